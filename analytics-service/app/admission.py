@@ -0,0 +1,239 @@
+"""Admission control and load shedding.
+
+API requests are split into route classes, each with its own concurrency
+limit, bounded queue and queue-time budget, so heavy endpoints (productivity,
+timeline pages, batches) cannot take every MongoDB connection from the cheap
+ones. A request that finds the queue full, or waits longer than its budget,
+is shed right away instead of queueing inside the Motor pool until the client
+gives up. It is answered with the last successful response to the same
+request when there is a recent one, and otherwise with ``503`` and
+``Retry-After``. Requests sent with ``X-Read-Consistency: strong`` get no
+stale fallback.
+
+Admitted requests run under ``pymongo.timeout()`` with what is left of their
+class's operation budget. Motor copies the context into its executor, so every
+MongoDB command the request issues is sent with ``maxTimeMS`` and gives up
+waiting for a pooled connection at the same deadline. A request that fails
+once its deadline has passed is shed like a queued one.
+
+Limits are per worker process. Streaming endpoints (NDJSON, Server-Sent
+Events, exports) are long-lived and are not limited.
+"""
+import asyncio
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+import orjson
+import pymongo
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.config import settings
+from app.telemetry import metrics_registry
+
+# Paths matched after the API prefix; everything else under it is "cheap"
+EXEMPT_ROUTES = re.compile(r"/analytics/(stream|projects/[^/]+/timeline/stream|admin/export/.*)$")
+HEAVY_ROUTES = re.compile(r"/analytics/(productivity|projects/batch|projects/[^/]+/timeline|admin/active-users/series)$")
+
+
+class RouteClass:
+    """Concurrency limit with a bounded FIFO queue and a queue-time budget"""
+
+    def __init__(self, name: str, limit: int, max_queue: int, queue_seconds: float, timeout_seconds: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_seconds = queue_seconds
+        self.timeout_seconds = timeout_seconds
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting at most ``queue_seconds``; False when the request should be shed"""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            return False
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        expiry = loop.call_later(self.queue_seconds, self._expire, waiter)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            # The client went away while queued; pass on a slot that was already handed over
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.release()
+            raise
+        finally:
+            expiry.cancel()
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def _expire(self, waiter: asyncio.Future):
+        if not waiter.done():
+            waiter.set_result(False)
+
+    def release(self):
+        # Hand the slot straight to the oldest waiter so newcomers cannot overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+
+def default_route_classes() -> Dict[str, RouteClass]:
+    return {
+        "cheap": RouteClass(
+            "cheap", settings.ADMISSION_CHEAP_CONCURRENCY, settings.ADMISSION_CHEAP_QUEUE,
+            settings.ADMISSION_CHEAP_QUEUE_MS / 1000, settings.ADMISSION_CHEAP_TIMEOUT_MS / 1000
+        ),
+        "heavy": RouteClass(
+            "heavy", settings.ADMISSION_HEAVY_CONCURRENCY, settings.ADMISSION_HEAVY_QUEUE,
+            settings.ADMISSION_HEAVY_QUEUE_MS / 1000, settings.ADMISSION_HEAVY_TIMEOUT_MS / 1000
+        ),
+    }
+
+
+class StaleResponses:
+    """Last successful JSON response per request (path, query and caller), for shedding only"""
+
+    def __init__(self, max_entries: int, max_age_seconds: float, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple, Tuple[float, List[Tuple[bytes, bytes]], bytes]]" = OrderedDict()
+
+    def put(self, key: Tuple, headers: List[Tuple[bytes, bytes]], body: bytes):
+        if self.max_entries <= 0 or len(body) > self.max_bytes:
+            return
+        self._entries[key] = (time.monotonic(), headers, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: Tuple) -> Optional[Tuple[int, List[Tuple[bytes, bytes]], bytes]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, headers, body = entry
+        age = time.monotonic() - stored_at
+        if age > self.max_age_seconds:
+            del self._entries[key]
+            return None
+        return int(age), headers, body
+
+
+def request_key(scope: Scope) -> Optional[Tuple]:
+    headers = Headers(scope=scope)
+    if (headers.get("x-read-consistency") or "").lower() == "strong":
+        return None  # read-your-writes requests are never answered from the stale cache
+    # The caller's credentials are part of the key, so a fallback never crosses users
+    return (
+        scope["path"], scope.get("query_string", b""),
+        headers.get("authorization"), headers.get("x-user-id"), headers.get("x-user-role"),
+    )
+
+
+class AdmissionControlMiddleware:
+    def __init__(
+        self,
+        app: ASGIApp,
+        route_classes: Optional[Dict[str, RouteClass]] = None,
+        stale: Optional[StaleResponses] = None,
+        prefix: Optional[str] = None,
+        retry_after_seconds: Optional[int] = None
+    ):
+        self.app = app
+        self.route_classes = route_classes or default_route_classes()
+        self.stale = stale if stale is not None else StaleResponses(
+            settings.ADMISSION_STALE_ENTRIES, settings.ADMISSION_STALE_MAX_AGE_SECONDS,
+            settings.ADMISSION_STALE_MAX_BYTES
+        )
+        self.prefix = prefix if prefix is not None else settings.API_V1_STR
+        self.retry_after_seconds = retry_after_seconds or settings.ADMISSION_RETRY_AFTER_SECONDS
+
+    def classify(self, path: str) -> Optional[str]:
+        if not path.startswith(self.prefix):
+            return None
+        path = path[len(self.prefix):]
+        if EXEMPT_ROUTES.match(path):
+            return None
+        return "heavy" if HEAVY_ROUTES.match(path) else "cheap"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        name = self.classify(scope["path"]) if scope["type"] == "http" else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = self.route_classes[name]
+        key = request_key(scope) if scope["method"] == "GET" else None
+        arrived = time.monotonic()
+        if not await route_class.acquire():
+            await self._shed(send, key, name, "queue")
+            return
+
+        deadline = arrived + route_class.timeout_seconds
+        shed = False
+        stored: Optional[List[Tuple[bytes, bytes]]] = None
+        body: List[bytes] = []
+
+        async def send_admitted(message: Message):
+            nonlocal shed, stored
+            if shed:
+                return
+            if message["type"] == "http.response.start":
+                if message["status"] >= 500 and time.monotonic() >= deadline:
+                    # Most likely a MongoDB timeout surfaced as an error by the handler
+                    shed = True
+                    await self._shed(send, key, name, "deadline")
+                    return
+                content_type = Headers(raw=message["headers"]).get("content-type", "")
+                if key is not None and message["status"] == 200 and content_type.startswith("application/json"):
+                    stored = list(message["headers"])
+            elif message["type"] == "http.response.body" and stored is not None:
+                body.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    self.stale.put(key, stored, b"".join(body))
+            await send(message)
+
+        try:
+            with pymongo.timeout(max(deadline - time.monotonic(), 0.001)):
+                await self.app(scope, receive, send_admitted)
+        finally:
+            route_class.release()
+
+    async def _shed(self, send: Send, key: Optional[Tuple], name: str, reason: str):
+        fallback = self.stale.get(key) if key is not None else None
+        if fallback is not None:
+            age, headers, body = fallback
+            metrics_registry.record_shed_request(name, reason, "stale")
+            response_headers = MutableHeaders(raw=list(headers))
+            response_headers["Age"] = str(age)
+            response_headers["X-Load-Shed"] = "stale"
+            await send({"type": "http.response.start", "status": 200, "headers": response_headers.raw})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        metrics_registry.record_shed_request(name, reason, "rejected")
+        body = orjson.dumps({"detail": "Service is overloaded, retry later"})
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(self.retry_after_seconds).encode()),
+                (b"x-load-shed", b"rejected"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,27 +1,113 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from typing import Dict, Any
+import asyncio
+import orjson
+from datetime import date, datetime, timedelta, timezone
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import APIRouter, Depends, Header, HTTPException, status, Request, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from typing import Dict, Any, Literal, Optional
 import structlog
-from app.auth import get_admin_user
-from app.services.analytics_service import AnalyticsService
+from app.auth import get_admin_user, get_platform_admin
+from app.api.conditional import (
+    build_validators, is_not_modified, not_modified_response, set_validators, split_version
+)
+from app.config import settings
+from app.export import zstd_ndjson_stream
+from app.rollups import align_window, as_utc, count_buckets
+from app.services.analytics_service import AnalyticsService, InvalidCursorError
+from app.services.live_updates import Subscription, live_update_hub
 from app.models import (
     DashboardResponse,
     ProjectAnalyticsResponse,
     TaskSummaryResponse,
-    ProductivityResponse
+    ProductivityResponse,
+    TimelinePageResponse,
+    BatchProjectAnalyticsRequest,
+    BatchProjectAnalyticsResponse,
+    LeaderboardResponse,
+    ActiveUsersResponse,
+    ActiveUserSeriesResponse
 )
 
 logger = structlog.get_logger()
 
+# Service results are trusted dicts: handlers return ORJSONResponse directly so
+# they are serialized once, while response_model still documents the schema.
+
+LeaderboardMetric = Literal["completions", "completion_rate", "recent_activity"]
+Granularity = Literal["hour", "day", "week", "month"]
+ExportCollection = Literal["task_events", "project_events", "user_metrics", "project_metrics"]
+
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 analytics_service = AnalyticsService()
 
 
+async def read_your_writes(x_read_consistency: Optional[str] = Header(None)) -> bool:
+    """``X-Read-Consistency: strong`` keeps secondary-routed reads on the primary"""
+    return (x_read_consistency or "").lower() == "strong"
+
+
+async def activity_window(
+    from_: Optional[datetime] = Query(None, alias="from", description="Window start (ISO 8601, UTC if naive)"),
+    to: Optional[datetime] = Query(None, description="Window end, exclusive (default: now)"),
+    granularity: Optional[Granularity] = Query(None, description="Bucket size (default: day)")
+) -> Optional[Dict[str, Any]]:
+    """Parse from/to/granularity into a bucket-aligned window; None when none are given"""
+    if from_ is None and to is None and granularity is None:
+        return None
+
+    granularity = granularity or "day"
+    end = as_utc(to) if to else datetime.now(timezone.utc)
+    start = as_utc(from_) if from_ else end - timedelta(days=settings.ROLLUP_DEFAULT_WINDOW_DAYS)
+    if start >= end:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="'from' must be before 'to'")
+
+    window = {**align_window(start, end, granularity), "granularity": granularity}
+    if count_buckets(window["start"], window["end"], granularity) > settings.ROLLUP_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Window spans more than {settings.ROLLUP_MAX_BUCKETS} {granularity} buckets, use a coarser granularity"
+        )
+    return window
+
+
+def window_key(window: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Volatile validator input identifying the requested window, None without one"""
+    if window is None:
+        return None
+    return f"{window['start'].isoformat()}/{window['end'].isoformat()}/{window['granularity']}"
+
+
 @router.get("/dashboard", response_model=DashboardResponse)
-async def get_dashboard(request: Request, current_user: dict = Depends(get_admin_user)):
-    """Get user dashboard metrics"""
+async def get_dashboard(
+    request: Request,
+    consistent: bool = Depends(read_your_writes),
+    window: Optional[Dict[str, Any]] = Depends(activity_window),
+    current_user: dict = Depends(get_admin_user)
+):
+    """Get user dashboard metrics and completion-time percentiles.
+
+    With from/to/granularity, also activity per bucket, and percentiles over that window.
+    """
     try:
-        dashboard_data = await analytics_service.get_user_dashboard(current_user["user_id"])
-        return DashboardResponse(**dashboard_data)
+        # Validators come from the same read as the body, so a cached body always matches its ETag
+        dashboard_data, version = split_version(
+            await analytics_service.get_user_dashboard(current_user["user_id"], consistent=consistent)
+        )
+        etag, last_modified = build_validators(
+            "dashboard", version, current_user["user_id"], volatile=[window_key(window)]
+        )
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        dashboard_data["completion_time"] = await analytics_service.get_completion_times(
+            current_user["user_id"], window=window, consistent=consistent
+        )
+        if window is not None:
+            dashboard_data["window"] = await analytics_service.get_activity_window(
+                current_user["user_id"], window, consistent=consistent
+            )
+        return set_validators(ORJSONResponse(dashboard_data), etag, last_modified)
     except Exception as e:
         logger.error("Error getting dashboard", error=str(e), user_id=current_user["user_id"])
         raise HTTPException(
@@ -30,14 +116,56 @@ async def get_dashboard(request: Request, current_user: dict = Depends(get_admin
         )
 
 
+@router.post("/projects/batch", response_model=BatchProjectAnalyticsResponse)
+async def get_projects_analytics(
+    batch_request: BatchProjectAnalyticsRequest,
+    request: Request,
+    current_user: dict = Depends(get_admin_user)
+):
+    """Get analytics summaries for several projects in one request"""
+    if len(batch_request.project_ids) > settings.BATCH_MAX_PROJECTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BATCH_MAX_PROJECTS} projects can be requested at once"
+        )
+
+    try:
+        batch_data = await analytics_service.get_projects_analytics(
+            batch_request.project_ids,
+            current_user["user_id"],
+            timeline_limit=batch_request.timeline_limit
+        )
+        return ORJSONResponse(batch_data)
+    except Exception as e:
+        logger.error("Error getting batch project analytics",
+                    error=str(e),
+                    user_id=current_user["user_id"],
+                    project_count=len(batch_request.project_ids))
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve project analytics"
+        )
+
+
 @router.get("/projects/{project_id}", response_model=ProjectAnalyticsResponse)
 async def get_project_analytics(
     project_id: int,
     request: Request,
+    window: Optional[Dict[str, Any]] = Depends(activity_window),
     current_user: dict = Depends(get_admin_user)
 ):
-    """Get analytics for a specific project"""
+    """Get analytics and completion-time percentiles for a specific project.
+
+    With from/to/granularity, also activity per bucket, and percentiles over that window.
+    """
     try:
+        version = await analytics_service.get_metrics_version(current_user["user_id"], project_id)
+        etag, last_modified = build_validators(
+            "project", version, current_user["user_id"], project_id, volatile=[window_key(window)]
+        )
+        if version is not None and is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
         project_data = await analytics_service.get_project_analytics(
             project_id, current_user["user_id"]
         )
@@ -47,8 +175,22 @@ async def get_project_analytics(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Project not found or access denied"
             )
+        # The response is validated by the metrics document its counters came from
+        project_data, version = split_version(project_data)
+        etag, last_modified = build_validators(
+            "project", version, current_user["user_id"], project_id, volatile=[window_key(window)]
+        )
         
-        return ProjectAnalyticsResponse(**project_data)
+        completion_time = await analytics_service.get_completion_times(
+            current_user["user_id"], project_id=project_id, window=window
+        )
+        project_data["completion_time"] = completion_time
+        project_data["avg_completion_time_hours"] = completion_time["mean_hours"]
+        if window is not None:
+            project_data["window"] = await analytics_service.get_activity_window(
+                current_user["user_id"], window, project_id=project_id
+            )
+        return set_validators(ORJSONResponse(project_data), etag, last_modified)
     except HTTPException:
         raise
     except Exception as e:
@@ -62,12 +204,130 @@ async def get_project_analytics(
         )
 
 
+@router.get("/projects/{project_id}/timeline", response_model=TimelinePageResponse)
+async def get_project_timeline(
+    project_id: int,
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=settings.TIMELINE_MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_admin_user)
+):
+    """Get a page of a project timeline; pass next_cursor back to fetch the following page"""
+    try:
+        # Version and events are both read on the primary, version first, so
+        # the page is never older than its ETag
+        version = await analytics_service.get_metrics_version(current_user["user_id"], project_id, consistent=True)
+        etag, last_modified = build_validators("timeline", version, current_user["user_id"], project_id, cursor, limit)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        timeline_page = await analytics_service.get_project_timeline(
+            project_id, current_user["user_id"], cursor=cursor, limit=limit
+        )
+        return set_validators(ORJSONResponse(timeline_page), etag, last_modified)
+    except InvalidCursorError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid timeline cursor"
+        )
+    except Exception as e:
+        logger.error("Error getting project timeline",
+                    error=str(e),
+                    user_id=current_user["user_id"],
+                    project_id=project_id)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve project timeline"
+        )
+
+
+@router.get("/projects/{project_id}/timeline/stream")
+async def stream_project_timeline(
+    project_id: int,
+    request: Request,
+    cursor: Optional[str] = None,
+    current_user: dict = Depends(get_admin_user)
+):
+    """Stream the full project timeline as NDJSON, one event per line"""
+    try:
+        events = analytics_service.stream_project_timeline(
+            project_id, current_user["user_id"], cursor=cursor
+        )
+    except InvalidCursorError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid timeline cursor"
+        )
+
+    async def ndjson_lines():
+        try:
+            async for event in events:
+                yield orjson.dumps(event) + b"\n"
+        except Exception as e:
+            # Headers are already sent; log and end the stream early
+            logger.error("Error streaming project timeline",
+                        error=str(e),
+                        user_id=current_user["user_id"],
+                        project_id=project_id)
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+
+@router.get("/stream")
+async def stream_live_updates(request: Request, current_user: dict = Depends(get_admin_user)):
+    """Push dashboard and project metric changes for the current user as Server-Sent Events"""
+    subscription = live_update_hub.subscribe(current_user["user_id"])
+    return StreamingResponse(
+        _live_update_events(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def _live_update_events(request: Request, subscription: Subscription):
+    """Format coalesced deltas as SSE frames, with heartbeats while idle"""
+    try:
+        yield _sse_frame("ready", {"status": live_update_hub.status})
+        while not await request.is_disconnected():
+            batch = await subscription.next_batch(timeout=settings.LIVE_UPDATES_HEARTBEAT_SECONDS)
+            if not batch:
+                yield b": keep-alive\n\n"
+                continue
+            for delta in batch:
+                yield _sse_frame(delta["type"], delta)
+            # Let bursts of updates coalesce before the next flush
+            await asyncio.sleep(settings.LIVE_UPDATES_COALESCE_SECONDS)
+    finally:
+        live_update_hub.unsubscribe(subscription)
+
+
+def _sse_frame(event: str, data: Dict[str, Any]) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
 @router.get("/tasks/summary", response_model=TaskSummaryResponse)
-async def get_task_summary(request: Request, current_user: dict = Depends(get_admin_user)):
-    """Get task completion metrics summary"""
+async def get_task_summary(
+    request: Request,
+    window: Optional[Dict[str, Any]] = Depends(activity_window),
+    current_user: dict = Depends(get_admin_user)
+):
+    """Get task completion metrics summary, with activity per bucket when from/to/granularity are given"""
     try:
-        summary_data = await analytics_service.get_task_summary(current_user["user_id"])
-        return TaskSummaryResponse(**summary_data)
+        version = await analytics_service.get_metrics_version(current_user["user_id"])
+        etag, last_modified = build_validators(
+            "summary", version, current_user["user_id"], volatile=[window_key(window)]
+        )
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        # The response is validated by the metrics document its counters came from
+        summary_data, version = split_version(await analytics_service.get_task_summary(current_user["user_id"]))
+        etag, last_modified = build_validators(
+            "summary", version, current_user["user_id"], volatile=[window_key(window)]
+        )
+        if window is not None:
+            summary_data["window"] = await analytics_service.get_activity_window(current_user["user_id"], window)
+        return set_validators(ORJSONResponse(summary_data), etag, last_modified)
     except Exception as e:
         logger.error("Error getting task summary", error=str(e), user_id=current_user["user_id"])
         raise HTTPException(
@@ -77,11 +337,31 @@ async def get_task_summary(request: Request, current_user: dict = Depends(get_ad
 
 
 @router.get("/productivity", response_model=ProductivityResponse)
-async def get_productivity_insights(request: Request, current_user: dict = Depends(get_admin_user)):
-    """Get user productivity insights and recommendations"""
+async def get_productivity_insights(
+    request: Request,
+    consistent: bool = Depends(read_your_writes),
+    window: Optional[Dict[str, Any]] = Depends(activity_window),
+    current_user: dict = Depends(get_admin_user)
+):
+    """Get user productivity insights and recommendations (last 30 days, or from/to/granularity)"""
     try:
-        productivity_data = await analytics_service.get_productivity_insights(current_user["user_id"])
-        return ProductivityResponse(**productivity_data)
+        # The 30 day window moves daily, so the date is part of the validator
+        today = datetime.now(timezone.utc).date().isoformat()
+        version = await analytics_service.get_metrics_version(current_user["user_id"], consistent=consistent)
+        etag, last_modified = build_validators(
+            "productivity", version, current_user["user_id"], volatile=[today, window_key(window)]
+        )
+        if is_not_modified(request, etag, last_modified):
+            return not_modified_response(etag, last_modified)
+
+        productivity_data, version = split_version(await analytics_service.get_productivity_insights(
+            current_user["user_id"], consistent=consistent, window=window
+        ))
+        # The lookup above only answers 304s; it may have been served by another member than the body
+        etag, last_modified = build_validators(
+            "productivity", version, current_user["user_id"], volatile=[today, window_key(window)]
+        )
+        return set_validators(ORJSONResponse(productivity_data), etag, last_modified)
     except Exception as e:
         logger.error("Error getting productivity insights", error=str(e), user_id=current_user["user_id"])
         raise HTTPException(
@@ -90,6 +370,141 @@ async def get_productivity_insights(request: Request, current_user: dict = Depen
         )
 
 
+@router.get("/admin/leaderboard/users", response_model=LeaderboardResponse)
+async def get_user_leaderboard(
+    request: Request,
+    metric: LeaderboardMetric = "completions",
+    limit: int = Query(10, ge=1, le=settings.LEADERBOARD_MAX_LIMIT),
+    current_user: dict = Depends(get_platform_admin)
+):
+    """Get the platform-wide top users (Admin only)"""
+    try:
+        leaderboard = await analytics_service.get_user_leaderboard(metric, limit)
+        return ORJSONResponse(leaderboard)
+    except Exception as e:
+        logger.error("Error getting user leaderboard", error=str(e), metric=metric)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve user leaderboard"
+        )
+
+
+@router.get("/admin/leaderboard/projects", response_model=LeaderboardResponse)
+async def get_project_leaderboard(
+    request: Request,
+    metric: LeaderboardMetric = "completions",
+    limit: int = Query(10, ge=1, le=settings.LEADERBOARD_MAX_LIMIT),
+    current_user: dict = Depends(get_platform_admin)
+):
+    """Get the platform-wide top projects (Admin only)"""
+    try:
+        leaderboard = await analytics_service.get_project_leaderboard(metric, limit)
+        return ORJSONResponse(leaderboard)
+    except Exception as e:
+        logger.error("Error getting project leaderboard", error=str(e), metric=metric)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve project leaderboard"
+        )
+
+
+async def active_user_window(window: Optional[Dict[str, Any]] = Depends(activity_window)) -> Dict[str, Any]:
+    """Activity window for active-user counts, which are kept per day and per month"""
+    if window is None:
+        end = datetime.now(timezone.utc)
+        start = end - timedelta(days=settings.ROLLUP_DEFAULT_WINDOW_DAYS)
+        window = {**align_window(start, end, "day"), "granularity": "day"}
+    if window["granularity"] == "hour":
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Active users are counted per day, use granularity day, week or month"
+        )
+    if window["granularity"] != "month" and window["end"] - window["start"] > timedelta(days=settings.ACTIVE_USERS_MAX_DAYS):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Windows longer than {settings.ACTIVE_USERS_MAX_DAYS} days need granularity=month"
+        )
+    return window
+
+
+@router.get("/admin/active-users", response_model=ActiveUsersResponse)
+async def get_active_users(
+    project_id: Optional[int] = Query(None, description="Count a single project's users instead of the platform's"),
+    current_user: dict = Depends(get_platform_admin)
+):
+    """Get approximate DAU, WAU and MAU for today (UTC), platform-wide or for a project (Admin only)"""
+    try:
+        active_users = await analytics_service.get_active_users(project_id)
+        return ORJSONResponse(active_users)
+    except Exception as e:
+        logger.error("Error getting active users", error=str(e), project_id=project_id)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve active users"
+        )
+
+
+@router.get("/admin/active-users/series", response_model=ActiveUserSeriesResponse)
+async def get_active_user_series(
+    project_id: Optional[int] = Query(None, description="Count a single project's users instead of the platform's"),
+    window: Dict[str, Any] = Depends(active_user_window),
+    current_user: dict = Depends(get_platform_admin)
+):
+    """Get approximate distinct active users per bucket and over the whole from/to window (Admin only)"""
+    try:
+        series = await analytics_service.get_active_user_series(window, project_id)
+        return ORJSONResponse(series)
+    except Exception as e:
+        logger.error("Error getting active user series", error=str(e), project_id=project_id)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to retrieve active users"
+        )
+
+
+@router.get("/admin/export/{collection}")
+async def export_collection(
+    collection: ExportCollection,
+    day: Optional[date] = Query(None, description="Only this UTC day (a single partition)"),
+    after_timestamp: Optional[datetime] = Query(None, description="Resume after this time field value..."),
+    after_id: Optional[str] = Query(None, description="...and _id, taken from the last line received"),
+    current_user: dict = Depends(get_platform_admin)
+):
+    """Stream a collection as zstd-compressed NDJSON in (time, _id) order (Admin only)"""
+    if (after_timestamp is None) != (after_id is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="after_timestamp and after_id must be given together"
+        )
+    after = None
+    if after_id is not None:
+        try:
+            after = (as_utc(after_timestamp), ObjectId(after_id))
+        except InvalidId:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid after_id")
+
+    start = end = None
+    if day is not None:
+        start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+    batches = analytics_service.export_batches(collection, after, start, end)
+
+    async def compressed():
+        try:
+            async for chunk in zstd_ndjson_stream(batches):
+                yield chunk
+        except Exception as e:
+            # Headers are already sent; log and end the stream early
+            logger.error("Error streaming export", error=str(e), collection=collection)
+
+    filename = f"{collection}-{day.isoformat() if day else 'all'}.ndjson.zst"
+    return StreamingResponse(
+        compressed(),
+        media_type="application/zstd",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @router.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -0,0 +1,87 @@
+"""Conditional GET support for analytics responses.
+
+Validators are derived from the ``version`` counter and ``updated_at`` field
+the analytics worker maintains on ``user_metrics``, ``project_metrics`` and
+``user_dashboard``, so an unchanged resource is answered with ``304 Not
+Modified`` after a single lookup instead of rebuilding the response. A full
+response carries validators built from the version read together with its
+body, never from that separate lookup: with reads routed to secondaries the
+two can be served by different members, and a body from a staler member must
+not be cached under a newer ETag.
+"""
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional, Sequence, Tuple
+from fastapi import Request, Response
+
+
+def build_validators(
+    scope: str, version: Optional[Dict[str, Any]], *parts: Any, volatile: Sequence[Any] = ()
+) -> Tuple[str, Optional[datetime]]:
+    """Build a weak ETag and Last-Modified for a resource.
+
+    ``scope`` names the resource, ``version`` is the projected metrics document
+    (or None when no metrics exist yet) and ``parts`` are any other inputs the
+    response depends on, such as the user id. ``volatile`` inputs (the current
+    date, a rollup window; None entries are ignored) can change the response
+    while ``updated_at`` stays put: they go into the ETag only, and no
+    Last-Modified is returned, so If-Modified-Since is not honoured for them.
+    """
+    version = version or {}
+    updated_at = version.get("updated_at")
+    if updated_at is not None and updated_at.tzinfo is None:
+        # MongoDB returns naive datetimes in UTC
+        updated_at = updated_at.replace(tzinfo=timezone.utc)
+    volatile = [part for part in volatile if part is not None]
+
+    fingerprint = "|".join(
+        str(part) for part in (
+            scope, *parts, *volatile, version.get("version", 0), updated_at.isoformat() if updated_at else ""
+        )
+    )
+    etag = 'W/"' + hashlib.sha1(fingerprint.encode()).hexdigest()[:20] + '"'
+    return etag, None if volatile else updated_at
+
+
+def split_version(data: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Separate the ``version`` and ``updated_at`` a service read returned from the response body"""
+    body = {key: value for key, value in data.items() if key not in ("version", "updated_at")}
+    return body, {"version": data.get("version", 0), "updated_at": data.get("updated_at")}
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    """Evaluate If-None-Match, falling back to If-Modified-Since when it is absent"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+        # Weak comparison: W/"x" matches "x"
+        opaque = etag[2:] if etag.startswith("W/") else etag
+        return "*" in candidates or any(
+            (candidate[2:] if candidate.startswith("W/") else candidate) == opaque
+            for candidate in candidates
+        )
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have one-second resolution
+        return last_modified.replace(microsecond=0) <= since
+
+    return False
+
+
+def set_validators(response: Response, etag: str, last_modified: Optional[datetime]) -> Response:
+    """Attach validators and ask clients to revalidate on every use"""
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "private, no-cache"
+    if last_modified is not None:
+        response.headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return response
+
+
+def not_modified_response(etag: str, last_modified: Optional[datetime]) -> Response:
+    return set_validators(Response(status_code=304), etag, last_modified)
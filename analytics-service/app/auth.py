@@ -34,4 +34,17 @@ async def get_admin_user(request: Request) -> dict:
     #         detail="Forbidden: Admin role required"
     #     )
     
-    return user
\ No newline at end of file
+    return user
+
+
+async def get_platform_admin(request: Request) -> dict:
+    """Get current user and require the Admin role, for platform-wide endpoints"""
+    user = await get_current_user_from_headers(request)
+
+    if user.get("role") != "Admin":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Forbidden: Admin role required"
+        )
+
+    return user
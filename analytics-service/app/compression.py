@@ -0,0 +1,141 @@
+"""Negotiated gzip/brotli response compression.
+
+Like Starlette's ``GZipMiddleware`` but also offers brotli (when the optional
+``brotli`` package is installed) and leaves streamed responses incremental by
+flushing the compressor after every chunk. Server-Sent Events and responses
+that are already encoded pass through untouched.
+"""
+import zlib
+from typing import Optional
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+UNCOMPRESSED_CONTENT_TYPES = ("text/event-stream", "application/zstd")
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick ``br`` or ``gzip`` from an Accept-Encoding header, honouring q=0"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        parts = [part.strip() for part in item.split(";")]
+        if not parts[0]:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        accepted[parts[0].lower()] = quality
+
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress and flush so the client can decode everything sent so far"""
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH)
+
+
+class CompressionMiddleware:
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream = send
+        self.start_message: Optional[Message] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            # Hold the headers until the first body chunk tells us the size
+            self.start_message = message
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or content_type.startswith(UNCOMPRESSED_CONTENT_TYPES)
+                or message["status"] in (204, 304)
+            )
+            return
+
+        if message["type"] != "http.response.body":
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+            if self.passthrough or (not more_body and len(body) < self.middleware.minimum_size):
+                self.passthrough = True
+                await self.downstream(start_message)
+                await self.downstream(message)
+                return
+
+            self.compressor = _Compressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+            headers = MutableHeaders(raw=start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                body = self.compressor.chunk(body)
+            else:
+                body = self.compressor.finish(body)
+                headers["Content-Length"] = str(len(body))
+            await self.downstream(start_message)
+            await self.downstream({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+
+        if self.passthrough:
+            await self.downstream(message)
+            return
+
+        body = self.compressor.chunk(body) if more_body else self.compressor.finish(body)
+        await self.downstream({"type": "http.response.body", "body": body, "more_body": more_body})
@@ -0,0 +1,324 @@
+"""Streaming bulk export of analytics collections to compressed, day-partitioned files.
+
+Documents are read through a Motor cursor sorted by ``(time field, _id)`` in
+batches of ``EXPORT_BATCH_SIZE`` and written straight to the current part file,
+so memory stays constant whatever the size of the collection. Files are laid
+out as::
+
+    <output>/<collection>/date=YYYY-MM-DD/part-<first _id>.ndjson.zst
+    <output>/<collection>/date=YYYY-MM-DD/part-<first _id>.parquet
+
+A part is written to a ``.tmp`` file and renamed when its day ends, when it
+reaches ``EXPORT_PART_MAX_ROWS`` rows or when the export finishes. Only then is
+``<output>/<collection>/_watermark.json`` advanced to its last ``(time, _id)``,
+so an interrupted export resumes after the last complete part without
+duplicating or losing documents. NDJSON keeps whole documents; Parquet keeps
+the columns in ``PARQUET_COLUMNS`` and needs the ``pyarrow`` package.
+
+Usage:
+    python -m app.export                                   # every collection, zstd NDJSON
+    python -m app.export --collection task_events --format parquet --output /data/exports
+    python -m app.export --collection task_events --reset  # start again from the beginning
+"""
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import orjson
+import structlog
+import zstandard
+from bson import ObjectId
+from app.config import settings
+from app.rollups import as_utc
+
+logger = structlog.get_logger()
+
+# Exportable collections and the time field they are partitioned and resumed by
+EXPORT_COLLECTIONS = {
+    "task_events": "timestamp",
+    "project_events": "timestamp",
+    "user_metrics": "updated_at",
+    "project_metrics": "updated_at",
+}
+FORMATS = ("ndjson", "parquet")
+EXTENSIONS = {"ndjson": ".ndjson.zst", "parquet": ".parquet"}
+
+PARQUET_COLUMNS = {
+    "task_events": [
+        ("_id", "string"), ("event", "string"), ("task_id", "int64"), ("project_id", "int64"),
+        ("user_id", "string"), ("username", "string"), ("title", "string"), ("status", "string"),
+        ("timestamp", "timestamp"),
+    ],
+    "project_events": [
+        ("_id", "string"), ("event", "string"), ("project_id", "int64"), ("user_id", "string"),
+        ("username", "string"), ("name", "string"), ("timestamp", "timestamp"),
+    ],
+    "user_metrics": [
+        ("_id", "string"), ("user_id", "string"), ("username", "string"), ("total_tasks", "int64"),
+        ("completed_tasks", "int64"), ("active_projects", "int64"), ("completion_rate", "float64"),
+        ("avg_completion_time_hours", "float64"), ("last_activity", "timestamp"), ("version", "int64"),
+        ("created_at", "timestamp"), ("updated_at", "timestamp"),
+    ],
+    "project_metrics": [
+        ("_id", "string"), ("project_id", "int64"), ("user_id", "string"), ("username", "string"),
+        ("project_name", "string"), ("total_tasks", "int64"), ("completed_tasks", "int64"),
+        ("completion_rate", "float64"), ("avg_completion_time_hours", "float64"),
+        ("created_at_project", "timestamp"), ("last_activity", "timestamp"), ("version", "int64"),
+        ("created_at", "timestamp"), ("updated_at", "timestamp"),
+    ],
+}
+
+# Lower bound for the time field: matches only documents where it is a date
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+Position = Tuple[datetime, ObjectId]
+
+
+def export_filter(
+    time_field: str,
+    after: Optional[Position] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Dict[str, Any]:
+    """Documents in [start, end) by time field, strictly after the ``(time, _id)`` position"""
+    time_range: Dict[str, Any] = {"$gte": start or _EPOCH}
+    if end is not None:
+        time_range["$lt"] = end
+    query: Dict[str, Any] = {time_field: time_range}
+    if after is not None:
+        timestamp, document_id = after
+        query["$or"] = [
+            {time_field: {"$gt": timestamp}},
+            {time_field: timestamp, "_id": {"$gt": document_id}},
+        ]
+    return query
+
+
+async def iterate_batches(
+    database,
+    collection: str,
+    after: Optional[Position] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: Optional[int] = None
+) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yield the collection's documents in ``(time, _id)`` order, one cursor batch at a time"""
+    time_field = EXPORT_COLLECTIONS[collection]
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+    cursor = database[collection].find(
+        export_filter(time_field, after, start, end), batch_size=batch_size
+    ).sort([(time_field, 1), ("_id", 1)])
+    batch: List[Dict[str, Any]] = []
+    try:
+        async for document in cursor:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        cursor.close()
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def ndjson_lines(documents: List[Dict[str, Any]]) -> bytes:
+    return b"".join(
+        orjson.dumps(document, default=_default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_APPEND_NEWLINE)
+        for document in documents
+    )
+
+
+async def zstd_ndjson_stream(batches: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    """Compress NDJSON batches into one zstd frame, flushing a block per batch"""
+    compressor = zstandard.ZstdCompressor(level=settings.EXPORT_ZSTD_LEVEL).compressobj()
+    async for batch in batches:
+        chunk = compressor.compress(ndjson_lines(batch)) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+class NdjsonPart:
+    """zstd-compressed NDJSON part file"""
+
+    def __init__(self, path: str, collection: str):
+        self._file = open(path, "wb")
+        self._writer = zstandard.ZstdCompressor(level=settings.EXPORT_ZSTD_LEVEL).stream_writer(self._file)
+
+    def write(self, documents: List[Dict[str, Any]]):
+        self._writer.write(ndjson_lines(documents))
+
+    def close(self):
+        self._writer.close()  # also closes the file
+
+
+class ParquetPart:
+    """Parquet part file with zstd-compressed row groups, one per batch"""
+
+    def __init__(self, path: str, collection: str):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError("Parquet exports need the pyarrow package") from e
+
+        types = {
+            "string": pyarrow.string(),
+            "int64": pyarrow.int64(),
+            "float64": pyarrow.float64(),
+            "timestamp": pyarrow.timestamp("ms", tz="UTC"),
+        }
+        self._pyarrow = pyarrow
+        self._columns = PARQUET_COLUMNS[collection]
+        self._schema = pyarrow.schema([(name, types[kind]) for name, kind in self._columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression="zstd")
+
+    def _row(self, document: Dict[str, Any]) -> Dict[str, Any]:
+        row = {}
+        for name, kind in self._columns:
+            value = document.get(name)
+            if value is not None:
+                if kind == "string":
+                    value = str(value)
+                elif kind == "timestamp":
+                    value = as_utc(value)
+            row[name] = value
+        return row
+
+    def write(self, documents: List[Dict[str, Any]]):
+        table = self._pyarrow.Table.from_pylist([self._row(document) for document in documents], self._schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+
+
+PART_WRITERS = {"ndjson": NdjsonPart, "parquet": ParquetPart}
+
+
+def _watermark_path(output: str, collection: str) -> str:
+    return os.path.join(output, collection, "_watermark.json")
+
+
+def load_watermark(output: str, collection: str) -> Optional[Position]:
+    try:
+        with open(_watermark_path(output, collection)) as f:
+            watermark = json.load(f)
+    except FileNotFoundError:
+        return None
+    return datetime.fromisoformat(watermark["time"]), ObjectId(watermark["_id"])
+
+
+def save_watermark(output: str, collection: str, position: Position):
+    path = _watermark_path(output, collection)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"time": position[0].isoformat(), "_id": str(position[1])}, f)
+    os.replace(path + ".tmp", path)
+
+
+class _OpenPart:
+    def __init__(self, output: str, collection: str, fmt: str, day: str, first_id: ObjectId):
+        directory = os.path.join(output, collection, f"date={day}")
+        os.makedirs(directory, exist_ok=True)
+        self.day = day
+        self.path = os.path.join(directory, f"part-{first_id}{EXTENSIONS[fmt]}")
+        self.writer = PART_WRITERS[fmt](self.path + ".tmp", collection)
+        self.rows = 0
+        self.last: Optional[Position] = None
+
+    def write(self, documents: List[Dict[str, Any]], time_field: str):
+        self.writer.write(documents)
+        self.rows += len(documents)
+        self.last = (documents[-1][time_field], documents[-1]["_id"])
+
+    def commit(self):
+        self.writer.close()
+        os.replace(self.path + ".tmp", self.path)
+
+
+async def export_collection(
+    database,
+    collection: str,
+    output: str,
+    fmt: str = "ndjson",
+    batch_size: Optional[int] = None,
+    part_max_rows: Optional[int] = None
+) -> Dict[str, int]:
+    """Export new documents of a collection after its watermark; returns rows and parts written"""
+    time_field = EXPORT_COLLECTIONS[collection]
+    part_max_rows = part_max_rows or settings.EXPORT_PART_MAX_ROWS
+    os.makedirs(os.path.join(output, collection), exist_ok=True)
+    after = load_watermark(output, collection)
+    stats = {"rows": 0, "parts": 0}
+    part: Optional[_OpenPart] = None
+
+    def commit():
+        part.commit()
+        save_watermark(output, collection, part.last)
+        stats["rows"] += part.rows
+        stats["parts"] += 1
+        logger.info("Export part written", collection=collection, path=part.path, rows=part.rows)
+
+    try:
+        async for batch in iterate_batches(database, collection, after, batch_size=batch_size):
+            # Split the batch where the day changes, the part is full or the batch ends
+            pending: List[Dict[str, Any]] = []
+            for document in batch:
+                day = as_utc(document[time_field]).date().isoformat()
+                if part is not None and (day != part.day or part.rows + len(pending) >= part_max_rows):
+                    if pending:
+                        part.write(pending, time_field)
+                        pending = []
+                    commit()
+                    part = None
+                if part is None:
+                    part = _OpenPart(output, collection, fmt, day, document["_id"])
+                pending.append(document)
+            if pending:
+                part.write(pending, time_field)
+        if part is not None:
+            commit()
+            part = None
+    finally:
+        if part is not None:
+            # Interrupted: drop the incomplete part, the watermark still points before it
+            part.writer.close()
+            os.remove(part.path + ".tmp")
+
+    return stats
+
+
+async def _main(collections: List[str], output: str, fmt: str, reset: bool) -> Dict[str, Dict[str, int]]:
+    from app.database import ANALYTICS, connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        # Exports are long sequential scans, so they read from a secondary when there is one
+        database = get_database(ANALYTICS)
+        results = {}
+        for collection in collections:
+            if reset and os.path.exists(_watermark_path(output, collection)):
+                os.remove(_watermark_path(output, collection))
+            results[collection] = await export_collection(database, collection, output, fmt)
+        return results
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export analytics collections to day-partitioned compressed files")
+    parser.add_argument("--collection", action="append", choices=sorted(EXPORT_COLLECTIONS),
+                        help="collection to export (repeatable, default: all)")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--output", default=settings.EXPORT_DIR)
+    parser.add_argument("--reset", action="store_true", help="ignore the watermark and export everything")
+    args = parser.parse_args()
+    print(asyncio.run(_main(args.collection or list(EXPORT_COLLECTIONS), args.output, args.format, args.reset)))
@@ -0,0 +1,209 @@
+"""Index manifest shared by the analytics API service and the analytics worker.
+
+Both services keep an identical copy of this module (like ``models.py``) so the
+set of indexes on the analytics database is declared exactly once per release.
+Keys follow the fields documents are actually written with (``timestamp``,
+``event``) and are ordered equality -> sort -> range for the queries issued by
+``AnalyticsService``.
+
+``SHARD_KEYS`` declares how each collection is distributed when the database
+runs on a sharded cluster (``python -m app.sharding`` applies it). Per-user
+data is sharded on a hashed ``user_id``: every dashboard, project, timeline
+and window query, and every worker write, filters on one user and is routed
+to a single shard, while the hash spreads users (and the unbounded
+``task_events``) evenly. Unique indexes on sharded collections must start
+with the shard key field. Small platform-wide collections (``active_users``,
+rollup watermarks, ``cohort_retention``) stay unsharded on the primary shard.
+"""
+import argparse
+import asyncio
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING, HASHED
+import structlog
+
+logger = structlog.get_logger()
+
+
+INDEX_MANIFEST: Dict[str, List[Dict[str, Any]]] = {
+    "task_events": [
+        # Dashboard recent activity: {user_id} sorted by timestamp desc
+        {"keys": [("user_id", ASCENDING), ("timestamp", DESCENDING)]},
+        # Project timeline: {user_id, project_id} keyset-paginated over (timestamp, _id)
+        {"keys": [("user_id", ASCENDING), ("project_id", ASCENDING), ("timestamp", ASCENDING), ("_id", ASCENDING)]},
+        # Recent completions / productivity: {user_id, event, status} + timestamp sort or range
+        {"keys": [("user_id", ASCENDING), ("event", ASCENDING), ("status", ASCENDING), ("timestamp", DESCENDING)]},
+        # Creation event of a completed task (completion-time sketches), scoped to its user
+        {"keys": [("user_id", ASCENDING), ("task_id", ASCENDING)]},
+        # Bulk export: the whole collection in (timestamp, _id) order, resumed from a watermark
+        {"keys": [("timestamp", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "project_events": [
+        {"keys": [("user_id", ASCENDING), ("timestamp", DESCENDING)]},
+        {"keys": [("project_id", ASCENDING)]},
+        {"keys": [("timestamp", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "user_metrics": [
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+        # Admin leaderboards walk these sorted keys and stop after N entries
+        {"keys": [("last_activity", DESCENDING)]},
+        {"keys": [("completed_tasks", DESCENDING), ("completion_rate", DESCENDING)]},
+        {"keys": [("completion_rate", DESCENDING), ("completed_tasks", DESCENDING)]},
+        # Bulk export of changed metrics, in (updated_at, _id) order
+        {"keys": [("updated_at", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "project_metrics": [
+        # Single project lookups and batch {user_id, project_id: {$in: [...]}} lookups
+        {"keys": [("user_id", ASCENDING), ("project_id", ASCENDING)], "unique": True},
+        {"keys": [("user_id", ASCENDING), ("last_activity", DESCENDING)]},
+        {"keys": [("last_activity", DESCENDING)]},
+        {"keys": [("completed_tasks", DESCENDING), ("completion_rate", DESCENDING)]},
+        {"keys": [("completion_rate", DESCENDING), ("completed_tasks", DESCENDING)]},
+        {"keys": [("updated_at", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    "task_rollups": [
+        # Window reads: {user_id, project_id, granularity} + bucket range; also the upsert key
+        {"keys": [("user_id", ASCENDING), ("project_id", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+         "unique": True},
+        # Compaction scans one level's closed buckets across all users
+        {"keys": [("granularity", ASCENDING), ("bucket", ASCENDING)]},
+        # Hours flagged by late events, found by compaction without scanning every hour
+        {"keys": [("refold", ASCENDING)], "partialFilterExpression": {"refold": True}},
+    ],
+    "task_created_at": [
+        # Creation time lookups by task; also the upsert key
+        {"keys": [("user_id", ASCENDING), ("task_id", ASCENDING)], "unique": True},
+    ],
+    "completion_sketches": [
+        # Day-range and all-time sketch reads; also the insert key that detects concurrent writers
+        {"keys": [("user_id", ASCENDING), ("project_id", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+         "unique": True},
+    ],
+    "active_users": [
+        # Register sets per {project_id (None for the platform), granularity}, read by bucket range
+        {"keys": [("project_id", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)], "unique": True},
+    ],
+    "user_productivity": [
+        # Written by the worker's batch analytics job, one document per user
+        {"keys": [("user_id", ASCENDING)], "unique": True},
+    ],
+}
+
+
+SHARD_KEYS: Dict[str, List[Tuple[str, Any]]] = {
+    "task_events": [("user_id", HASHED)],
+    "project_events": [("user_id", HASHED)],
+    "user_metrics": [("user_id", HASHED)],
+    "project_metrics": [("user_id", HASHED)],
+    "user_dashboard": [("_id", HASHED)],  # _id is the user_id
+    "task_rollups": [("user_id", HASHED)],
+    "completion_sketches": [("user_id", HASHED)],
+    "task_created_at": [("user_id", HASHED)],
+    "user_productivity": [("user_id", HASHED)],
+}
+
+
+def key_signature(keys) -> Tuple[Tuple[str, Any], ...]:
+    """Normalize an index key pattern so manifest and server entries compare equal"""
+    signature = []
+    for field, direction in keys:
+        if isinstance(direction, (int, float)):
+            direction = int(direction)
+        signature.append((field, direction))
+    return tuple(signature)
+
+
+def format_keys(keys) -> str:
+    """Render a key pattern the way mongosh prints it, for logs and reports"""
+    return "{" + ", ".join(f"{field}: {direction}" for field, direction in key_signature(keys)) + "}"
+
+
+async def reconcile_indexes(
+    database,
+    drop_unused: bool = False,
+    progress: Optional[Callable[[int, int, str], None]] = None
+) -> Dict[str, List[str]]:
+    """Create indexes missing from the manifest and report (or drop) extra ones.
+
+    ``progress`` is called with ``(completed, total, index)`` after each manifest
+    entry is checked or built. Returns a report with ``created``, ``unused``,
+    ``dropped`` and ``mismatched`` entries formatted as ``collection {keys}``.
+    """
+    report: Dict[str, List[str]] = {"created": [], "unused": [], "dropped": [], "mismatched": []}
+    total = sum(len(specs) for specs in INDEX_MANIFEST.values())
+    completed = 0
+
+    for collection_name, specs in INDEX_MANIFEST.items():
+        collection = database[collection_name]
+        existing = await collection.index_information()
+
+        present = {}
+        for name, info in existing.items():
+            if name == "_id_":
+                continue
+            present[key_signature(info["key"])] = (name, info)
+
+        # The shard key index is created by app.sharding and can never be dropped
+        shard_key = SHARD_KEYS.get(collection_name)
+        if shard_key is not None:
+            present.pop(key_signature(shard_key), None)
+
+        wanted = set()
+        for spec in specs:
+            signature = key_signature(spec["keys"])
+            wanted.add(signature)
+            label = f"{collection_name} {format_keys(spec['keys'])}"
+
+            if signature in present:
+                _, info = present[signature]
+                if bool(info.get("unique", False)) != bool(spec.get("unique", False)):
+                    report["mismatched"].append(label)
+            else:
+                options = {key: value for key, value in spec.items() if key != "keys"}
+                await collection.create_index(spec["keys"], **options)
+                report["created"].append(label)
+
+            completed += 1
+            if progress:
+                progress(completed, total, label)
+
+        for signature, (name, info) in present.items():
+            if signature in wanted:
+                continue
+            label = f"{collection_name} {format_keys(info['key'])}"
+            report["unused"].append(label)
+            if drop_unused:
+                await collection.drop_index(name)
+                report["dropped"].append(label)
+
+    logger.info("Index reconciliation finished",
+                created=len(report["created"]),
+                unused=report["unused"],
+                dropped=len(report["dropped"]),
+                mismatched=report["mismatched"])
+    return report
+
+
+async def _main(drop_unused: bool):
+    from app.database import connect_to_mongo, close_mongo_connection, get_database
+
+    def report_progress(completed: int, total: int, index: str):
+        print(f"[{completed}/{total}] {index}")
+
+    from app.timeseries import ensure_event_collections
+
+    await connect_to_mongo()
+    try:
+        await ensure_event_collections(get_database())
+        report = await reconcile_indexes(get_database(), drop_unused=drop_unused, progress=report_progress)
+        for kind, entries in report.items():
+            for entry in entries:
+                print(f"{kind:>10}  {entry}")
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile MongoDB indexes with the analytics index manifest")
+    parser.add_argument("--drop-unused", action="store_true", help="drop indexes that are not in the manifest")
+    args = parser.parse_args()
+    asyncio.run(_main(args.drop_unused))
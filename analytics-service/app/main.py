@@ -2,30 +2,20 @@ import asyncio
 import structlog
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
-from app.database import connect_to_mongo, close_mongo_connection
+from app.logging_config import configure_logging
+from app.admission import AdmissionControlMiddleware
+from app.compression import CompressionMiddleware
+from app.telemetry import TimingMiddleware, metrics_registry
+from app.database import connect_to_mongo, close_mongo_connection, start_index_management, get_readiness, get_database
+from app.services.live_updates import live_update_hub
 
 from app.api.analytics import router as analytics_router
 
-# Configure structured logging
-structlog.configure(
-    processors=[
-        structlog.stdlib.filter_by_level,
-        structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer()
-    ],
-    context_class=dict,
-    logger_factory=structlog.stdlib.LoggerFactory(),
-    wrapper_class=structlog.stdlib.BoundLogger,
-    cache_logger_on_first_use=True,
-)
+# Configure structured logging, written to stdout by a background thread
+configure_logging()
 
 logger = structlog.get_logger()
 
@@ -37,8 +27,13 @@ async def lifespan(app: FastAPI):
     logger.info("Starting Analytics API Service")
     
     try:
-        # Connect to MongoDB
+        # Connect to MongoDB; indexes are reconciled without holding up readiness
         await connect_to_mongo()
+        await start_index_management()
+        
+        # One change stream per process feeds every live dashboard connection
+        if settings.LIVE_UPDATES_ENABLED:
+            live_update_hub.start(get_database())
         logger.info("Analytics API Service started successfully")
         
         yield
@@ -50,6 +45,7 @@ async def lifespan(app: FastAPI):
     finally:
         # Shutdown
         logger.info("Shutting down Analytics API Service")
+        await live_update_hub.stop()
         await close_mongo_connection()
 
 
@@ -61,9 +57,15 @@ app = FastAPI(
     openapi_url="/api/v1/openapi.json",
     docs_url="/api/v1/docs",
     redoc_url="/api/v1/redoc",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Shed load per route class before requests queue on the MongoDB pool; inside CORS
+# and compression so rejections carry CORS headers and stale fallbacks get compressed
+if settings.ADMISSION_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -73,6 +75,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress JSON and NDJSON responses above the size threshold (brotli or gzip)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+    gzip_level=settings.COMPRESSION_GZIP_LEVEL,
+    brotli_quality=settings.COMPRESSION_BROTLI_QUALITY
+)
+
+# Outermost so route latency and Server-Timing cover the whole stack
+app.add_middleware(TimingMiddleware, registry=metrics_registry)
+
 # Include routers
 app.include_router(analytics_router, prefix=settings.API_V1_STR)
 
@@ -89,8 +102,23 @@ async def root():
 
 @app.get("/health")
 async def health():
-    """Health check endpoint"""
-    return {"status": "ok", "service": "analytics-service"}
+    """Readiness check: 200 while ready or degraded (indexes still building), 503 without a database"""
+    readiness = get_readiness()
+    status_code = 503 if readiness["status"] == "unavailable" else 200
+    return ORJSONResponse(
+        status_code=status_code,
+        content={
+            "status": readiness["status"],
+            "service": "analytics-service",
+            "checks": {**readiness["checks"], "live_updates": live_update_hub.status}
+        }
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Route and MongoDB command latency in Prometheus text format"""
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
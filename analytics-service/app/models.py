@@ -41,6 +41,7 @@ class UserMetrics(BaseModel):
     completion_rate: float = 0.0
     avg_completion_time_hours: Optional[float] = None
     last_activity: Optional[datetime] = None
+    version: int = 0  # Incremented by the worker on every change, used for ETags
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -56,16 +57,35 @@ class ProjectMetrics(BaseModel):
     avg_completion_time_hours: Optional[float] = None
     created_at_project: datetime
     last_activity: Optional[datetime] = None
+    version: int = 0  # Incremented by the worker on every change, used for ETags
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+class ActivityWindow(BaseModel):
+    from_: str = Field(..., alias="from")
+    to: str
+    granularity: str
+    totals: Dict[str, int]
+    series: List[Dict[str, Any]]
+
+
+class CompletionTimeStats(BaseModel):
+    count: int
+    mean_hours: Optional[float] = None
+    p50_hours: Optional[float] = None
+    p90_hours: Optional[float] = None
+    p99_hours: Optional[float] = None
+
+
 class DashboardResponse(BaseModel):
     total_tasks: int
     completed_tasks: int
     active_projects: int
     completion_rate: float
     recent_activity: List[Dict[str, Any]]
+    completion_time: Optional[CompletionTimeStats] = None
+    window: Optional[ActivityWindow] = None
 
 
 class ProductivityResponse(BaseModel):
@@ -73,6 +93,7 @@ class ProductivityResponse(BaseModel):
     weekly_summary: Dict[str, Any]
     productivity_score: float
     recommendations: List[str]
+    window: Optional[ActivityWindow] = None
 
 
 class ProjectAnalyticsResponse(BaseModel):
@@ -84,6 +105,38 @@ class ProjectAnalyticsResponse(BaseModel):
     avg_completion_time_hours: Optional[float]
     task_distribution: Dict[str, int]
     timeline: List[Dict[str, Any]]
+    timeline_next_cursor: Optional[str] = None
+    completion_time: Optional[CompletionTimeStats] = None
+    window: Optional[ActivityWindow] = None
+
+
+class BatchProjectAnalyticsRequest(BaseModel):
+    project_ids: List[int] = Field(..., min_length=1)
+    timeline_limit: int = Field(5, ge=0, le=50)
+
+
+class ProjectSummaryResponse(BaseModel):
+    project_id: int
+    project_name: str
+    total_tasks: int
+    completed_tasks: int
+    completion_rate: float
+    avg_completion_time_hours: Optional[float]
+    task_distribution: Dict[str, int]
+    event_count: int
+    last_activity: Optional[str]
+    recent_timeline: List[Dict[str, Any]]
+
+
+class BatchProjectAnalyticsResponse(BaseModel):
+    projects: List[ProjectSummaryResponse]
+    missing_project_ids: List[int]
+
+
+class TimelinePageResponse(BaseModel):
+    project_id: int
+    events: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
 
 
 class TaskSummaryResponse(BaseModel):
@@ -92,4 +145,27 @@ class TaskSummaryResponse(BaseModel):
     pending_tasks: int
     completion_rate: float
     tasks_by_status: Dict[str, int]
-    recent_completions: List[Dict[str, Any]]
\ No newline at end of file
+    recent_completions: List[Dict[str, Any]]
+    window: Optional[ActivityWindow] = None
+
+
+class LeaderboardResponse(BaseModel):
+    metric: str
+    entries: List[Dict[str, Any]]
+
+
+class ActiveUsersResponse(BaseModel):
+    project_id: Optional[int] = None
+    as_of: str
+    dau: int
+    wau: int
+    mau: int
+
+
+class ActiveUserSeriesResponse(BaseModel):
+    project_id: Optional[int] = None
+    from_: str = Field(..., alias="from")
+    to: str
+    granularity: str
+    active_users: int
+    series: List[Dict[str, Any]]
@@ -0,0 +1,282 @@
+"""Explain-based checks that every query issued by AnalyticsService uses an index.
+
+``ANALYTICS_QUERIES`` mirrors the filter/sort shape of each query in
+``app/services/analytics_service.py``; keep the two in sync when queries change.
+Aggregations list their ``$match`` as ``filter`` and the remaining stages as
+``pipeline``, and are explained as the whole pipeline.
+On a sharded cluster every query must also be routed to a single shard, unless
+it is marked ``scatter`` (platform-wide admin queries, merged by ``mongos``).
+Run against a live database with ``python -m app.query_plans``.
+"""
+import asyncio
+import sys
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+from bson import ObjectId
+import structlog
+from app.indexes import INDEX_MANIFEST, SHARD_KEYS
+
+logger = structlog.get_logger()
+
+
+ANALYTICS_QUERIES: List[Dict[str, Any]] = [
+    {
+        "name": "dashboard.materialized",
+        "collection": "user_dashboard",
+        "filter": {"_id": "1"},
+    },
+    {
+        "name": "dashboard.user_metrics",
+        "collection": "user_metrics",
+        "filter": {"user_id": "1"},
+    },
+    {
+        "name": "dashboard.recent_activity",
+        "collection": "task_events",
+        "filter": {"user_id": "1"},
+        "sort": [("timestamp", -1)],
+        "limit": 10,
+    },
+    {
+        "name": "project.metrics",
+        "collection": "project_metrics",
+        "filter": {"project_id": 1, "user_id": "1"},
+    },
+    {
+        "name": "project.timeline",
+        "collection": "task_events",
+        "filter": {"project_id": 1, "user_id": "1"},
+        "sort": [("timestamp", 1), ("_id", 1)],
+        "limit": 101,
+    },
+    {
+        "name": "project.timeline_page",
+        "collection": "task_events",
+        "filter": {
+            "project_id": 1,
+            "user_id": "1",
+            # Keyset cursor: events after the last (timestamp, _id) of the previous page
+            "$or": [
+                {"timestamp": {"$gt": datetime.now(timezone.utc) - timedelta(days=1)}},
+                {"timestamp": datetime.now(timezone.utc) - timedelta(days=1), "_id": {"$gt": ObjectId()}},
+            ],
+        },
+        "sort": [("timestamp", 1), ("_id", 1)],
+        "limit": 101,
+    },
+    {
+        "name": "projects.batch_metrics",
+        "collection": "project_metrics",
+        "filter": {"user_id": "1", "project_id": {"$in": [1, 2]}},
+    },
+    {
+        # Explained as the aggregate it is: the filter is its $match stage
+        "name": "projects.batch_activity",
+        "collection": "task_events",
+        "filter": {"user_id": "1", "project_id": {"$in": [1, 2]}},
+        "pipeline": [
+            {"$group": {
+                "_id": "$project_id",
+                "event_count": {"$sum": 1},
+                "last_activity": {"$max": "$timestamp"},
+                "recent_timeline": {"$topN": {
+                    "n": 5,
+                    "sortBy": {"timestamp": -1, "_id": -1},
+                    "output": {"event": "$event", "task_id": "$task_id", "title": "$title", "timestamp": "$timestamp"},
+                }},
+            }},
+        ],
+    },
+    {
+        "name": "admin.user_leaderboard",
+        "collection": "user_metrics",
+        "filter": {},
+        "scatter": True,
+        "sort": [("completed_tasks", -1), ("completion_rate", -1)],
+        "limit": 10,
+    },
+    {
+        "name": "admin.project_leaderboard",
+        "collection": "project_metrics",
+        "filter": {},
+        "scatter": True,
+        "sort": [("last_activity", -1)],
+        "limit": 10,
+    },
+    {
+        "name": "summary.recent_completions",
+        "collection": "task_events",
+        "filter": {"user_id": "1", "status": "completed", "event": "task_updated"},
+        "sort": [("timestamp", -1)],
+        "limit": 5,
+    },
+    {
+        "name": "productivity.completions",
+        "collection": "task_events",
+        "filter": {
+            "user_id": "1",
+            "timestamp": {"$gte": datetime.now(timezone.utc) - timedelta(days=30)},
+            "event": "task_updated",
+            "status": "completed",
+        },
+    },
+    {
+        "name": "rollups.window",
+        "collection": "task_rollups",
+        "filter": {
+            "user_id": "1",
+            "project_id": None,
+            "granularity": "day",
+            "bucket": {"$gte": datetime.now(timezone.utc) - timedelta(days=30)},
+        },
+    },
+    {
+        "name": "sketches.window",
+        "collection": "completion_sketches",
+        "filter": {
+            "user_id": "1",
+            "project_id": 1,
+            "granularity": "day",
+            "bucket": {"$gte": datetime.now(timezone.utc) - timedelta(days=30)},
+        },
+    },
+    {
+        "name": "active_users.window",
+        "collection": "active_users",
+        "filter": {
+            "project_id": None,
+            "granularity": "day",
+            "bucket": {"$gte": datetime.now(timezone.utc) - timedelta(days=30)},
+        },
+    },
+]
+
+
+def plan_stages(plan: Dict[str, Any]) -> Iterator[str]:
+    """Yield every stage name in an explain plan tree (classic, SBE and sharded layouts)"""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("queryPlan", "inputStage", "winningPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for key in ("inputStages", "shards"):
+        for child in plan.get(key, []):
+            yield from plan_stages(child)
+
+
+def manifest_index_for(query: Dict[str, Any]) -> Optional[List]:
+    """Return the manifest index that serves a query shape, or None.
+
+    An index serves the query when its leading fields are exactly the
+    equality predicates, followed by the sort fields and then range fields.
+    """
+    equality = {field for field, value in query["filter"].items()
+                if not field.startswith("$") and not isinstance(value, dict)}
+    if equality == {"_id"}:
+        return [("_id", 1)]  # every collection's default index
+    ranges = [field for field, value in query["filter"].items() if isinstance(value, dict)]
+    # Fields of $or clauses (keyset cursors) bound the same index after the equality prefix
+    ranges += [field for clause in query["filter"].get("$or", []) for field in clause]
+    trailing = [field for field, _ in query.get("sort", [])]
+    trailing += [field for field in dict.fromkeys(ranges) if field not in trailing]
+
+    for spec in INDEX_MANIFEST.get(query["collection"], []):
+        fields = [field for field, _ in spec["keys"]]
+        if set(fields[:len(equality)]) != equality:
+            continue
+        rest = fields[len(equality):]
+        if rest[:len(trailing)] == trailing:
+            return spec["keys"]
+    return None
+
+
+def shard_key_targeted(query: Dict[str, Any]) -> bool:
+    """Whether mongos can route a query shape to one shard: equality on the shard key field"""
+    shard_key = SHARD_KEYS.get(query["collection"])
+    if shard_key is None:
+        return True  # unsharded collections live on the database's primary shard
+    value = query["filter"].get(shard_key[0][0])
+    return value is not None and not isinstance(value, dict)
+
+
+def aggregate_winning_plan(explanation: Dict[str, Any]) -> Dict[str, Any]:
+    """The find-style winning plan of an aggregate explain, whichever layout the server returned"""
+    if "queryPlanner" in explanation:
+        # The whole pipeline was pushed down into the query layer
+        return explanation["queryPlanner"]["winningPlan"]
+    if "stages" in explanation:
+        return explanation["stages"][0]["$cursor"]["queryPlanner"]["winningPlan"]
+    # Through mongos: one entry per shard the pipeline was sent to
+    shards = [aggregate_winning_plan(shard) for shard in explanation["shards"].values()]
+    return {"stage": "SINGLE_SHARD" if len(shards) == 1 else "SHARD_MERGE", "shards": shards}
+
+
+async def explain_query(database, query: Dict[str, Any]) -> Dict[str, Any]:
+    """Explain one query shape and summarize whether it is index-backed"""
+    if "pipeline" in query:
+        explanation = await database.command(
+            "explain",
+            {
+                "aggregate": query["collection"],
+                "pipeline": [{"$match": query["filter"]}, *query["pipeline"]],
+                "cursor": {},
+            },
+            verbosity="queryPlanner",
+        )
+        winning_plan = aggregate_winning_plan(explanation)
+    else:
+        cursor = database[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        if query.get("limit"):
+            cursor = cursor.limit(query["limit"])
+        explanation = await cursor.explain()
+        winning_plan = explanation["queryPlanner"]["winningPlan"]
+
+    stages = list(plan_stages(winning_plan))
+    return {
+        "name": query["name"],
+        "collection": query["collection"],
+        "stages": stages,
+        # _id lookups show up as IDHACK (or EXPRESS_IXSCAN on 8.0) rather than IXSCAN
+        "uses_index": bool({"IXSCAN", "IDHACK", "EXPRESS_IXSCAN"} & set(stages)) and "COLLSCAN" not in stages,
+        # Through mongos the root stage is SINGLE_SHARD, or SHARD_MERGE(_SORT) when every shard is asked
+        "targeted": winning_plan.get("stage") not in ("SHARD_MERGE", "SHARD_MERGE_SORT"),
+    }
+
+
+async def check_query_plans(database) -> List[Dict[str, Any]]:
+    """Explain every AnalyticsService query; log and return the ones that do not use an index
+    or, on a sharded cluster, are sent to every shard without being marked ``scatter``"""
+    failures = []
+    for query in ANALYTICS_QUERIES:
+        result = await explain_query(database, query)
+        if not result["uses_index"]:
+            logger.warning("Query is not index-backed", query=result["name"], stages=result["stages"])
+            failures.append(result)
+        elif not result["targeted"] and not query.get("scatter"):
+            logger.warning("Query is sent to every shard", query=result["name"], stages=result["stages"])
+            failures.append(result)
+    return failures
+
+
+async def _main() -> int:
+    from app.database import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        failures = await check_query_plans(get_database())
+    finally:
+        await close_mongo_connection()
+
+    for failure in failures:
+        kind = "COLLSCAN" if not failure["uses_index"] else "SCATTER "
+        print(f"{kind}  {failure['name']} ({failure['collection']}): {' -> '.join(failure['stages'])}")
+    print(f"{len(ANALYTICS_QUERIES) - len(failures)}/{len(ANALYTICS_QUERIES)} queries use an index and are targeted")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
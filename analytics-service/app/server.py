@@ -0,0 +1,53 @@
+"""Production entry point for the Analytics API.
+
+Runs ``app.main:app`` under uvicorn with one worker process per available CPU
+(or ``WEB_CONCURRENCY``), uvloop and the httptools parser. Every worker runs
+the application lifespan on its own, so each process gets its own Motor pool
+sized by the ``MONGODB_*_POOL_SIZE`` settings and pre-warmed at startup.
+
+Usage:
+    python -m app.server
+"""
+import os
+import uvicorn
+from app.config import settings
+
+
+def available_cpus() -> int:
+    """CPUs this process may use, honouring affinity and cgroup CPU quotas"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    # Containers limited with --cpus expose the quota in cgroup v2 cpu.max ("max 100000" when unlimited)
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, max(1, int(quota) // int(period)))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+def worker_count() -> int:
+    return settings.WEB_CONCURRENCY if settings.WEB_CONCURRENCY > 0 else available_cpus()
+
+
+def main():
+    uvicorn.run(
+        "app.main:app",
+        host=settings.HOST,
+        port=settings.PORT,
+        workers=worker_count(),
+        loop="uvloop",
+        http="httptools",
+        proxy_headers=True,
+        reload=False,
+        log_level=settings.LOG_LEVEL
+    )
+
+
+if __name__ == "__main__":
+    main()
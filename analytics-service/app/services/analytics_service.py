@@ -1,27 +1,117 @@
+import base64
+import json
 from datetime import datetime, timezone, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 from collections import defaultdict
+from bson import ObjectId
+from bson.errors import InvalidId
 import structlog
-from app.database import get_database
+from app.config import RAW_EVENTS_WINDOW_DAYS, settings
+from app.database import ANALYTICS, PRIMARY, get_database
 from app.models import TaskEvent, ProjectEvent, UserMetrics, ProjectMetrics
+from app.export import iterate_batches
+from app.services.single_flight import SingleFlight, coalesce
+from app.hyperloglog import HyperLogLog, read_registers, union
+from app.rollups import bucket_start, next_bucket, read_series, summarize_window
+from app.sketches import read_completion_times, summarize_sketch
 
 logger = structlog.get_logger()
 
+TIMELINE_SORT = [("timestamp", 1), ("_id", 1)]
+
+# Fields conditional responses are validated with (see app.api.conditional)
+VERSION_PROJECTION = {"_id": 0, "version": 1, "updated_at": 1}
+
+# Each ordering matches a descending index on user_metrics and project_metrics,
+# so top-N reads walk the index and stop after N documents
+LEADERBOARD_SORTS = {
+    "completions": [("completed_tasks", -1), ("completion_rate", -1)],
+    "completion_rate": [("completion_rate", -1), ("completed_tasks", -1)],
+    "recent_activity": [("last_activity", -1)],
+}
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a timeline cursor cannot be decoded"""
+
+
+def encode_timeline_cursor(event: Dict[str, Any]) -> str:
+    """Encode the (timestamp, _id) position of an event as an opaque cursor"""
+    position = {"t": event["timestamp"].isoformat(), "id": str(event["_id"])}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_timeline_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Decode a cursor produced by encode_timeline_cursor"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(position["t"]), ObjectId(position["id"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise InvalidCursorError(f"Invalid timeline cursor: {cursor}") from e
+
 
 class AnalyticsService:
     def __init__(self):
-        self.db = None
+        self.databases: Dict[str, Any] = {}
+        self.flights = SingleFlight()
 
-    def _get_db(self):
-        """Get database instance"""
-        if self.db is None:
-            self.db = get_database()
-        return self.db
+    def _get_db(self, profile: str = PRIMARY):
+        """Get database instance for a read profile (see app.database)"""
+        if self.databases.get(profile) is None:
+            self.databases[profile] = get_database(profile)
+        return self.databases[profile]
 
-    async def get_user_dashboard(self, user_id: int) -> Dict[str, Any]:
-        """Get dashboard metrics for a user"""
-        db = self._get_db()
-        
+    def _read_profile(self, consistent: bool) -> str:
+        """Read-your-writes requests stay on the primary, others may use a secondary"""
+        return PRIMARY if consistent else ANALYTICS
+
+    @coalesce
+    async def get_metrics_version(
+        self, user_id: int, project_id: Optional[int] = None, consistent: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """Get the version counter and updated_at of a user's (or project's) metrics.
+
+        A projected single-document lookup on the unique metrics index, used to
+        answer conditional requests without rebuilding the response. Pass the
+        same ``consistent`` flag as the read it validates.
+        """
+        db = self._get_db(self._read_profile(consistent))
+        if project_id is None:
+            return await db.user_metrics.find_one({"user_id": str(user_id)}, VERSION_PROJECTION)
+        return await db.project_metrics.find_one(
+            {"user_id": str(user_id), "project_id": project_id}, VERSION_PROJECTION
+        )
+
+    @coalesce
+    async def get_user_dashboard(self, user_id: int, consistent: bool = False) -> Dict[str, Any]:
+        """Get dashboard metrics for a user, from a secondary unless ``consistent``.
+
+        One primary-key read of the ``user_dashboard`` document the worker
+        maintains. Users it has not written one for yet (no task event since
+        it started doing so) are assembled from ``user_metrics`` and the
+        latest ``task_events`` instead. Either way ``version`` and
+        ``updated_at`` come from the document the counters were read from,
+        for the caller to build validators with.
+        """
+        db = self._get_db(self._read_profile(consistent))
+        dashboard = await db.user_dashboard.find_one({"_id": str(user_id)})
+        if dashboard is not None:
+            return {
+                "total_tasks": dashboard["total_tasks"],
+                "completed_tasks": dashboard["completed_tasks"],
+                "active_projects": dashboard.get("active_projects", 0),
+                "completion_rate": dashboard["completion_rate"],
+                "recent_activity": [
+                    {**activity, "timestamp": activity["timestamp"].isoformat()}
+                    for activity in dashboard.get("recent_activity", [])
+                ],
+                "version": dashboard.get("version", 0),
+                "updated_at": dashboard.get("updated_at")
+            }
+        return await self._assemble_dashboard(db, user_id)
+
+    async def _assemble_dashboard(self, db, user_id: int) -> Dict[str, Any]:
         # Try with string user_id first (most likely format in MongoDB)
         user_metrics = await db.user_metrics.find_one({"user_id": str(user_id)})
 
@@ -59,11 +149,18 @@ class AnalyticsService:
             "completed_tasks": user_metrics["completed_tasks"],
             "active_projects": user_metrics["active_projects"],
             "completion_rate": user_metrics["completion_rate"],
-            "recent_activity": recent_activity
+            "recent_activity": recent_activity,
+            "version": user_metrics.get("version", 0),
+            "updated_at": user_metrics.get("updated_at")
         }
 
+    @coalesce
     async def get_project_analytics(self, project_id: int, user_id: int) -> Dict[str, Any]:
-        """Get analytics for a specific project"""
+        """Get analytics for a specific project.
+
+        ``version`` and ``updated_at`` come from the metrics document the
+        counters were read from, for the caller to build validators with.
+        """
         db = self._get_db()
         
         # Get project metrics - use string user_id
@@ -75,22 +172,83 @@ class AnalyticsService:
         if project_metrics is None:
             return None
 
-        # Get task events for timeline - use string user_id
-        task_events = await db.task_events.find(
-            {"project_id": project_id, "user_id": str(user_id)}
-        ).sort("timestamp", 1).to_list(100)
+        # First page of the timeline; later pages come from get_project_timeline
+        timeline_page = await self.get_project_timeline(project_id, user_id, limit=settings.TIMELINE_PAGE_SIZE)
+        timeline = timeline_page["events"]
 
-        # Build timeline
-        timeline = [
-            {
-                "event_type": event["event"],
-                "task_id": event["task_id"],
-                "timestamp": event["timestamp"].isoformat(),
-                "task_title": event["title"]
+        return {
+            **self._project_summary(project_metrics),
+            "timeline": timeline,
+            "timeline_next_cursor": timeline_page["next_cursor"],
+            "version": project_metrics.get("version", 0),
+            "updated_at": project_metrics.get("updated_at")
+        }
+
+    @coalesce
+    async def get_projects_analytics(
+        self,
+        project_ids: List[int],
+        user_id: int,
+        timeline_limit: int = 5
+    ) -> Dict[str, Any]:
+        """Get summaries for several projects with one metrics query and one grouped event query"""
+        db = self._get_db()
+        project_ids = list(dict.fromkeys(project_ids))
+
+        metrics_by_project = {
+            metrics["project_id"]: metrics
+            for metrics in await db.project_metrics.find({
+                "user_id": str(user_id),
+                "project_id": {"$in": project_ids}
+            }).to_list(len(project_ids))
+        }
+
+        activity_by_project = {}
+        if metrics_by_project:
+            group: Dict[str, Any] = {
+                "_id": "$project_id",
+                "event_count": {"$sum": 1},
+                "last_activity": {"$max": "$timestamp"}
             }
-            for event in task_events
-        ]
+            if timeline_limit > 0:
+                group["recent_timeline"] = {
+                    "$topN": {
+                        "n": timeline_limit,
+                        "sortBy": {"timestamp": -1, "_id": -1},
+                        "output": {
+                            "event": "$event",
+                            "task_id": "$task_id",
+                            "title": "$title",
+                            "timestamp": "$timestamp"
+                        }
+                    }
+                }
+            activity = await db.task_events.aggregate([
+                {"$match": {"user_id": str(user_id), "project_id": {"$in": list(metrics_by_project)}}},
+                {"$group": group}
+            ]).to_list(len(metrics_by_project))
+            activity_by_project = {entry["_id"]: entry for entry in activity}
+
+        projects = []
+        for project_id in project_ids:
+            project_metrics = metrics_by_project.get(project_id)
+            if project_metrics is None:
+                continue
+            activity = activity_by_project.get(project_id, {})
+            last_activity = activity.get("last_activity")
+            projects.append({
+                **self._project_summary(project_metrics),
+                "event_count": activity.get("event_count", 0),
+                "last_activity": last_activity.isoformat() if last_activity else None,
+                "recent_timeline": [self._timeline_event(event) for event in activity.get("recent_timeline", [])]
+            })
+
+        return {
+            "projects": projects,
+            "missing_project_ids": [project_id for project_id in project_ids if project_id not in metrics_by_project]
+        }
 
+    def _project_summary(self, project_metrics: Dict[str, Any]) -> Dict[str, Any]:
         # Task distribution by status (simplified)
         task_distribution = {
             "completed": project_metrics["completed_tasks"],
@@ -104,12 +262,85 @@ class AnalyticsService:
             "completed_tasks": project_metrics["completed_tasks"],
             "completion_rate": project_metrics["completion_rate"],
             "avg_completion_time_hours": project_metrics.get("avg_completion_time_hours"),
-            "task_distribution": task_distribution,
-            "timeline": timeline
+            "task_distribution": task_distribution
+        }
+
+    async def get_project_timeline(
+        self,
+        project_id: int,
+        user_id: int,
+        cursor: Optional[str] = None,
+        limit: int = 50
+    ) -> Dict[str, Any]:
+        """Get one page of a project timeline, keyset-paginated over (timestamp, _id)"""
+        db = self._get_db()
+
+        # Fetch one extra event to know whether another page exists
+        task_events = await db.task_events.find(
+            self._timeline_filter(project_id, user_id, cursor)
+        ).sort(TIMELINE_SORT).limit(limit + 1).to_list(limit + 1)
+
+        next_cursor = None
+        if len(task_events) > limit:
+            task_events = task_events[:limit]
+            next_cursor = encode_timeline_cursor(task_events[-1])
+
+        return {
+            "project_id": project_id,
+            "events": [self._timeline_event(event) for event in task_events],
+            "next_cursor": next_cursor
+        }
+
+    def stream_project_timeline(
+        self,
+        project_id: int,
+        user_id: int,
+        cursor: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a project timeline as the Motor cursor produces batches.
+
+        The cursor argument is validated before the stream starts so callers
+        can reject bad input before sending a response. Every event carries
+        its own ``cursor`` to resume an interrupted stream.
+        """
+        db = self._get_db()
+        events = db.task_events.find(
+            self._timeline_filter(project_id, user_id, cursor),
+            batch_size=settings.TIMELINE_STREAM_BATCH_SIZE
+        ).sort(TIMELINE_SORT)
+        return self._iterate_timeline(events)
+
+    async def _iterate_timeline(self, events) -> AsyncIterator[Dict[str, Any]]:
+        try:
+            async for event in events:
+                timeline_event = self._timeline_event(event)
+                timeline_event["cursor"] = encode_timeline_cursor(event)
+                yield timeline_event
+        finally:
+            events.close()
+
+    def _timeline_filter(self, project_id: int, user_id: int, cursor: Optional[str]) -> Dict[str, Any]:
+        """Build the timeline query, continuing after the cursor position if given"""
+        query: Dict[str, Any] = {"user_id": str(user_id), "project_id": project_id}
+        if cursor:
+            timestamp, event_id = decode_timeline_cursor(cursor)
+            query["$or"] = [
+                {"timestamp": {"$gt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$gt": event_id}}
+            ]
+        return query
+
+    def _timeline_event(self, event: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "event_type": event["event"],
+            "task_id": event["task_id"],
+            "timestamp": event["timestamp"].isoformat(),
+            "task_title": event.get("title")
         }
 
+    @coalesce
     async def get_task_summary(self, user_id: int) -> Dict[str, Any]:
-        """Get task summary for a user"""
+        """Get task summary for a user, with the ``version`` and ``updated_at`` of the metrics it was read from"""
         db = self._get_db()
         
         user_metrics = await db.user_metrics.find_one({"user_id": str(user_id)})
@@ -120,7 +351,9 @@ class AnalyticsService:
                 "pending_tasks": 0,
                 "completion_rate": 0.0,
                 "tasks_by_status": {"completed": 0, "pending": 0},
-                "recent_completions": []
+                "recent_completions": [],
+                "version": 0,
+                "updated_at": None
             }
 
         pending_tasks = user_metrics["total_tasks"] - user_metrics["completed_tasks"]
@@ -134,7 +367,7 @@ class AnalyticsService:
             {
                 "task_id": event["task_id"],
                 "project_id": event["project_id"],
-                "title": event["title"],
+                "title": event.get("title"),
                 "completed_at": event["timestamp"].isoformat()
             }
             for event in recent_completions
@@ -149,22 +382,88 @@ class AnalyticsService:
                 "completed": user_metrics["completed_tasks"],
                 "pending": pending_tasks
             },
-            "recent_completions": recent_completions_data
+            "recent_completions": recent_completions_data,
+            "version": user_metrics.get("version", 0),
+            "updated_at": user_metrics.get("updated_at")
         }
 
-    async def get_productivity_insights(self, user_id: int) -> Dict[str, Any]:
-        """Get productivity insights for a user"""
-        db = self._get_db()
-        
+    @coalesce
+    async def get_activity_window(
+        self,
+        user_id: int,
+        window: Dict[str, Any],
+        project_id: Optional[int] = None,
+        consistent: bool = True
+    ) -> Dict[str, Any]:
+        """Get task activity counters per bucket for an aligned window.
+
+        ``window`` holds ``start``, ``end`` and ``granularity`` (see
+        ``app.rollups.align_window``). Served from the worker's rollups, so the
+        cost grows with the number of buckets rather than events.
+        """
+        db = self._get_db(self._read_profile(consistent))
+        series = await read_series(
+            db, str(user_id), project_id, window["granularity"], window["start"], window["end"]
+        )
+        return summarize_window(series, window["granularity"], window["start"], window["end"])
+
+    @coalesce
+    async def get_completion_times(
+        self,
+        user_id: int,
+        project_id: Optional[int] = None,
+        window: Optional[Dict[str, Any]] = None,
+        consistent: bool = True
+    ) -> Dict[str, Any]:
+        """Get completion-time count, mean and p50/p90/p99 in hours.
+
+        Merged from the worker's per-day DDSketches over ``window``, or read
+        from the all-time sketch without one. Estimates are within 1% of the
+        exact percentiles.
+        """
+        db = self._get_db(self._read_profile(consistent))
+        start, end = (window["start"], window["end"]) if window is not None else (None, None)
+        sketch = await read_completion_times(db, str(user_id), project_id, start, end)
+        return summarize_sketch(sketch)
+
+    @coalesce
+    async def get_productivity_insights(
+        self,
+        user_id: int,
+        consistent: bool = False,
+        window: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Get productivity insights for a user, from a secondary unless ``consistent``.
+
+        Without a ``window`` this covers the last 30 days of raw events; with
+        one, completions per bucket come from the rollups. The ``version`` and
+        ``updated_at`` of the user's metrics are read first, in the same
+        causally consistent session as the events, so whichever members serve
+        the reads the body is never older than the validators built from them.
+        """
+        db = self._get_db(self._read_profile(consistent))
+        async with await db.client.start_session(causal_consistency=True) as session:
+            version = await db.user_metrics.find_one(
+                {"user_id": str(user_id)}, VERSION_PROJECTION, session=session
+            ) or {}
+            if window is not None:
+                insights = await self._windowed_productivity(db, user_id, window, session)
+            else:
+                insights = await self._recent_productivity(db, user_id, session)
+        insights["version"] = version.get("version", 0)
+        insights["updated_at"] = version.get("updated_at")
+        return insights
+
+    async def _recent_productivity(self, db, user_id: int, session) -> Dict[str, Any]:
         # Get task events from last 30 days
-        thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
+        window_start = datetime.now(timezone.utc) - timedelta(days=RAW_EVENTS_WINDOW_DAYS)
         
         task_events = await db.task_events.find({
             "user_id": str(user_id),
-            "timestamp": {"$gte": thirty_days_ago},
+            "timestamp": {"$gte": window_start},
             "event": "task_updated",
             "status": "completed"
-        }).to_list(1000)
+        }, session=session).to_list(1000)
 
         # Calculate daily completions
         daily_completions = defaultdict(int)
@@ -174,8 +473,30 @@ class AnalyticsService:
 
         # Calculate weekly summary
         total_completions = len(task_events)
-        avg_daily = total_completions / 30 if total_completions > 0 else 0
+        avg_daily = total_completions / RAW_EVENTS_WINDOW_DAYS if total_completions > 0 else 0
         
+        return self._productivity(daily_completions, total_completions, avg_daily)
+
+    async def _windowed_productivity(self, db, user_id: int, window: Dict[str, Any], session) -> Dict[str, Any]:
+        series = await read_series(
+            db, str(user_id), None, window["granularity"], window["start"], window["end"], session=session
+        )
+        activity = summarize_window(series, window["granularity"], window["start"], window["end"])
+        label_length = 16 if window["granularity"] == "hour" else 10  # "YYYY-MM-DDTHH:MM" or "YYYY-MM-DD"
+
+        completions = {
+            bucket["bucket"][:label_length]: bucket["completed"]
+            for bucket in activity["series"] if bucket["completed"]
+        }
+        total_completions = activity["totals"]["completed"]
+        days = (window["end"] - window["start"]).total_seconds() / 86400
+        avg_daily = total_completions / days if total_completions > 0 else 0
+
+        insights = self._productivity(completions, total_completions, avg_daily)
+        insights["window"] = activity
+        return insights
+
+    def _productivity(self, daily_completions: Dict[str, int], total_completions: int, avg_daily: float) -> Dict[str, Any]:
         # Simple productivity score (0-100)
         productivity_score = min(100, avg_daily * 20)  # Scale appropriately
         
@@ -197,4 +518,111 @@ class AnalyticsService:
             },
             "productivity_score": round(productivity_score, 1),
             "recommendations": recommendations
-        }
\ No newline at end of file
+        }
+
+    @coalesce
+    async def get_user_leaderboard(self, metric: str, limit: int = 10) -> Dict[str, Any]:
+        """Get the platform-wide top users for a leaderboard metric"""
+        db = self._get_db(ANALYTICS)
+
+        users = await db.user_metrics.find(
+            {},
+            {"_id": 0, "user_id": 1, "username": 1, "total_tasks": 1,
+             "completed_tasks": 1, "completion_rate": 1, "last_activity": 1}
+        ).sort(LEADERBOARD_SORTS[metric]).limit(limit).to_list(limit)
+
+        return {"metric": metric, "entries": self._ranked(users)}
+
+    @coalesce
+    async def get_project_leaderboard(self, metric: str, limit: int = 10) -> Dict[str, Any]:
+        """Get the platform-wide top projects for a leaderboard metric"""
+        db = self._get_db(ANALYTICS)
+
+        projects = await db.project_metrics.find(
+            {},
+            {"_id": 0, "project_id": 1, "project_name": 1, "user_id": 1, "username": 1,
+             "total_tasks": 1, "completed_tasks": 1, "completion_rate": 1, "last_activity": 1}
+        ).sort(LEADERBOARD_SORTS[metric]).limit(limit).to_list(limit)
+
+        return {"metric": metric, "entries": self._ranked(projects)}
+
+    @coalesce
+    async def get_active_users(
+        self, project_id: Optional[int] = None, as_of: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """Get approximate daily, weekly and monthly active users as of a UTC day.
+
+        WAU and MAU cover the 7 and 30 days up to and including ``as_of``,
+        unioned from the worker's daily HyperLogLog registers.
+        """
+        db = self._get_db(ANALYTICS)
+        day = bucket_start(as_of or datetime.now(timezone.utc), "day")
+        end = day + timedelta(days=1)
+        daily = await read_registers(db, project_id, "day", end - timedelta(days=30), end)
+
+        return {
+            "project_id": project_id,
+            "as_of": day.date().isoformat(),
+            "dau": union(sketch for bucket, sketch in daily.items() if bucket == day).estimate(),
+            "wau": union(sketch for bucket, sketch in daily.items() if bucket >= end - timedelta(days=7)).estimate(),
+            "mau": union(daily.values()).estimate()
+        }
+
+    @coalesce
+    async def get_active_user_series(
+        self, window: Dict[str, Any], project_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Get approximate distinct active users per bucket and over a whole aligned window.
+
+        Day and week buckets are unioned from the daily registers, month
+        buckets read the monthly ones, so the cost depends on the number of
+        buckets only.
+        """
+        db = self._get_db(ANALYTICS)
+        granularity = window["granularity"]
+        level = "month" if granularity == "month" else "day"
+        registers = await read_registers(db, project_id, level, window["start"], window["end"])
+
+        buckets: Dict[datetime, HyperLogLog] = {}
+        for bucket, sketch in registers.items():
+            buckets.setdefault(bucket_start(bucket, granularity), HyperLogLog()).merge(sketch)
+
+        series = []
+        bucket = window["start"]
+        while bucket < window["end"]:
+            series.append({
+                "bucket": bucket.isoformat(),
+                "active_users": buckets[bucket].estimate() if bucket in buckets else 0
+            })
+            bucket = next_bucket(bucket, granularity)
+
+        return {
+            "project_id": project_id,
+            "from": window["start"].isoformat(),
+            "to": window["end"].isoformat(),
+            "granularity": granularity,
+            "active_users": union(registers.values()).estimate(),
+            "series": series
+        }
+
+    def export_batches(
+        self,
+        collection: str,
+        after: Optional[Tuple[datetime, ObjectId]] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Stream a collection in (time, _id) order in cursor-sized batches (see app.export).
+
+        Exports are long sequential scans, so they read from a secondary when there is one.
+        """
+        return iterate_batches(self._get_db(ANALYTICS), collection, after, start, end)
+
+    def _ranked(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        entries = []
+        for rank, document in enumerate(documents, start=1):
+            entry = {"rank": rank, **document}
+            if entry.get("last_activity") is not None:
+                entry["last_activity"] = entry["last_activity"].isoformat()
+            entries.append(entry)
+        return entries
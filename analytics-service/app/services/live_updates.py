@@ -0,0 +1,166 @@
+"""Live dashboard updates fanned out from a single MongoDB change stream.
+
+One ``LiveUpdateHub`` per process watches ``user_metrics`` and
+``project_metrics`` and hands per-user deltas to connected clients. Every
+subscription keeps a bounded, coalescing buffer: a newer delta for the same
+metrics document replaces the pending one, and a client that falls too far
+behind gets a single ``resync`` instead of an unbounded queue.
+"""
+import asyncio
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo.errors import OperationFailure, PyMongoError
+import structlog
+from app.config import settings
+
+logger = structlog.get_logger()
+
+WATCHED_COLLECTIONS = ["user_metrics", "project_metrics"]
+
+# Error code MongoDB returns when change streams are not available (standalone server)
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+DASHBOARD_FIELDS = ["total_tasks", "completed_tasks", "active_projects", "completion_rate", "version"]
+PROJECT_FIELDS = ["project_id", "project_name", "total_tasks", "completed_tasks", "completion_rate", "version"]
+
+
+def to_delta(collection: str, document: Dict[str, Any]) -> Tuple[Tuple[Any, ...], Dict[str, Any]]:
+    """Turn a metrics document into a (coalescing key, client payload) pair"""
+    if collection == "user_metrics":
+        return ("dashboard",), {"type": "dashboard", **{field: document.get(field) for field in DASHBOARD_FIELDS}}
+    return ("project", document.get("project_id")), {
+        "type": "project", **{field: document.get(field) for field in PROJECT_FIELDS}
+    }
+
+
+class Subscription:
+    """Bounded, coalescing buffer of pending deltas for one connection"""
+
+    def __init__(self, user_id: str, max_pending: int):
+        self.user_id = user_id
+        self.max_pending = max_pending
+        self.coalesced = 0
+        self.resyncs = 0
+        self._pending: "OrderedDict[Tuple[Any, ...], Dict[str, Any]]" = OrderedDict()
+        self._resync = False
+        self._ready = asyncio.Event()
+
+    def offer(self, key: Tuple[Any, ...], delta: Dict[str, Any]):
+        if self._resync:
+            return
+        if key in self._pending:
+            self.coalesced += 1
+            self._pending.move_to_end(key)
+        elif len(self._pending) >= self.max_pending:
+            # Too far behind: drop the backlog and ask the client to refetch over REST
+            self._pending.clear()
+            self._resync = True
+            self.resyncs += 1
+            self._ready.set()
+            return
+        self._pending[key] = delta
+        self._ready.set()
+
+    async def next_batch(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Wait for pending deltas and drain them; returns [] on timeout"""
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return []
+
+        self._ready.clear()
+        if self._resync:
+            self._resync = False
+            return [{"type": "resync"}]
+
+        batch = list(self._pending.values())
+        self._pending.clear()
+        return batch
+
+
+class LiveUpdateHub:
+    def __init__(self, max_pending: int = 64):
+        self.max_pending = max_pending
+        self.status = "stopped"
+        self._subscriptions: Dict[str, List[Subscription]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def connections(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def subscribe(self, user_id: Any) -> Subscription:
+        subscription = Subscription(str(user_id), self.max_pending)
+        self._subscriptions.setdefault(subscription.user_id, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscriptions = self._subscriptions.get(subscription.user_id, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+        if not subscriptions:
+            self._subscriptions.pop(subscription.user_id, None)
+
+    def publish(self, collection: str, document: Dict[str, Any]):
+        """Fan a changed metrics document out to the owning user's connections"""
+        subscriptions = self._subscriptions.get(str(document.get("user_id")))
+        if not subscriptions:
+            return
+        key, delta = to_delta(collection, document)
+        for subscription in subscriptions:
+            subscription.offer(key, delta)
+
+    def start(self, database):
+        """Start the single change stream subscription for this process"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._watch(database))
+        return self._task
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.status = "stopped"
+
+    async def _watch(self, database):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": WATCHED_COLLECTIONS},
+            "operationType": {"$in": ["insert", "update", "replace"]}
+        }}]
+        resume_token = None
+        retry_delay = 1
+
+        while True:
+            try:
+                async with database.watch(
+                    pipeline, full_document="updateLookup", resume_after=resume_token
+                ) as stream:
+                    self.status = "running"
+                    retry_delay = 1
+                    logger.info("Watching metrics change stream", collections=WATCHED_COLLECTIONS)
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        document = change.get("fullDocument")
+                        if document is not None:
+                            self.publish(change["ns"]["coll"], document)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    self.status = "unsupported"
+                    logger.warning("Change streams need a replica set, live updates disabled", error=str(e))
+                    return
+                self.status = "retrying"
+                logger.error("Metrics change stream failed", error=str(e), retry_in=retry_delay)
+            except PyMongoError as e:
+                self.status = "retrying"
+                logger.error("Metrics change stream failed", error=str(e), retry_in=retry_delay)
+
+            await asyncio.sleep(retry_delay)
+            retry_delay = min(retry_delay * 2, 30)
+
+
+live_update_hub = LiveUpdateHub(max_pending=settings.LIVE_UPDATES_MAX_PENDING)
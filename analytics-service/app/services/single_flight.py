@@ -0,0 +1,88 @@
+"""Single-flight coalescing of identical concurrent service calls.
+
+When a dashboard opens, its tabs and widgets often ask for the same user's
+data at the same moment. The first call for a given method and arguments runs
+the MongoDB queries; identical calls arriving while it is in flight wait for
+its result instead of issuing their own. Nothing is kept once the call
+finishes, so a caller never gets a result older than a computation that was
+already running when it arrived.
+"""
+import asyncio
+import copy
+import functools
+import inspect
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from app.config import settings
+from app.telemetry import metrics_registry
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.callers = 1
+
+
+class SingleFlight:
+    """In-flight calls by key, shared by every caller that asks while they run"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, function: Callable[[], Awaitable[Any]], label: str = "") -> Any:
+        """Await ``function()``, or the call already in flight for ``key``"""
+        call = self._calls.get(key)
+        # A call left behind by another event loop (tests, worker restarts) can never finish here
+        if call is not None and call.task.get_loop() is not asyncio.get_running_loop():
+            call = None
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(function()))
+            call.task.add_done_callback(functools.partial(self._forget, key, call))
+        else:
+            call.callers += 1
+            metrics_registry.record_coalesced_call(label)
+
+        # A caller that goes away (client disconnect, timeout) must not cancel the shared call
+        result = await asyncio.shield(call.task)
+        # Handlers add fields to the dicts they get back, so shared results are copied per caller
+        return copy.deepcopy(result) if call.callers > 1 else result
+
+    def _forget(self, key: Hashable, call: _Call, task: asyncio.Task):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved even when every caller went away
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def coalesce(method):
+    """Share one execution of an ``AnalyticsService`` method between identical concurrent calls.
+
+    Calls are identical when every argument, defaults included, is equal.
+    ``consistent=True`` (read-your-writes) calls always run on their own: a
+    call already in flight may have read before the caller's write.
+    """
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        arguments: Dict[str, Any] = dict(bound.arguments)
+        del arguments["self"]
+        if not settings.SINGLE_FLIGHT_ENABLED or arguments.get("consistent"):
+            return await method(self, *args, **kwargs)
+
+        key = (method.__name__, _freeze(arguments))
+        return await self.flights.do(key, lambda: method(self, *args, **kwargs), method.__name__)
+
+    return wrapper
@@ -0,0 +1,73 @@
+"""Shard the analytics collections on a sharded MongoDB cluster.
+
+Applies ``SHARD_KEYS`` from ``app.indexes`` through a ``mongos`` router: enables
+sharding for the database, then creates each collection's hashed shard key
+index and shards the collection. Collections already sharded on the declared
+key are left alone; one sharded on a different key is reported, since a shard
+key can only be changed with ``reshardCollection``. Run it once when the
+cluster is set up, before the worker starts writing
+(``docker-compose.sharded.yml`` does this):
+
+    python -m app.sharding
+"""
+import asyncio
+from typing import Dict, List
+import structlog
+from app.indexes import SHARD_KEYS, format_keys, key_signature
+
+logger = structlog.get_logger()
+
+
+async def shard_collections(database) -> Dict[str, List[str]]:
+    """Shard every collection in ``SHARD_KEYS``; returns ``sharded``, ``unchanged`` and ``mismatched`` entries"""
+    client = database.client
+    hello = await client.admin.command("hello")
+    if hello.get("msg") != "isdbgrid":
+        raise RuntimeError("Sharding collections needs a connection to a mongos router")
+
+    report: Dict[str, List[str]] = {"sharded": [], "unchanged": [], "mismatched": []}
+    await client.admin.command("enableSharding", database.name)
+
+    for collection_name, keys in SHARD_KEYS.items():
+        namespace = f"{database.name}.{collection_name}"
+        label = f"{collection_name} {format_keys(keys)}"
+        # Newer servers also track unsharded collections, marked unsplittable
+        current = await client.config.collections.find_one(
+            {"_id": namespace, "unsplittable": {"$ne": True}}
+        )
+        if current is not None:
+            if key_signature(current["key"].items()) == key_signature(keys):
+                report["unchanged"].append(label)
+            else:
+                logger.warning("Collection is sharded on another key", collection=collection_name,
+                               key=format_keys(current["key"].items()), expected=format_keys(keys))
+                report["mismatched"].append(label)
+            continue
+
+        # shardCollection only creates the index itself for empty collections
+        await database[collection_name].create_index(keys)
+        await client.admin.command("shardCollection", namespace, key=dict(keys))
+        report["sharded"].append(label)
+
+    logger.info("Sharding finished",
+                sharded=report["sharded"],
+                unchanged=len(report["unchanged"]),
+                mismatched=report["mismatched"])
+    return report
+
+
+async def _main():
+    from app.database import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        report = await shard_collections(get_database())
+        for kind, entries in report.items():
+            for entry in entries:
+                print(f"{kind:>10}  {entry}")
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
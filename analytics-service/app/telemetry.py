@@ -0,0 +1,248 @@
+"""Request and MongoDB command latency telemetry.
+
+``TimingMiddleware`` records a latency histogram per route template and adds a
+``Server-Timing`` header splitting each request into total and MongoDB time.
+``MongoCommandListener`` is registered on the Motor client and records
+per-collection, per-command latency and documents returned. Everything is
+exposed in Prometheus text format on ``/metrics``.
+"""
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# Driver housekeeping that would only add noise to per-query metrics
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "saslStart", "saslContinue", "endSessions", "buildInfo"}
+
+
+class Histogram:
+    """Cumulative-bucket histogram, safe to update from driver threads"""
+
+    def __init__(self, buckets: List[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.request_latency: Dict[Tuple[str, ...], Histogram] = {}
+        self.command_latency: Dict[Tuple[str, ...], Histogram] = {}
+        self.documents_returned: Dict[Tuple[str, ...], int] = {}
+        self.command_failures: Dict[Tuple[str, ...], int] = {}
+        self.coalesced_calls: Dict[Tuple[str, ...], int] = {}
+        self.shed_requests: Dict[Tuple[str, ...], int] = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, family: Dict[Tuple[str, ...], Histogram], labels: Tuple[str, ...]) -> Histogram:
+        histogram = family.get(labels)
+        if histogram is None:
+            with self._lock:
+                histogram = family.setdefault(labels, Histogram())
+        return histogram
+
+    def _increment(self, family: Dict[Tuple[str, ...], int], labels: Tuple[str, ...], amount: int = 1):
+        with self._lock:
+            family[labels] = family.get(labels, 0) + amount
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        self._histogram(self.request_latency, (method, route, str(status))).observe(seconds)
+
+    def observe_command(self, collection: str, command: str, seconds: float, documents: int):
+        labels = (collection, command)
+        self._histogram(self.command_latency, labels).observe(seconds)
+        if documents:
+            self._increment(self.documents_returned, labels, documents)
+
+    def record_command_failure(self, collection: str, command: str):
+        self._increment(self.command_failures, (collection, command))
+
+    def record_coalesced_call(self, method: str):
+        self._increment(self.coalesced_calls, (method,))
+
+    def record_shed_request(self, route_class: str, reason: str, outcome: str):
+        self._increment(self.shed_requests, (route_class, reason, outcome))
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+        self._render_histograms(
+            lines, "analytics_http_request_duration_seconds", "HTTP request latency by route",
+            ("method", "route", "status"), self.request_latency
+        )
+        self._render_histograms(
+            lines, "analytics_mongo_command_duration_seconds", "MongoDB command latency by collection",
+            ("collection", "command"), self.command_latency
+        )
+        self._render_counters(
+            lines, "analytics_mongo_documents_returned_total", "Documents returned by MongoDB cursors",
+            ("collection", "command"), self.documents_returned
+        )
+        self._render_counters(
+            lines, "analytics_mongo_command_failures_total", "Failed MongoDB commands",
+            ("collection", "command"), self.command_failures
+        )
+        self._render_counters(
+            lines, "analytics_coalesced_calls_total", "Service calls that joined an identical call in flight",
+            ("method",), self.coalesced_calls
+        )
+        self._render_counters(
+            lines, "analytics_shed_requests_total", "Requests shed by admission control",
+            ("route_class", "reason", "outcome"), self.shed_requests
+        )
+        return "\n".join(lines) + "\n"
+
+    def _render_histograms(self, lines, name, help_text, label_names, family):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in sorted(family.items()):
+            counts, total, count = histogram.snapshot()
+            label_text = _labels(label_names, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(histogram.buckets + [float("inf")], counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{label_text}}} {total}")
+            lines.append(f"{name}_count{{{label_text}}} {count}")
+
+    def _render_counters(self, lines, name, help_text, label_names, family):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(family.items()):
+            lines.append(f"{name}{{{_labels(label_names, labels)}}} {value}")
+
+
+def _escape(value: str) -> str:
+    # Label values escape backslash, double quote and line feed (Prometheus text format)
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class RequestTiming:
+    """MongoDB time accumulated by the commands of one request"""
+
+    def __init__(self):
+        self.db_seconds = 0.0
+        self.db_commands = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.db_seconds += seconds
+            self.db_commands += 1
+
+
+# Motor copies the context into its executor threads, so the listener sees it
+current_request_timing: contextvars.ContextVar[Optional[RequestTiming]] = contextvars.ContextVar(
+    "current_request_timing", default=None
+)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._in_flight: Dict[Tuple[int, object], Tuple[str, str]] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = "-"
+        with self._lock:
+            self._in_flight[(event.request_id, event.connection_id)] = (collection, event.command_name)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        labels = self._finish(event)
+        if labels is None:
+            return
+        seconds = event.duration_micros / 1_000_000
+        self.registry.observe_command(labels[0], labels[1], seconds, _documents_returned(event.reply))
+        timing = current_request_timing.get()
+        if timing is not None:
+            timing.add(seconds)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        labels = self._finish(event)
+        if labels is not None:
+            self.registry.record_command_failure(*labels)
+
+    def _finish(self, event) -> Optional[Tuple[str, str]]:
+        with self._lock:
+            return self._in_flight.pop((event.request_id, event.connection_id), None)
+
+
+def _documents_returned(reply) -> int:
+    cursor = reply.get("cursor") if hasattr(reply, "get") else None
+    if not cursor:
+        return 0
+    return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+
+
+class TimingMiddleware:
+    def __init__(self, app: ASGIApp, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = RequestTiming()
+        token = current_request_timing.set(timing)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                headers = MutableHeaders(raw=message["headers"])
+                headers.append(
+                    "Server-Timing",
+                    f'app;dur={elapsed_ms:.1f}, db;dur={timing.db_seconds * 1000:.1f};desc="{timing.db_commands} commands"'
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_request_timing.reset(token)
+            route = scope.get("route")
+            self.registry.observe_request(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status_code,
+                time.perf_counter() - started
+            )
+
+
+metrics_registry = MetricsRegistry()
+mongo_command_listener = MongoCommandListener(metrics_registry)
@@ -0,0 +1,184 @@
+"""Time-series storage and retention for the raw event collections.
+
+Both services keep an identical copy of this module. With
+``EVENTS_TIMESERIES=true``, ``task_events`` and ``project_events`` are created
+as MongoDB time-series collections (``timeField: timestamp``, ``metaField:
+user_id``). MongoDB then stores each user's events in compressed, column-wise
+buckets; secondary indexes point at buckets instead of single events, and time
+windows are pruned per bucket. ``user_id`` is the meta field because every
+query and the hashed shard key are already per user, so documents and filters
+keep their shape. ``project_id`` stays a measurement field behind its index.
+
+``EVENTS_RETENTION_DAYS`` (0 keeps events forever) becomes the collection's
+``expireAfterSeconds``: MongoDB drops whole buckets once every event in them is
+older. Changing it updates existing collections on the next start.
+
+Existing regular collections are never converted in place. The migration
+renames one to ``<collection>_legacy``, creates the time-series collection
+under the original name (new events go there straight away) and copies the
+legacy events in ``_id`` order, recording progress in ``event_migrations`` so
+an interrupted copy resumes. Stop the worker for the rename; Kafka keeps its
+events until it is back::
+
+    python -m app.timeseries                       # create collections, apply retention
+    python -m app.timeseries --migrate             # convert regular event collections
+    python -m app.timeseries --migrate --drop-legacy
+"""
+import argparse
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from pymongo.errors import CollectionInvalid, OperationFailure
+import structlog
+from app.config import settings
+
+logger = structlog.get_logger()
+
+EVENT_COLLECTIONS = ["task_events", "project_events"]
+MIGRATIONS_COLLECTION = "event_migrations"
+LEGACY_SUFFIX = "_legacy"
+
+# Returned by create when another process created the collection first
+NAMESPACE_EXISTS = 48
+
+
+def timeseries_options() -> Dict[str, Any]:
+    return {"timeField": "timestamp", "metaField": "user_id", "granularity": settings.EVENTS_TIMESERIES_GRANULARITY}
+
+
+def expire_after_seconds() -> Optional[int]:
+    return settings.EVENTS_RETENTION_DAYS * 86400 if settings.EVENTS_RETENTION_DAYS > 0 else None
+
+
+async def ensure_event_collection(database, name: str) -> str:
+    """Create ``name`` as a time-series collection or bring its retention up to date; returns what was done"""
+    expire = expire_after_seconds()
+    if name not in await database.list_collection_names(filter={"name": name}):
+        options: Dict[str, Any] = {"timeseries": timeseries_options()}
+        if expire is not None:
+            options["expireAfterSeconds"] = expire
+        try:
+            await database.create_collection(name, **options)
+            return "created"
+        except CollectionInvalid:
+            pass
+        except OperationFailure as e:
+            if e.code != NAMESPACE_EXISTS:
+                raise
+
+    current = await database[name].options()
+    if "timeseries" not in current:
+        return "regular"
+    if current.get("expireAfterSeconds") == expire:
+        return "unchanged"
+    await database.command("collMod", name, expireAfterSeconds=expire if expire is not None else "off")
+    return "retention updated"
+
+
+async def ensure_event_collections(database) -> Dict[str, str]:
+    """Set up the event collections when ``EVENTS_TIMESERIES`` is on; called before indexes are reconciled"""
+    if not settings.EVENTS_TIMESERIES:
+        return {}
+    report = {}
+    for name in EVENT_COLLECTIONS:
+        report[name] = await ensure_event_collection(database, name)
+        if report[name] == "regular":
+            logger.warning("Event collection is not a time-series collection, run python -m app.timeseries --migrate",
+                           collection=name)
+    logger.info("Event collections checked", collections=report, retention_days=settings.EVENTS_RETENTION_DAYS)
+    return report
+
+
+def _as_event(document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # Time-series collections only accept BSON dates in the time field
+    timestamp = document.get("timestamp")
+    if isinstance(timestamp, str):
+        try:
+            timestamp = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if not isinstance(timestamp, datetime):
+        return None
+    return {**document, "timestamp": timestamp}
+
+
+async def copy_events(source, target, progress, name: str, batch_size: int = 1000) -> Dict[str, int]:
+    """Copy ``source`` into ``target`` in ``_id`` order, resuming after the ``_id`` recorded in ``progress``"""
+    state = await progress.find_one({"_id": name}) or {}
+    last_id = state.get("last_id")
+    stats = {"copied": 0, "skipped": 0}
+    resuming = last_id is not None
+
+    while True:
+        query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+        batch: List[Dict[str, Any]] = await source.find(query).sort("_id", 1).limit(batch_size).to_list(None)
+        if not batch:
+            break
+        events = [event for event in map(_as_event, batch) if event is not None]
+        if resuming:
+            # Time-series collections do not enforce unique _ids: drop what an interrupted run left behind
+            await target.delete_many({"_id": {"$in": [event["_id"] for event in events]}})
+            resuming = False
+        if events:
+            await target.insert_many(events, ordered=False)
+        last_id = batch[-1]["_id"]
+        await progress.update_one(
+            {"_id": name},
+            {"$set": {"last_id": last_id}, "$inc": {"copied": len(events), "skipped": len(batch) - len(events)}},
+            upsert=True
+        )
+        stats["copied"] += len(events)
+        stats["skipped"] += len(batch) - len(events)
+        logger.info("Events migrated", collection=name, copied=stats["copied"], skipped=stats["skipped"])
+    return stats
+
+
+async def migrate_event_collection(
+    database, name: str, batch_size: int = 1000, drop_legacy: bool = False
+) -> Dict[str, Any]:
+    """Convert one regular event collection to a time-series collection, copying its events"""
+    legacy = name + LEGACY_SUFFIX
+    names = await database.list_collection_names()
+    if name in names and "timeseries" not in await database[name].options():
+        if legacy in names:
+            raise RuntimeError(f"{legacy} already exists, finish or clean up the previous migration first")
+        await database[name].rename(legacy)
+        logger.info("Renamed regular event collection", collection=name, legacy=legacy)
+        names.append(legacy)
+
+    status = await ensure_event_collection(database, name)
+    if status == "regular":
+        raise RuntimeError(f"{name} was recreated as a regular collection, stop the worker and migrate again")
+    if legacy not in names:
+        return {"collection": name, "status": status, "copied": 0, "skipped": 0}
+
+    stats = await copy_events(database[legacy], database[name], database[MIGRATIONS_COLLECTION], name, batch_size)
+    if drop_legacy:
+        await database[legacy].drop()
+        await database[MIGRATIONS_COLLECTION].delete_one({"_id": name})
+        logger.info("Dropped legacy event collection", collection=legacy)
+    return {"collection": name, "status": "migrated", **stats}
+
+
+async def _main(migrate: bool, batch_size: int, drop_legacy: bool):
+    from app.database import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        database = get_database()
+        for name in EVENT_COLLECTIONS:
+            if migrate:
+                print(await migrate_event_collection(database, name, batch_size, drop_legacy))
+            else:
+                print(name, await ensure_event_collection(database, name))
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store raw events in time-series collections with TTL retention")
+    parser.add_argument("--migrate", action="store_true", help="convert regular event collections and copy their events")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--drop-legacy", action="store_true", help="drop the legacy collections once copied")
+    args = parser.parse_args()
+    asyncio.run(_main(args.migrate, args.batch_size, args.drop_legacy))
@@ -0,0 +1,198 @@
+"""Seeded analytics dataset with skewed, production-like distributions.
+
+Activity per user follows a Pareto distribution (a few heavy users, a long
+tail of light ones), users own one to a handful of projects, and events are
+spread over the last ``days`` days with a realistic completion ratio. The same
+seed always produces the same dataset.
+"""
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+from app.rollups import ROLLUPS_COLLECTION, bucket_start, compact_rollups, empty_counters, event_counters
+from app.hyperloglog import ACTIVE_USERS_COLLECTION, REGISTER_GRANULARITIES, HyperLogLog
+from app.sketches import SKETCHES_COLLECTION, DDSketch
+
+STATUSES = ["pending", "in_progress", "completed"]
+
+
+@dataclass
+class Dataset:
+    user_metrics: List[Dict[str, Any]] = field(default_factory=list)
+    project_metrics: List[Dict[str, Any]] = field(default_factory=list)
+    task_events: List[Dict[str, Any]] = field(default_factory=list)
+    project_events: List[Dict[str, Any]] = field(default_factory=list)
+    projects_by_user: Dict[int, List[int]] = field(default_factory=dict)
+
+    @property
+    def user_ids(self) -> List[int]:
+        return sorted(self.projects_by_user)
+
+
+def generate_dataset(users: int = 200, days: int = 60, mean_events: int = 150, seed: int = 42) -> Dataset:
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    dataset = Dataset()
+    next_project_id = 1
+    next_task_id = 1
+
+    for user_id in range(1, users + 1):
+        username = f"user{user_id}"
+        project_count = min(1 + int(rng.expovariate(0.6)), 12)
+        project_ids = list(range(next_project_id, next_project_id + project_count))
+        next_project_id += project_count
+        dataset.projects_by_user[user_id] = project_ids
+
+        # Pareto(1.5) has mean 3, so scale to mean_events and cap the heaviest users
+        event_count = min(int(rng.paretovariate(1.5) * mean_events / 3), mean_events * 40)
+        per_project: Dict[int, Dict[str, Any]] = {
+            project_id: {"total": 0, "completed": 0, "last": None} for project_id in project_ids
+        }
+
+        for project_id in project_ids:
+            created = now - timedelta(days=days, hours=rng.randint(0, 23))
+            dataset.project_events.append({
+                "event": "project_created", "project_id": project_id, "user_id": str(user_id),
+                "username": username, "name": f"Project {project_id}", "timestamp": created
+            })
+
+        tasks_created = 0
+        for _ in range(event_count):
+            # Larger projects get more of the activity
+            project_id = project_ids[min(int(rng.expovariate(1.0)), project_count - 1)]
+            timestamp = now - timedelta(seconds=rng.randint(0, days * 86400))
+            if tasks_created == 0 or rng.random() < 0.4:
+                event, status, task_id = "task_created", "pending", next_task_id
+                next_task_id += 1
+                tasks_created += 1
+                per_project[project_id]["total"] += 1
+            else:
+                event = "task_updated"
+                status = rng.choices(STATUSES, weights=[1, 3, 6])[0]
+                task_id = next_task_id - rng.randint(1, tasks_created)
+                if status == "completed":
+                    per_project[project_id]["completed"] += 1
+            last = per_project[project_id]["last"]
+            per_project[project_id]["last"] = timestamp if last is None else max(last, timestamp)
+            dataset.task_events.append({
+                "event": event, "task_id": task_id, "project_id": project_id, "user_id": str(user_id),
+                "username": username, "title": f"Task {task_id}", "status": status, "timestamp": timestamp
+            })
+
+        total_tasks = completed_tasks = 0
+        last_activity = None
+        for project_id, stats in per_project.items():
+            completed = min(stats["completed"], stats["total"])
+            total_tasks += stats["total"]
+            completed_tasks += completed
+            if stats["last"] and (last_activity is None or stats["last"] > last_activity):
+                last_activity = stats["last"]
+            dataset.project_metrics.append({
+                "project_id": project_id, "user_id": str(user_id), "username": username,
+                "project_name": f"Project {project_id}", "total_tasks": stats["total"],
+                "completed_tasks": completed,
+                "completion_rate": completed / stats["total"] if stats["total"] else 0.0,
+                "avg_completion_time_hours": None, "created_at_project": now - timedelta(days=days),
+                "last_activity": stats["last"], "version": stats["total"] + completed,
+                "created_at": now - timedelta(days=days), "updated_at": stats["last"] or now
+            })
+
+        dataset.user_metrics.append({
+            "user_id": str(user_id), "username": username, "total_tasks": total_tasks,
+            "completed_tasks": completed_tasks, "active_projects": project_count,
+            "completion_rate": completed_tasks / total_tasks if total_tasks else 0.0,
+            "avg_completion_time_hours": None, "last_activity": last_activity,
+            "version": event_count, "created_at": now - timedelta(days=days), "updated_at": last_activity or now
+        })
+
+    return dataset
+
+
+def hourly_rollups(dataset: Dataset) -> List[Dict[str, Any]]:
+    """Hourly rollup documents as the worker would have written them for the events"""
+    rollups: Dict[tuple, Dict[str, int]] = {}
+    for event in dataset.task_events:
+        hour = bucket_start(event["timestamp"], "hour")
+        for scope in (None, event["project_id"]):
+            counters = rollups.setdefault((event["user_id"], scope, hour), empty_counters())
+            for name, value in event_counters(event["event"], event["status"]).items():
+                counters[name] += value
+    return [
+        {"user_id": user_id, "project_id": project_id, "granularity": "hour", "bucket": bucket, "counters": counters}
+        for (user_id, project_id, bucket), counters in rollups.items()
+    ]
+
+
+def completion_sketches(dataset: Dataset) -> List[Dict[str, Any]]:
+    """Day and all-time completion-time sketches as the worker would have written them"""
+    created = {event["task_id"]: event["timestamp"] for event in dataset.task_events if event["event"] == "task_created"}
+    sketches: Dict[tuple, DDSketch] = {}
+    for event in dataset.task_events:
+        if event["event"] != "task_updated" or event["status"] != "completed" or event["task_id"] not in created:
+            continue
+        hours = (event["timestamp"] - created[event["task_id"]]).total_seconds() / 3600
+        day = bucket_start(event["timestamp"], "day")
+        for scope in (None, event["project_id"]):
+            for granularity, bucket in (("day", day), ("all", None)):
+                sketches.setdefault((event["user_id"], scope, granularity, bucket), DDSketch()).add(hours)
+    return [
+        {"user_id": user_id, "project_id": project_id, "granularity": granularity, "bucket": bucket,
+         "sketch": sketch.to_bytes(), "count": sketch.count, "sum_hours": sketch.sum}
+        for (user_id, project_id, granularity, bucket), sketch in sketches.items()
+    ]
+
+
+def user_dashboards(dataset: Dataset) -> List[Dict[str, Any]]:
+    """Materialized dashboard documents as the worker would have written them"""
+    recent: Dict[str, List[Dict[str, Any]]] = {}
+    for event in sorted(dataset.task_events, key=lambda event: event["timestamp"], reverse=True):
+        activity = recent.setdefault(event["user_id"], [])
+        if len(activity) < 10:
+            activity.append({"type": "task", "event": event["event"], "task_id": event["task_id"],
+                             "project_id": event["project_id"], "timestamp": event["timestamp"]})
+    return [
+        {"_id": metrics["user_id"], "total_tasks": metrics["total_tasks"], "completed_tasks": metrics["completed_tasks"],
+         "active_projects": metrics["active_projects"], "completion_rate": metrics["completion_rate"],
+         "recent_activity": recent.get(metrics["user_id"], []), "updated_at": metrics["updated_at"]}
+        for metrics in dataset.user_metrics
+    ]
+
+
+def active_user_registers(dataset: Dataset) -> List[Dict[str, Any]]:
+    """Daily and monthly HyperLogLog register sets as the worker would have written them"""
+    registers: Dict[tuple, HyperLogLog] = {}
+    for event in dataset.task_events + dataset.project_events:
+        for scope in (None, event["project_id"]):
+            for granularity in REGISTER_GRANULARITIES:
+                key = (scope, granularity, bucket_start(event["timestamp"], granularity))
+                registers.setdefault(key, HyperLogLog()).add(event["user_id"])
+    return [
+        {"project_id": project_id, "granularity": granularity, "bucket": bucket,
+         "registers": {str(index): rank for index, rank in sketch.registers.items()}}
+        for (project_id, granularity, bucket), sketch in registers.items()
+    ]
+
+
+async def seed_database(database, dataset: Dataset):
+    """Load a dataset into a Motor (or fake) database, with compacted rollups, sketches, dashboards and registers"""
+    for name in ("user_metrics", "project_metrics", "task_events", "project_events"):
+        documents = getattr(dataset, name)
+        if documents:
+            await database[name].insert_many([dict(document) for document in documents])
+
+    rollups = hourly_rollups(dataset)
+    if rollups:
+        await database[ROLLUPS_COLLECTION].insert_many(rollups)
+        await compact_rollups(database, grace_seconds=3600)
+
+    sketches = completion_sketches(dataset)
+    if sketches:
+        await database[SKETCHES_COLLECTION].insert_many(sketches)
+
+    dashboards = user_dashboards(dataset)
+    if dashboards:
+        await database.user_dashboard.insert_many(dashboards)
+
+    registers = active_user_registers(dataset)
+    if registers:
+        await database[ACTIVE_USERS_COLLECTION].insert_many(registers)
@@ -0,0 +1,367 @@
+"""In-memory stand-in for the parts of Motor the analytics service uses.
+
+Supports ``insert_one``, ``find_one``, ``find`` (projection, sort, limit, async iteration),
+``aggregate`` with ``$match`` / ``$group`` / ``$sort`` / ``$limit``, upserts
+with ``$set`` / ``$inc`` / ``$max`` / ``$unset`` through ``update_one`` and ``bulk_write``, and the
+query operators the service issues. Documents are bucketed by ``user_id``
+(and ``project_id`` / ``granularity``) the way the compound indexes prefix
+them, so user-scoped queries do not scan the whole collection. It is meant
+for relative, in-process benchmarks only.
+"""
+import asyncio
+import copy
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import UpdateResult
+from app.indexes import INDEX_MANIFEST
+
+_MISSING = object()
+
+
+def _get(document: Dict[str, Any], path: str) -> Any:
+    value: Any = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$exists":
+        return (value is not _MISSING) == bool(operand)
+    if value is _MISSING or value is None:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    raise NotImplementedError(f"Unsupported query operator {operator}")
+
+
+def matches(document: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(document, clause) for clause in condition):
+                return False
+            continue
+        if field == "$and":
+            if not all(matches(document, clause) for clause in condition):
+                return False
+            continue
+        value = _get(document, field)
+        if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+            if not all(_compare(value, operator, operand) for operator, operand in condition.items()):
+                return False
+        elif value is _MISSING or value != condition:
+            return False
+    return True
+
+
+def _sort_key(document: Dict[str, Any], field: str):
+    value = _get(document, field)
+    # Missing and null sort first, as in MongoDB
+    return (0, 0) if value is _MISSING or value is None else (1, value)
+
+
+def sort_documents(documents: List[Dict[str, Any]], sort: List[tuple]) -> List[Dict[str, Any]]:
+    for field, direction in reversed(sort):
+        documents = sorted(documents, key=lambda document: _sort_key(document, field), reverse=direction < 0)
+    return documents
+
+
+def project(document: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return document
+    include_id = projection.get("_id", 1)
+    included = [field for field, flag in projection.items() if flag and field != "_id"]
+    if included:
+        result = {field: document[field] for field in included if field in document}
+        if include_id and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    excluded = {field for field, flag in projection.items() if not flag}
+    return {field: value for field, value in document.items() if field not in excluded}
+
+
+def _normalize_sort(key_or_list, direction=None) -> List[tuple]:
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else 1)]
+    if isinstance(key_or_list, dict):
+        return list(key_or_list.items())
+    return list(key_or_list)
+
+
+class FakeCursor:
+    def __init__(self, documents: List[Dict[str, Any]], projection=None):
+        self._documents = documents
+        self._projection = projection
+        self._sort: List[tuple] = []
+        self._limit = 0
+        self._results: Optional[List[Dict[str, Any]]] = None
+
+    def sort(self, key_or_list, direction=None) -> "FakeCursor":
+        self._sort = _normalize_sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int) -> "FakeCursor":
+        self._limit = limit
+        return self
+
+    def _evaluate(self) -> List[Dict[str, Any]]:
+        if self._results is None:
+            documents = sort_documents(self._documents, self._sort) if self._sort else self._documents
+            if self._limit:
+                documents = documents[:self._limit]
+            self._results = [project(document, self._projection) for document in documents]
+        return self._results
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        # Yield like a network round trip so concurrent requests interleave
+        await asyncio.sleep(0)
+        results = self._evaluate()
+        return list(results if length is None else results[:length])
+
+    def __aiter__(self):
+        self._iterator = iter(self._evaluate())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    def close(self):
+        self._results = []
+
+
+# Equality prefixes documents are bucketed by, longest first, like compound index prefixes
+BUCKET_KEYS = [("user_id", "project_id", "granularity"), ("user_id", "project_id"), ("user_id",)]
+
+
+class FakeCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self.documents: List[Dict[str, Any]] = []
+        self._buckets: Dict[tuple, Dict[tuple, List[Dict[str, Any]]]] = {
+            fields: defaultdict(list) for fields in BUCKET_KEYS
+        }
+
+    def insert_many_sync(self, documents: List[Dict[str, Any]]):
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+            self.documents.append(document)
+            for fields, buckets in self._buckets.items():
+                buckets[tuple(document.get(field) for field in fields)].append(document)
+
+    async def insert_many(self, documents: List[Dict[str, Any]], **kwargs):
+        self.insert_many_sync(documents)
+
+    async def insert_one(self, document: Dict[str, Any]):
+        self.insert_many_sync([document])
+
+    def _candidates(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        for fields, buckets in self._buckets.items():
+            values = tuple(query.get(field, _MISSING) for field in fields)
+            if all(value is not _MISSING and not isinstance(value, dict) for value in values):
+                return buckets.get(values, [])
+        return self.documents
+
+    def _matching(self, query: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return [document for document in self._candidates(query) if matches(document, query)]
+
+    async def find_one(self, query: Optional[Dict[str, Any]] = None, projection=None, sort=None, **kwargs):
+        await asyncio.sleep(0)
+        query = query or {}
+        candidates = self._candidates(query)
+        if sort:
+            candidates = sort_documents(candidates, _normalize_sort(sort))
+        for document in candidates:
+            if matches(document, query):
+                return project(copy.copy(document), projection)
+        return None
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection=None, **kwargs) -> FakeCursor:
+        return FakeCursor(self._matching(query or {}), projection)
+
+    async def count_documents(self, query: Dict[str, Any], **kwargs) -> int:
+        return len(self._matching(query))
+
+    def _check_unique(self, document: Dict[str, Any]):
+        for spec in INDEX_MANIFEST.get(self.name, []):
+            if spec.get("unique"):
+                key = {field: document.get(field) for field, _ in spec["keys"]}
+                if self._matching(key):
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} dup key: {key}", 11000)
+
+    def _upsert(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool) -> int:
+        matched = self._matching(query)
+        if matched:
+            _apply_update(matched[0], update, inserting=False)
+        elif upsert:
+            document = {field: value for field, value in query.items()
+                        if not field.startswith("$") and not isinstance(value, dict)}
+            _apply_update(document, update, inserting=True)
+            # Unique manifest indexes are enforced where upserts can race: on insert
+            self._check_unique(document)
+            self.insert_many_sync([document])
+        return min(len(matched), 1)
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False, **kwargs):
+        matched = self._upsert(query, update, upsert)
+        return UpdateResult({"n": matched, "nModified": matched}, acknowledged=True)
+
+    async def bulk_write(self, operations: List[Any], **kwargs):
+        errors = []
+        for index, operation in enumerate(operations):
+            # pymongo.UpdateOne keeps its arguments in private attributes
+            try:
+                self._upsert(operation._filter, operation._doc, operation._upsert)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": e.code, "errmsg": str(e)})
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": 0})
+
+    async def delete_many(self, query: Dict[str, Any], **kwargs):
+        doomed = {id(document) for document in self._matching(query)}
+        self.documents = [document for document in self.documents if id(document) not in doomed]
+        for buckets in self._buckets.values():
+            for key, documents in list(buckets.items()):
+                buckets[key] = [document for document in documents if id(document) not in doomed]
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> FakeCursor:
+        documents = self.documents
+        for stage in pipeline:
+            (operator, spec), = stage.items()
+            if operator == "$match":
+                documents = [document for document in (
+                    self._candidates(spec) if documents is self.documents else documents
+                ) if matches(document, spec)]
+            elif operator == "$sort":
+                documents = sort_documents(documents, _normalize_sort(spec))
+            elif operator == "$limit":
+                documents = documents[:spec]
+            elif operator == "$group":
+                documents = _group(documents, spec)
+            elif operator == "$project":
+                documents = [project(document, spec) for document in documents]
+            else:
+                raise NotImplementedError(f"Unsupported pipeline stage {operator}")
+        return FakeCursor(list(documents))
+
+
+def _set_path(document: Dict[str, Any], path: str, value: Any):
+    *parents, leaf = path.split(".")
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[leaf] = value
+
+
+def _apply_update(document: Dict[str, Any], update: Dict[str, Any], inserting: bool):
+    for operator, fields in update.items():
+        if operator == "$set" or (operator == "$setOnInsert" and inserting):
+            for path, value in fields.items():
+                _set_path(document, path, value)
+        elif operator == "$inc":
+            for path, amount in fields.items():
+                current = _get(document, path)
+                _set_path(document, path, (0 if current is _MISSING else current) + amount)
+        elif operator == "$max":
+            for path, value in fields.items():
+                current = _get(document, path)
+                if current is _MISSING or value > current:
+                    _set_path(document, path, value)
+        elif operator == "$unset":
+            for path in fields:
+                *parents, leaf = path.split(".")
+                parent = _get(document, ".".join(parents)) if parents else document
+                if isinstance(parent, dict):
+                    parent.pop(leaf, None)
+        elif operator != "$setOnInsert":
+            raise NotImplementedError(f"Unsupported update operator {operator}")
+
+
+def _expression(document: Dict[str, Any], expression: Any) -> Any:
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = _get(document, expression[1:])
+        return None if value is _MISSING else value
+    if isinstance(expression, dict):
+        return {key: _expression(document, value) for key, value in expression.items()}
+    return expression
+
+
+def _group(documents: List[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    groups: Dict[Any, List[Dict[str, Any]]] = {}
+    for document in documents:
+        key = _expression(document, spec["_id"])
+        groups.setdefault(repr(key), []).append(document)
+
+    results = []
+    for members in groups.values():
+        result = {"_id": _expression(members[0], spec["_id"])}
+        for field, accumulator in spec.items():
+            if field == "_id":
+                continue
+            (operator, argument), = accumulator.items()
+            if operator == "$sum":
+                result[field] = sum(_expression(member, argument) or 0 for member in members)
+            elif operator in ("$max", "$min"):
+                values = [value for value in (_expression(member, argument) for member in members) if value is not None]
+                result[field] = (max if operator == "$max" else min)(values) if values else None
+            elif operator == "$push":
+                result[field] = [_expression(member, argument) for member in members]
+            elif operator == "$topN":
+                ordered = sort_documents(members, _normalize_sort(argument["sortBy"]))
+                result[field] = [_expression(member, argument["output"]) for member in ordered[:argument["n"]]]
+            else:
+                raise NotImplementedError(f"Unsupported accumulator {operator}")
+        results.append(result)
+    return results
+
+
+class FakeSession:
+    """A single in-process store is trivially causally consistent"""
+
+    async def __aenter__(self) -> "FakeSession":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return None
+
+
+class FakeClient:
+    async def start_session(self, **kwargs) -> FakeSession:
+        return FakeSession()
+
+
+class FakeDatabase:
+    def __init__(self):
+        self._collections: Dict[str, FakeCollection] = {}
+        self.client = FakeClient()
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name)
+        return self._collections[name]
+
+    def with_options(self, **kwargs) -> "FakeDatabase":
+        # Read preferences are meaningless for a single in-process store
+        return self
@@ -0,0 +1,304 @@
+"""In-process load test for the analytics API.
+
+Drives every analytics endpoint through ``httpx.ASGITransport`` (no sockets,
+no uvicorn) at a configurable concurrency against a seeded dataset, and
+reports requests per second and p50/p95/p99 latency per endpoint. The dataset
+lives in an in-memory stand-in by default, or in a real MongoDB with
+``--mongodb-url``.
+
+Usage:
+    python -m benchmarks.run --concurrency 32 --requests 500
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json --fail-on-regression
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import random
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional
+import httpx
+from benchmarks.dataset import Dataset, generate_dataset, seed_database
+from benchmarks.fake_mongo import FakeDatabase
+
+API = "/api/v1/analytics"
+
+
+@dataclass
+class Scenario:
+    name: str
+    build: Callable[["Workload"], Dict[str, Any]]
+    admin: bool = False
+
+
+@dataclass
+class Result:
+    name: str
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    def percentile(self, fraction: float) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+        return ordered[index] * 1000
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "requests": len(self.latencies),
+            "errors": self.errors,
+            "rps": round(len(self.latencies) / self.elapsed, 1) if self.elapsed else 0.0,
+            "p50_ms": round(self.percentile(0.50), 2),
+            "p95_ms": round(self.percentile(0.95), 2),
+            "p99_ms": round(self.percentile(0.99), 2),
+        }
+
+
+class Workload:
+    """Picks users with a Zipf-like skew so hot users get most of the traffic"""
+
+    def __init__(self, dataset: Dataset, seed: int):
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self.user_ids = dataset.user_ids
+        self.weights = [1 / rank for rank in range(1, len(self.user_ids) + 1)]
+        self.etags: Dict[int, str] = {}
+
+    def user(self) -> int:
+        return self.rng.choices(self.user_ids, weights=self.weights)[0]
+
+    def project(self, user_id: int) -> int:
+        return self.rng.choice(self.dataset.projects_by_user[user_id])
+
+
+def _request(method: str, path: str, user_id: int, **kwargs) -> Dict[str, Any]:
+    return {"method": method, "url": path, "user_id": user_id, **kwargs}
+
+
+def _conditional_dashboard(workload: Workload) -> Dict[str, Any]:
+    user_id = workload.user()
+    headers = {"If-None-Match": workload.etags[user_id]} if user_id in workload.etags else {}
+    return _request("GET", f"{API}/dashboard", user_id, headers=headers, remember_etag=True)
+
+
+def _project_request(suffix: str) -> Callable[[Workload], Dict[str, Any]]:
+    def build(workload: Workload) -> Dict[str, Any]:
+        user_id = workload.user()
+        return _request("GET", f"{API}/projects/{workload.project(user_id)}{suffix}", user_id)
+    return build
+
+
+def _days_ago(days: int) -> str:
+    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _batch(workload: Workload) -> Dict[str, Any]:
+    user_id = workload.user()
+    return _request("POST", f"{API}/projects/batch", user_id, json={
+        "project_ids": workload.dataset.projects_by_user[user_id], "timeline_limit": 5
+    })
+
+
+SCENARIOS = [
+    Scenario("dashboard", lambda w: _request("GET", f"{API}/dashboard", w.user())),
+    Scenario("dashboard_revalidate", _conditional_dashboard),
+    Scenario("task_summary", lambda w: _request("GET", f"{API}/tasks/summary", w.user())),
+    Scenario("productivity", lambda w: _request("GET", f"{API}/productivity", w.user())),
+    Scenario("project_analytics", _project_request("")),
+    Scenario("project_timeline", _project_request("/timeline?limit=100")),
+    Scenario("project_timeline_stream", _project_request("/timeline/stream")),
+    Scenario("projects_batch", _batch),
+    Scenario("leaderboard_users", lambda w: _request(
+        "GET", f"{API}/admin/leaderboard/users?metric=completions&limit=10", w.user()), admin=True),
+    Scenario("leaderboard_projects", lambda w: _request(
+        "GET", f"{API}/admin/leaderboard/projects?metric=recent_activity&limit=10", w.user()), admin=True),
+    Scenario("active_users", lambda w: _request("GET", f"{API}/admin/active-users", w.user()), admin=True),
+    Scenario("active_users_series", lambda w: _request(
+        "GET", f"{API}/admin/active-users/series?granularity=week&from={_days_ago(56)}", w.user()), admin=True),
+    Scenario("dashboard_window_day", lambda w: _request("GET", f"{API}/dashboard?granularity=day", w.user())),
+    Scenario("productivity_window_week", lambda w: _request(
+        "GET", f"{API}/productivity?granularity=week&from={_days_ago(90)}", w.user())),
+    Scenario("project_window_hour", _project_request(f"?granularity=hour&from={_days_ago(7)}")),
+    Scenario("health", lambda w: _request("GET", "/health", w.user())),
+]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, workload: Workload,
+                       requests: int, concurrency: int, warmup: int) -> Result:
+    result = Result(scenario.name)
+    remaining = warmup + requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            measured = remaining < requests
+            spec = scenario.build(workload)
+            user_id = spec.pop("user_id")
+            remember_etag = spec.pop("remember_etag", False)
+            headers = {
+                "X-User-Id": str(user_id), "X-Username": f"user{user_id}",
+                "X-User-Role": "Admin" if scenario.admin else "User",
+                **spec.pop("headers", {})
+            }
+            started = time.perf_counter()
+            response = await client.request(headers=headers, **spec)
+            latency = time.perf_counter() - started
+            if remember_etag and "etag" in response.headers:
+                workload.etags[user_id] = response.headers["etag"]
+            if measured:
+                result.latencies.append(latency)
+                if response.status_code >= 400:
+                    result.errors += 1
+
+    # The first ``warmup`` requests taken by the workers are not measured
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    # Spread the elapsed time over the measured share of the requests
+    if warmup:
+        result.elapsed *= requests / (requests + warmup)
+    return result
+
+
+async def prepare_database(args, dataset: Dataset):
+    """Point the application at a seeded database and return a cleanup coroutine"""
+    from app.database import mongodb
+    from app.api import analytics
+
+    if args.mongodb_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from app.indexes import reconcile_indexes
+
+        client = AsyncIOMotorClient(args.mongodb_url)
+        await client.drop_database(args.database)
+        database = client[args.database]
+        await seed_database(database, dataset)
+        await reconcile_indexes(database)
+    else:
+        client = None
+        database = FakeDatabase()
+        await seed_database(database, dataset)
+
+    previous = (mongodb.client, mongodb.database, mongodb.index_status)
+    mongodb.client = client or database
+    mongodb.database = database
+    mongodb.read_profiles = {}
+    mongodb.index_status = {"status": "ready", "completed": 0, "total": 0, "error": None}
+    analytics.analytics_service.databases = {}
+
+    async def cleanup():
+        if client is not None:
+            if not args.keep_data:
+                await client.drop_database(args.database)
+            client.close()
+        mongodb.client, mongodb.database, mongodb.index_status = previous
+        mongodb.read_profiles = {}
+        analytics.analytics_service.databases = {}
+    return cleanup
+
+
+async def run(args) -> Dict[str, Any]:
+    from app.main import app
+
+    # The client's per-request INFO lines would flood the log queue and the timings
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    dataset = generate_dataset(users=args.users, days=args.days, mean_events=args.mean_events, seed=args.seed)
+    cleanup = await prepare_database(args, dataset)
+    workload = Workload(dataset, args.seed)
+    selected = [scenario for scenario in SCENARIOS if not args.only or scenario.name in args.only]
+
+    results = {}
+    try:
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            for scenario in selected:
+                result = await run_scenario(
+                    client, scenario, workload, args.requests, args.concurrency, args.warmup
+                )
+                results[scenario.name] = result.summary()
+    finally:
+        await cleanup()
+
+    return {
+        "config": {
+            "backend": "mongodb" if args.mongodb_url else "in-memory",
+            "users": args.users, "days": args.days, "mean_events": args.mean_events, "seed": args.seed,
+            "task_events": len(dataset.task_events), "concurrency": args.concurrency,
+            "requests": args.requests, "python": platform.python_version(),
+        },
+        "results": results,
+    }
+
+
+def print_report(report: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None, tolerance: float = 0.25) -> List[str]:
+    """Print a results table, with deltas against a baseline; returns regressed endpoints"""
+    config = report["config"]
+    print(f"backend={config['backend']} users={config['users']} task_events={config['task_events']} "
+          f"concurrency={config['concurrency']} requests={config['requests']}")
+    header = f"{'endpoint':<26}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}"
+    if baseline:
+        header += f"{'rps Δ':>10}{'p95 Δ':>10}"
+    print(header)
+
+    regressions = []
+    for name, stats in report["results"].items():
+        line = (f"{name:<26}{stats['rps']:>10.1f}{stats['p50_ms']:>10.2f}"
+                f"{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['errors']:>8}")
+        previous = (baseline or {}).get("results", {}).get(name)
+        if previous:
+            rps_delta = (stats["rps"] - previous["rps"]) / previous["rps"] if previous["rps"] else 0.0
+            p95_delta = (stats["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] if previous["p95_ms"] else 0.0
+            line += f"{rps_delta:>+10.0%}{p95_delta:>+10.0%}"
+            if p95_delta > tolerance or rps_delta < -tolerance:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the analytics API in-process")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=50, help="unmeasured requests per endpoint")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--days", type=int, default=60)
+    parser.add_argument("--mean-events", type=int, default=150, help="mean task events per user")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--only", nargs="*", help="endpoints to run (default: all)")
+    parser.add_argument("--mongodb-url", help="seed and query a real MongoDB instead of the in-memory store")
+    parser.add_argument("--database", default="analytics_benchmark")
+    parser.add_argument("--keep-data", action="store_true", help="keep the seeded MongoDB database")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95/rps change before flagging")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    regressions = print_report(report, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+import asyncio
+import pytest
+from pymongo import _csot
+from app.admission import AdmissionControlMiddleware, RouteClass, StaleResponses
+from app.telemetry import metrics_registry
+
+
+def scope(path, method="GET", user="1", headers=()):
+    return {
+        "type": "http", "method": method, "path": path, "query_string": b"",
+        "headers": [(b"x-user-id", user.encode()), *headers],
+    }
+
+
+async def call(app, request):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(request, receive, send)
+    start = messages[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def endpoint(release=None, status=200, seen=None):
+    async def app(scope, receive, send):
+        if seen is not None:
+            seen.append(_csot.get_timeout())
+        if release is not None:
+            await release.wait()
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": b'{"total_tasks": 4}'})
+    return app
+
+
+def middleware(app, limit=1, max_queue=0, queue_seconds=0.05, timeout_seconds=5.0, stale_entries=16):
+    classes = {name: RouteClass(name, limit, max_queue, queue_seconds, timeout_seconds) for name in ("cheap", "heavy")}
+    return AdmissionControlMiddleware(
+        app, route_classes=classes, stale=StaleResponses(stale_entries, 300, 1 << 20),
+        prefix="/api/v1", retry_after_seconds=2
+    )
+
+
+class TestRouteClass:
+    @pytest.mark.asyncio
+    async def test_queue_is_fifo_and_bounded(self):
+        route_class = RouteClass("heavy", limit=1, max_queue=2, queue_seconds=1.0, timeout_seconds=1.0)
+        assert await route_class.acquire()
+
+        first = asyncio.create_task(route_class.acquire())
+        second = asyncio.create_task(route_class.acquire())
+        await asyncio.sleep(0)
+        assert route_class.queued == 2
+        assert not await route_class.acquire()  # queue full: shed immediately
+
+        route_class.release()
+        assert await first
+        assert not second.done()
+        route_class.release()
+        assert await second
+        route_class.release()
+        assert route_class.active == 0
+
+    @pytest.mark.asyncio
+    async def test_queue_time_budget(self):
+        route_class = RouteClass("cheap", limit=1, max_queue=10, queue_seconds=0.01, timeout_seconds=1.0)
+        assert await route_class.acquire()
+
+        assert not await route_class.acquire()
+        assert route_class.queued == 0
+        route_class.release()
+        assert route_class.active == 0
+
+
+class TestAdmissionControl:
+    def test_classify(self):
+        admission = middleware(endpoint())
+        assert admission.classify("/api/v1/analytics/dashboard") == "cheap"
+        assert admission.classify("/api/v1/analytics/productivity") == "heavy"
+        assert admission.classify("/api/v1/analytics/projects/7/timeline") == "heavy"
+        assert admission.classify("/api/v1/analytics/projects/7/timeline/stream") is None
+        assert admission.classify("/api/v1/analytics/admin/export/task_events") is None
+        assert admission.classify("/health") is None
+
+    @pytest.mark.asyncio
+    async def test_sheds_with_retry_after(self):
+        release = asyncio.Event()
+        admission = middleware(endpoint(release))
+        before = metrics_registry.shed_requests.get(("heavy", "queue", "rejected"), 0)
+
+        running = asyncio.create_task(call(admission, scope("/api/v1/analytics/productivity")))
+        await asyncio.sleep(0)
+        status, headers, _ = await call(admission, scope("/api/v1/analytics/productivity"))
+        release.set()
+
+        assert status == 503
+        assert headers[b"retry-after"] == b"2"
+        assert (await running)[0] == 200
+        assert metrics_registry.shed_requests[("heavy", "queue", "rejected")] == before + 1
+
+    @pytest.mark.asyncio
+    async def test_route_classes_are_isolated(self):
+        release = asyncio.Event()
+        admission = middleware(endpoint(release))
+
+        running = asyncio.create_task(call(admission, scope("/api/v1/analytics/productivity")))
+        await asyncio.sleep(0)
+        cheap = asyncio.create_task(call(admission, scope("/api/v1/analytics/dashboard")))
+        await asyncio.sleep(0)
+        release.set()
+
+        assert (await cheap)[0] == 200
+        assert (await running)[0] == 200
+
+    @pytest.mark.asyncio
+    async def test_sheds_to_the_callers_last_response(self):
+        release = asyncio.Event()
+        release.set()
+        admission = middleware(endpoint(release))
+        assert (await call(admission, scope("/api/v1/analytics/dashboard")))[0] == 200
+
+        release.clear()
+        running = asyncio.create_task(call(admission, scope("/api/v1/analytics/dashboard")))
+        await asyncio.sleep(0)
+        status, headers, body = await call(admission, scope("/api/v1/analytics/dashboard"))
+        other_user = await call(admission, scope("/api/v1/analytics/dashboard", user="2"))
+        release.set()
+        await running
+
+        assert (status, body) == (200, b'{"total_tasks": 4}')
+        assert headers[b"x-load-shed"] == b"stale"
+        assert b"age" in headers
+        assert other_user[0] == 503
+
+    @pytest.mark.asyncio
+    async def test_strong_reads_are_never_served_stale(self):
+        release = asyncio.Event()
+        release.set()
+        admission = middleware(endpoint(release))
+        strong = [(b"x-read-consistency", b"strong")]
+        assert (await call(admission, scope("/api/v1/analytics/dashboard")))[0] == 200
+        assert (await call(admission, scope("/api/v1/analytics/dashboard", headers=strong)))[0] == 200
+
+        release.clear()
+        running = asyncio.create_task(call(admission, scope("/api/v1/analytics/dashboard")))
+        await asyncio.sleep(0)
+        status, headers, _ = await call(admission, scope("/api/v1/analytics/dashboard", headers=strong))
+        release.set()
+        await running
+
+        assert status == 503
+        assert headers[b"x-load-shed"] == b"rejected"
+
+    @pytest.mark.asyncio
+    async def test_operation_deadline(self):
+        seen = []
+        admission = middleware(endpoint(seen=seen), timeout_seconds=0.5)
+
+        await call(admission, scope("/api/v1/analytics/dashboard"))
+        await call(admission, scope("/health"))
+
+        assert 0 < seen[0] <= 0.5
+        assert seen[1] is None
+
+    @pytest.mark.asyncio
+    async def test_errors_after_the_deadline_are_shed(self):
+        async def timed_out(scope, receive, send):
+            await asyncio.sleep(0.02)
+            await endpoint(status=500)(scope, receive, send)
+
+        admission = middleware(timed_out, timeout_seconds=0.01)
+        status, headers, _ = await call(admission, scope("/api/v1/analytics/dashboard"))
+
+        assert status == 503
+        assert headers[b"x-load-shed"] == b"rejected"
@@ -1,9 +1,15 @@
 import pytest
 import asyncio
-from unittest.mock import Mock, AsyncMock
-from app.services.analytics_service import AnalyticsService
+from unittest.mock import Mock, AsyncMock, MagicMock
+from bson import ObjectId
+from app.services.analytics_service import (
+    AnalyticsService,
+    InvalidCursorError,
+    decode_timeline_cursor,
+    encode_timeline_cursor
+)
 from app.models import TaskEvent, ProjectEvent
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 
 
 @pytest.fixture
@@ -21,6 +27,39 @@ def mock_db():
     return db
 
 
+class AsyncCursor:
+    """Async-iterable stand-in for a Motor cursor"""
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.documents:
+            raise StopAsyncIteration
+        return self.documents.pop(0)
+
+    def close(self):
+        self.closed = True
+
+
+def make_task_events(count):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        {
+            "_id": ObjectId(),
+            "event": "task_created",
+            "task_id": i,
+            "title": f"Task {i}",
+            "timestamp": start + timedelta(minutes=i)
+        }
+        for i in range(count)
+    ]
+
+
 @pytest.fixture
 def sample_task_event():
     return TaskEvent(
@@ -50,10 +89,11 @@ class TestAnalyticsService:
     @pytest.mark.asyncio
     async def test_get_user_dashboard_no_data(self, analytics_service, mock_db, monkeypatch):
         """Test dashboard with no user data"""
+        mock_db.user_dashboard.find_one = AsyncMock(return_value=None)
         mock_db.user_metrics.find_one = AsyncMock(return_value=None)
         mock_db.task_events.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=[])
         
-        monkeypatch.setattr(analytics_service, '_get_db', lambda: mock_db)
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
         
         result = await analytics_service.get_user_dashboard(1)
         
@@ -65,27 +105,24 @@ class TestAnalyticsService:
 
     @pytest.mark.asyncio
     async def test_get_user_dashboard_with_data(self, analytics_service, mock_db, monkeypatch):
-        """Test dashboard with user data"""
-        user_metrics = {
+        """Test dashboard served from the materialized user_dashboard document"""
+        timestamp = datetime(2024, 1, 5, 9, 30, tzinfo=timezone.utc)
+        dashboard = {
+            "_id": "1",
             "total_tasks": 10,
             "completed_tasks": 7,
             "active_projects": 3,
-            "completion_rate": 0.7
+            "completion_rate": 0.7,
+            "recent_activity": [
+                {"type": "task", "event": "task_updated", "task_id": 1, "project_id": 1, "timestamp": timestamp}
+            ],
+            "version": 12,
+            "updated_at": timestamp
         }
         
-        recent_events = [
-            {
-                "event_type": "completed",
-                "task_id": 1,
-                "project_id": 1,
-                "timestamp": datetime.now(timezone.utc)
-            }
-        ]
+        mock_db.user_dashboard.find_one = AsyncMock(return_value=dashboard)
         
-        mock_db.user_metrics.find_one = AsyncMock(return_value=user_metrics)
-        mock_db.task_events.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=recent_events)
-        
-        monkeypatch.setattr(analytics_service, '_get_db', lambda: mock_db)
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
         
         result = await analytics_service.get_user_dashboard(1)
         
@@ -93,7 +130,32 @@ class TestAnalyticsService:
         assert result["completed_tasks"] == 7
         assert result["active_projects"] == 3
         assert result["completion_rate"] == 0.7
-        assert len(result["recent_activity"]) == 1
+        assert result["recent_activity"] == [
+            {"type": "task", "event": "task_updated", "task_id": 1, "project_id": 1, "timestamp": timestamp.isoformat()}
+        ]
+        # Validators come from the document served
+        assert (result["version"], result["updated_at"]) == (12, timestamp)
+        # One primary-key read: no metrics lookup and no sorted events query
+        mock_db.user_dashboard.find_one.assert_awaited_once_with({"_id": "1"})
+        mock_db.task_events.find.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_get_user_dashboard_before_materialization(self, analytics_service, mock_db, monkeypatch):
+        """Test users without a dashboard document are assembled from metrics and events"""
+        mock_db.user_dashboard.find_one = AsyncMock(return_value=None)
+        mock_db.user_metrics.find_one = AsyncMock(return_value={
+            "total_tasks": 2, "completed_tasks": 1, "active_projects": 1, "completion_rate": 0.5
+        })
+        mock_db.task_events.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=[
+            {"event": "task_created", "task_id": 4, "project_id": 2, "timestamp": datetime(2024, 1, 5, tzinfo=timezone.utc)}
+        ])
+
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        result = await analytics_service.get_user_dashboard(1)
+
+        assert result["total_tasks"] == 2
+        assert result["recent_activity"][0]["task_id"] == 4
 
     @pytest.mark.asyncio
     async def test_get_task_summary(self, analytics_service, mock_db, monkeypatch):
@@ -108,7 +170,7 @@ class TestAnalyticsService:
             {
                 "task_id": 1,
                 "project_id": 1,
-                "task_data": {"title": "Completed Task"},
+                "title": "Completed Task",
                 "timestamp": datetime.now(timezone.utc)
             }
         ]
@@ -116,7 +178,7 @@ class TestAnalyticsService:
         mock_db.user_metrics.find_one = AsyncMock(return_value=user_metrics)
         mock_db.task_events.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=recent_completions)
         
-        monkeypatch.setattr(analytics_service, '_get_db', lambda: mock_db)
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
         
         result = await analytics_service.get_task_summary(1)
         
@@ -126,13 +188,14 @@ class TestAnalyticsService:
         assert result["completion_rate"] == 0.667
         assert result["tasks_by_status"]["completed"] == 10
         assert result["tasks_by_status"]["pending"] == 5
+        assert result["recent_completions"][0]["title"] == "Completed Task"
 
     @pytest.mark.asyncio
     async def test_get_project_analytics_not_found(self, analytics_service, mock_db, monkeypatch):
         """Test project analytics when project not found"""
         mock_db.project_metrics.find_one = AsyncMock(return_value=None)
         
-        monkeypatch.setattr(analytics_service, '_get_db', lambda: mock_db)
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
         
         result = await analytics_service.get_project_analytics(1, 1)
         
@@ -152,17 +215,18 @@ class TestAnalyticsService:
         
         task_events = [
             {
-                "event_type": "created",
+                "_id": ObjectId(),
+                "event": "task_created",
                 "task_id": 1,
-                "task_data": {"title": "Task 1"},
+                "title": "Task 1",
                 "timestamp": datetime.now(timezone.utc)
             }
         ]
         
         mock_db.project_metrics.find_one = AsyncMock(return_value=project_metrics)
-        mock_db.task_events.find.return_value.sort.return_value.to_list = AsyncMock(return_value=task_events)
+        mock_db.task_events.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=task_events)
         
-        monkeypatch.setattr(analytics_service, '_get_db', lambda: mock_db)
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
         
         result = await analytics_service.get_project_analytics(1, 1)
         
@@ -173,6 +237,8 @@ class TestAnalyticsService:
         assert result["completion_rate"] == 0.625
         assert result["task_distribution"]["completed"] == 5
         assert result["task_distribution"]["pending"] == 3
+        assert result["timeline"][0]["task_title"] == "Task 1"
+        assert result["timeline_next_cursor"] is None
 
     @pytest.mark.asyncio
     async def test_get_productivity_insights(self, analytics_service, mock_db, monkeypatch):
@@ -184,13 +250,161 @@ class TestAnalyticsService:
         ]
         
         mock_db.task_events.find.return_value.to_list = AsyncMock(return_value=task_events)
+        mock_db.user_metrics.find_one = AsyncMock(return_value={"version": 7, "updated_at": None})
+        session = MagicMock()
+        mock_db.client.start_session = AsyncMock(return_value=session)
         
-        monkeypatch.setattr(analytics_service, '_get_db', lambda: mock_db)
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
         
         result = await analytics_service.get_productivity_insights(1)
         
+        # The version is read first, in the session the events are read in
+        assert mock_db.user_metrics.find_one.await_args.kwargs["session"] is session.__aenter__.return_value
+        assert mock_db.task_events.find.call_args.kwargs["session"] is session.__aenter__.return_value
+        assert result["version"] == 7
         assert "daily_completions" in result
         assert "weekly_summary" in result
         assert "productivity_score" in result
         assert "recommendations" in result
-        assert isinstance(result["recommendations"], list)
\ No newline at end of file
+        assert isinstance(result["recommendations"], list)
+
+class TestProjectTimeline:
+    @pytest.mark.asyncio
+    async def test_timeline_page_returns_next_cursor(self, analytics_service, mock_db, monkeypatch):
+        """A full page returns a cursor pointing at its last event"""
+        task_events = make_task_events(3)
+        to_list = AsyncMock(return_value=task_events)
+        mock_db.task_events.find.return_value.sort.return_value.limit.return_value.to_list = to_list
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        result = await analytics_service.get_project_timeline(1, 1, limit=2)
+
+        assert [event["task_id"] for event in result["events"]] == [0, 1]
+        assert decode_timeline_cursor(result["next_cursor"])[1] == task_events[1]["_id"]
+        mock_db.task_events.find.return_value.sort.return_value.limit.assert_called_with(3)
+
+    @pytest.mark.asyncio
+    async def test_timeline_last_page_has_no_cursor(self, analytics_service, mock_db, monkeypatch):
+        """The final page does not return a cursor"""
+        mock_db.task_events.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(
+            return_value=make_task_events(2)
+        )
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        result = await analytics_service.get_project_timeline(1, 1, limit=2)
+
+        assert len(result["events"]) == 2
+        assert result["next_cursor"] is None
+
+    @pytest.mark.asyncio
+    async def test_timeline_cursor_continues_after_position(self, analytics_service, mock_db, monkeypatch):
+        """A cursor turns into a (timestamp, _id) keyset predicate"""
+        event = make_task_events(1)[0]
+        mock_db.task_events.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=[])
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        await analytics_service.get_project_timeline(1, 1, cursor=encode_timeline_cursor(event))
+
+        query = mock_db.task_events.find.call_args[0][0]
+        assert query["user_id"] == "1"
+        assert query["$or"] == [
+            {"timestamp": {"$gt": event["timestamp"]}},
+            {"timestamp": event["timestamp"], "_id": {"$gt": event["_id"]}}
+        ]
+
+    def test_invalid_cursor_is_rejected(self):
+        """Garbage cursors raise InvalidCursorError"""
+        with pytest.raises(InvalidCursorError):
+            decode_timeline_cursor("not-a-cursor")
+
+    @pytest.mark.asyncio
+    async def test_stream_timeline_yields_events_with_cursors(self, analytics_service, mock_db, monkeypatch):
+        """Streaming yields every event with a resumable cursor and closes the Motor cursor"""
+        task_events = make_task_events(3)
+        cursor = AsyncCursor(task_events)
+        mock_db.task_events.find.return_value.sort.return_value = cursor
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        events = [event async for event in analytics_service.stream_project_timeline(1, 1)]
+
+        assert [event["task_id"] for event in events] == [0, 1, 2]
+        assert decode_timeline_cursor(events[-1]["cursor"])[1] == task_events[-1]["_id"]
+        assert cursor.closed
+
+
+class TestBatchProjectAnalytics:
+    @pytest.mark.asyncio
+    async def test_batch_uses_one_metrics_and_one_grouped_query(self, analytics_service, mock_db, monkeypatch):
+        """Batch analytics issues a single $in query and a single aggregation"""
+        last_activity = datetime(2024, 1, 2, tzinfo=timezone.utc)
+        mock_db.project_metrics.find.return_value.to_list = AsyncMock(return_value=[
+            {"project_id": 2, "project_name": "Two", "total_tasks": 4, "completed_tasks": 1, "completion_rate": 0.25},
+            {"project_id": 1, "project_name": "One", "total_tasks": 2, "completed_tasks": 2, "completion_rate": 1.0},
+        ])
+        mock_db.task_events.aggregate.return_value.to_list = AsyncMock(return_value=[
+            {
+                "_id": 1,
+                "event_count": 3,
+                "last_activity": last_activity,
+                "recent_timeline": [
+                    {"event": "task_updated", "task_id": 7, "title": "Done", "timestamp": last_activity}
+                ]
+            }
+        ])
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        result = await analytics_service.get_projects_analytics([1, 2, 3, 1], 5)
+
+        metrics_query = mock_db.project_metrics.find.call_args[0][0]
+        assert metrics_query == {"user_id": "5", "project_id": {"$in": [1, 2, 3]}}
+        pipeline = mock_db.task_events.aggregate.call_args[0][0]
+        assert pipeline[0]["$match"]["project_id"] == {"$in": [2, 1]}
+        assert mock_db.task_events.aggregate.call_count == 1
+
+        assert [project["project_id"] for project in result["projects"]] == [1, 2]
+        assert result["projects"][0]["event_count"] == 3
+        assert result["projects"][0]["recent_timeline"][0]["task_title"] == "Done"
+        assert result["projects"][1]["event_count"] == 0
+        assert result["projects"][1]["task_distribution"] == {"completed": 1, "pending": 3}
+        assert result["missing_project_ids"] == [3]
+
+    @pytest.mark.asyncio
+    async def test_batch_skips_event_query_when_nothing_found(self, analytics_service, mock_db, monkeypatch):
+        """No aggregation runs when none of the projects belong to the user"""
+        mock_db.project_metrics.find.return_value.to_list = AsyncMock(return_value=[])
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        result = await analytics_service.get_projects_analytics([1, 2], 5)
+
+        mock_db.task_events.aggregate.assert_not_called()
+        assert result == {"projects": [], "missing_project_ids": [1, 2]}
+
+
+class TestLeaderboards:
+    @pytest.mark.asyncio
+    async def test_user_leaderboard_reads_top_n_by_sorted_key(self, analytics_service, mock_db, monkeypatch):
+        """User leaderboard sorts on an indexed key and reads only N documents"""
+        last_activity = datetime(2024, 1, 2, tzinfo=timezone.utc)
+        mock_db.user_metrics.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=[
+            {"user_id": "2", "username": "b", "completed_tasks": 9, "last_activity": last_activity},
+            {"user_id": "1", "username": "a", "completed_tasks": 4, "last_activity": None},
+        ])
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        result = await analytics_service.get_user_leaderboard("completions", limit=2)
+
+        mock_db.user_metrics.find.return_value.sort.assert_called_with([("completed_tasks", -1), ("completion_rate", -1)])
+        mock_db.user_metrics.find.return_value.sort.return_value.limit.assert_called_with(2)
+        assert [entry["rank"] for entry in result["entries"]] == [1, 2]
+        assert result["entries"][0]["last_activity"] == last_activity.isoformat()
+
+    @pytest.mark.asyncio
+    async def test_project_leaderboard_recent_activity(self, analytics_service, mock_db, monkeypatch):
+        """Project leaderboard orders by last activity"""
+        mock_db.project_metrics.find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=[])
+        monkeypatch.setattr(analytics_service, '_get_db', lambda *args: mock_db)
+
+        result = await analytics_service.get_project_leaderboard("recent_activity", limit=5)
+
+        mock_db.project_metrics.find.return_value.sort.assert_called_with([("last_activity", -1)])
+        assert result == {"metric": "recent_activity", "entries": []}
@@ -1,8 +1,11 @@
+import json
 import pytest
+from datetime import datetime, timezone
 from unittest.mock import Mock, AsyncMock
 from fastapi.testclient import TestClient
 from app.main import app
-from app.auth import get_current_user
+from app.auth import get_admin_user as get_current_user
+from app.database import mongodb
 
 
 @pytest.fixture 
@@ -22,12 +25,15 @@ def mock_current_user():
 @pytest.fixture
 def mock_analytics_service():
     service = Mock()
+    service.get_metrics_version = AsyncMock(return_value={"version": 3, "updated_at": datetime(2024, 1, 1, 12, 0, 0)})
     service.get_user_dashboard = AsyncMock(return_value={
         "total_tasks": 5,
         "completed_tasks": 3,
         "active_projects": 2,
         "completion_rate": 0.6,
-        "recent_activity": []
+        "recent_activity": [],
+        "version": 3,
+        "updated_at": datetime(2024, 1, 1, 12, 0, 0)
     })
     service.get_task_summary = AsyncMock(return_value={
         "total_tasks": 5,
@@ -35,13 +41,17 @@ def mock_analytics_service():
         "pending_tasks": 2,
         "completion_rate": 0.6,
         "tasks_by_status": {"completed": 3, "pending": 2},
-        "recent_completions": []
+        "recent_completions": [],
+        "version": 3,
+        "updated_at": datetime(2024, 1, 1, 12, 0, 0)
     })
     service.get_productivity_insights = AsyncMock(return_value={
         "daily_completions": {"2024-01-01": 2},
         "weekly_summary": {"total_completions": 2, "avg_daily_completions": 0.29},
         "productivity_score": 5.8,
-        "recommendations": ["Try to complete at least one task per day"]
+        "recommendations": ["Try to complete at least one task per day"],
+        "version": 3,
+        "updated_at": datetime(2024, 1, 1, 12, 0, 0)
     })
     service.get_project_analytics = AsyncMock(return_value={
         "project_id": 1,
@@ -51,17 +61,50 @@ def mock_analytics_service():
         "completion_rate": 0.67,
         "avg_completion_time_hours": None,
         "task_distribution": {"completed": 2, "pending": 1},
-        "timeline": []
+        "timeline": [],
+        "version": 3,
+        "updated_at": datetime(2024, 1, 1, 12, 0, 0)
+    })
+    service.get_completion_times = AsyncMock(return_value={
+        "count": 2, "mean_hours": 5.0, "p50_hours": 4.0, "p90_hours": 6.0, "p99_hours": 6.0
     })
     return service
 
 
 class TestAnalyticsAPI:
-    def test_health_endpoint(self, client):
+    def test_health_endpoint(self, client, monkeypatch):
         """Test health check endpoint"""
+        monkeypatch.setattr(mongodb, "client", Mock())
+        monkeypatch.setattr(mongodb, "database", Mock())
+        monkeypatch.setattr(mongodb, "index_status", {"status": "ready", "completed": 11, "total": 11, "error": None})
+
+        response = client.get("/health")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["status"] == "ready"
+        assert data["service"] == "analytics-service"
+        assert data["checks"]["database"] == "connected"
+
+    def test_health_degraded_while_indexes_build(self, client, monkeypatch):
+        """Test health reports degraded but serving while indexes are building"""
+        monkeypatch.setattr(mongodb, "client", Mock())
+        monkeypatch.setattr(mongodb, "database", Mock())
+        monkeypatch.setattr(mongodb, "index_status", {"status": "building", "completed": 3, "total": 11, "error": None})
+
         response = client.get("/health")
         assert response.status_code == 200
-        assert response.json() == {"status": "ok", "service": "analytics-service"}
+        data = response.json()
+        assert data["status"] == "degraded"
+        assert data["checks"]["indexes"]["completed"] == 3
+
+    def test_health_unavailable_without_database(self, client, monkeypatch):
+        """Test health fails readiness when there is no database connection"""
+        monkeypatch.setattr(mongodb, "client", None)
+        monkeypatch.setattr(mongodb, "database", None)
+
+        response = client.get("/health")
+        assert response.status_code == 503
+        assert response.json()["status"] == "unavailable"
 
     def test_root_endpoint(self, client):
         """Test root endpoint"""
@@ -75,7 +118,7 @@ class TestAnalyticsAPI:
     def test_dashboard_unauthorized(self, client):
         """Test dashboard endpoint without authentication"""
         response = client.get("/api/v1/analytics/dashboard")
-        assert response.status_code == 403  # FastAPI returns 403 for missing auth
+        assert response.status_code == 401  # a missing token is rejected like an invalid one
 
     def test_dashboard_with_auth(self, client, mock_current_user, mock_analytics_service, monkeypatch):
         """Test dashboard endpoint with authentication"""
@@ -144,10 +187,382 @@ class TestAnalyticsAPI:
         app.dependency_overrides[get_current_user] = lambda: mock_current_user
         
         mock_service = Mock()
+        mock_service.get_metrics_version = AsyncMock(return_value=None)
         mock_service.get_project_analytics = AsyncMock(return_value=None)
         monkeypatch.setattr("app.api.analytics.analytics_service", mock_service)
         
         response = client.get("/api/v1/analytics/projects/999")
         assert response.status_code == 404
         
-        app.dependency_overrides.clear()
\ No newline at end of file
+        app.dependency_overrides.clear()
+    def test_project_timeline_with_auth(self, client, mock_current_user, monkeypatch):
+        """Test paginated project timeline endpoint"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+
+        mock_service = Mock()
+        mock_service.get_metrics_version = AsyncMock(return_value=None)
+        mock_service.get_project_timeline = AsyncMock(return_value={
+            "project_id": 1,
+            "events": [{"event_type": "task_created", "task_id": 1}],
+            "next_cursor": "abc"
+        })
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_service)
+
+        response = client.get("/api/v1/analytics/projects/1/timeline?limit=1&cursor=xyz")
+        assert response.status_code == 200
+        assert response.json()["next_cursor"] == "abc"
+        mock_service.get_project_timeline.assert_awaited_once_with(1, 1, cursor="xyz", limit=1)
+
+        app.dependency_overrides.clear()
+
+    def test_project_timeline_invalid_cursor(self, client, mock_current_user, monkeypatch):
+        """Test that a malformed cursor is a client error"""
+        from app.services.analytics_service import InvalidCursorError
+
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+
+        mock_service = Mock()
+        mock_service.get_metrics_version = AsyncMock(return_value=None)
+        mock_service.get_project_timeline = AsyncMock(side_effect=InvalidCursorError("bad"))
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_service)
+
+        response = client.get("/api/v1/analytics/projects/1/timeline?cursor=bad")
+        assert response.status_code == 400
+
+        app.dependency_overrides.clear()
+
+    def test_project_timeline_stream(self, client, mock_current_user, monkeypatch):
+        """Test NDJSON timeline streaming"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+
+        async def events():
+            for task_id in (1, 2):
+                yield {"event_type": "task_created", "task_id": task_id, "cursor": f"c{task_id}"}
+
+        mock_service = Mock()
+        mock_service.stream_project_timeline = Mock(return_value=events())
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_service)
+
+        response = client.get("/api/v1/analytics/projects/1/timeline/stream")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        assert [line["task_id"] for line in lines] == [1, 2]
+
+        app.dependency_overrides.clear()
+
+    def test_batch_project_analytics(self, client, mock_current_user, monkeypatch):
+        """Test batch project analytics endpoint"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+
+        mock_service = Mock()
+        mock_service.get_projects_analytics = AsyncMock(return_value={
+            "projects": [{
+                "project_id": 1,
+                "project_name": "Test Project",
+                "total_tasks": 3,
+                "completed_tasks": 2,
+                "completion_rate": 0.67,
+                "avg_completion_time_hours": None,
+                "task_distribution": {"completed": 2, "pending": 1},
+                "event_count": 5,
+                "last_activity": None,
+                "recent_timeline": []
+            }],
+            "missing_project_ids": [2]
+        })
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_service)
+
+        response = client.post("/api/v1/analytics/projects/batch", json={"project_ids": [1, 2]})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["projects"][0]["project_id"] == 1
+        assert data["missing_project_ids"] == [2]
+        mock_service.get_projects_analytics.assert_awaited_once_with([1, 2], 1, timeline_limit=5)
+
+        app.dependency_overrides.clear()
+
+    def test_batch_project_analytics_too_many_projects(self, client, mock_current_user, monkeypatch):
+        """Test batch endpoint rejects oversized requests"""
+        from app.config import settings
+
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+
+        project_ids = list(range(settings.BATCH_MAX_PROJECTS + 1))
+        response = client.post("/api/v1/analytics/projects/batch", json={"project_ids": project_ids})
+        assert response.status_code == 400
+
+        app.dependency_overrides.clear()
+
+    def test_user_leaderboard_requires_admin(self, client):
+        """Test leaderboard rejects non-admin users"""
+        response = client.get(
+            "/api/v1/analytics/admin/leaderboard/users",
+            headers={"X-User-Id": "1", "X-Username": "testuser", "X-User-Role": "User"}
+        )
+        assert response.status_code == 403
+
+    def test_user_leaderboard_as_admin(self, client, monkeypatch):
+        """Test leaderboard for admin users"""
+        mock_service = Mock()
+        mock_service.get_user_leaderboard = AsyncMock(return_value={
+            "metric": "completion_rate",
+            "entries": [{"rank": 1, "user_id": "1", "completion_rate": 1.0}]
+        })
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_service)
+
+        response = client.get(
+            "/api/v1/analytics/admin/leaderboard/users?metric=completion_rate&limit=3",
+            headers={"X-User-Id": "1", "X-Username": "admin", "X-User-Role": "Admin"}
+        )
+        assert response.status_code == 200
+        assert response.json()["entries"][0]["rank"] == 1
+        mock_service.get_user_leaderboard.assert_awaited_once_with("completion_rate", 3)
+
+    def test_project_leaderboard_rejects_unknown_metric(self, client):
+        """Test leaderboard validates the metric"""
+        response = client.get(
+            "/api/v1/analytics/admin/leaderboard/projects?metric=bogus",
+            headers={"X-User-Id": "1", "X-Username": "admin", "X-User-Role": "Admin"}
+        )
+        assert response.status_code == 422
+
+    def test_dashboard_read_your_writes(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """Test X-Read-Consistency: strong keeps the dashboard reads on the primary"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        client.get("/api/v1/analytics/dashboard")
+        assert mock_analytics_service.get_user_dashboard.call_args.kwargs["consistent"] is False
+
+        client.get("/api/v1/analytics/dashboard", headers={"X-Read-Consistency": "strong"})
+        assert mock_analytics_service.get_user_dashboard.call_args.kwargs["consistent"] is True
+
+        app.dependency_overrides.clear()
+
+    def test_dashboard_sets_validators(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """Test dashboard responses carry ETag and Last-Modified"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        response = client.get("/api/v1/analytics/dashboard")
+        assert response.status_code == 200
+        assert response.headers["etag"].startswith('W/"')
+        assert response.headers["last-modified"] == "Mon, 01 Jan 2024 12:00:00 GMT"
+        assert "version" not in response.json() and "updated_at" not in response.json()
+
+        app.dependency_overrides.clear()
+
+    def test_dashboard_not_modified(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """Test a matching If-None-Match answers 304 without the percentile reads"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        etag = client.get("/api/v1/analytics/dashboard").headers["etag"]
+        mock_analytics_service.get_completion_times.reset_mock()
+
+        response = client.get("/api/v1/analytics/dashboard", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.headers["etag"] == etag
+        mock_analytics_service.get_completion_times.assert_not_awaited()
+        mock_analytics_service.get_metrics_version.assert_not_awaited()
+
+        app.dependency_overrides.clear()
+
+    def test_dashboard_modified_after_version_change(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """Test a new dashboard version invalidates the previous ETag"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        etag = client.get("/api/v1/analytics/dashboard").headers["etag"]
+        mock_analytics_service.get_user_dashboard.return_value = {
+            **mock_analytics_service.get_user_dashboard.return_value,
+            "completed_tasks": 4, "version": 4, "updated_at": datetime(2024, 1, 1, 12, 5, 0)
+        }
+
+        response = client.get("/api/v1/analytics/dashboard", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+        app.dependency_overrides.clear()
+
+    def test_summary_if_modified_since(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """Test If-Modified-Since is honoured when no If-None-Match is sent"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        response = client.get(
+            "/api/v1/analytics/tasks/summary",
+            headers={"If-Modified-Since": "Mon, 01 Jan 2024 12:00:00 GMT"}
+        )
+        assert response.status_code == 304
+
+        response = client.get(
+            "/api/v1/analytics/tasks/summary",
+            headers={"If-Modified-Since": "Mon, 01 Jan 2024 11:59:59 GMT"}
+        )
+        assert response.status_code == 200
+
+        app.dependency_overrides.clear()
+
+    def test_validators_come_from_the_body_read(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """A body read from a staler member than the version lookup is sent with its own, older ETag"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        for url in ("/api/v1/analytics/productivity", "/api/v1/analytics/tasks/summary", "/api/v1/analytics/projects/1"):
+            mock_analytics_service.get_metrics_version.return_value = {
+                "version": 3, "updated_at": datetime(2024, 1, 1, 12, 0, 0)
+            }
+            stale_etag = client.get(url).headers["etag"]
+            # The lookup now sees version 4, the body read still version 3
+            mock_analytics_service.get_metrics_version.return_value = {
+                "version": 4, "updated_at": datetime(2024, 1, 1, 13, 0, 0)
+            }
+            response = client.get(url)
+            assert response.status_code == 200
+            assert response.headers["etag"] == stale_etag
+            assert "version" not in response.json()
+
+        app.dependency_overrides.clear()
+
+    def test_if_modified_since_ignored_for_volatile_validators(self, client, mock_current_user,
+                                                                mock_analytics_service, monkeypatch):
+        """Test responses depending on the date or a window send no Last-Modified and ignore If-Modified-Since"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        mock_analytics_service.get_activity_window = AsyncMock(return_value={
+            "from": "2024-01-01T00:00:00+00:00", "to": "2024-01-03T00:00:00+00:00", "granularity": "day",
+            "totals": {"events": 0, "created": 0, "completed": 0, "deleted": 0},
+            "series": []
+        })
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+        headers = {"If-Modified-Since": "Mon, 01 Jan 2024 12:00:00 GMT"}
+
+        for url in ("/api/v1/analytics/productivity",
+                    "/api/v1/analytics/tasks/summary?from=2024-01-01T00:00:00&to=2024-01-03T00:00:00&granularity=day"):
+            response = client.get(url, headers=headers)
+            assert response.status_code == 200
+            assert "last-modified" not in response.headers
+            assert client.get(url, headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+        app.dependency_overrides.clear()
+
+    def test_dashboard_window(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """Test from/to/granularity attach a bucket-aligned activity window"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        mock_analytics_service.get_activity_window = AsyncMock(return_value={
+            "from": "2024-01-01T00:00:00+00:00", "to": "2024-01-03T00:00:00+00:00", "granularity": "day",
+            "totals": {"events": 2, "created": 1, "completed": 1, "deleted": 0},
+            "series": []
+        })
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        response = client.get(
+            "/api/v1/analytics/dashboard?from=2024-01-01T06:00:00&to=2024-01-02T18:00:00&granularity=day"
+        )
+        assert response.status_code == 200
+        assert response.json()["window"]["totals"]["completed"] == 1
+        window = mock_analytics_service.get_activity_window.call_args.args[1]
+        assert window["start"] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+        assert window["end"] == datetime(2024, 1, 3, tzinfo=timezone.utc)
+
+        mock_analytics_service.get_activity_window.reset_mock()
+        client.get("/api/v1/analytics/dashboard")
+        mock_analytics_service.get_activity_window.assert_not_awaited()
+
+        app.dependency_overrides.clear()
+
+    def test_window_validation(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """Test inverted windows and windows with too many buckets are rejected"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        response = client.get("/api/v1/analytics/productivity?from=2024-02-01T00:00:00&to=2024-01-01T00:00:00")
+        assert response.status_code == 400
+
+        response = client.get("/api/v1/analytics/tasks/summary?from=2020-01-01T00:00:00&granularity=hour")
+        assert response.status_code == 400
+
+        response = client.get("/api/v1/analytics/dashboard?granularity=year")
+        assert response.status_code == 422
+
+        app.dependency_overrides.clear()
+
+    def test_project_completion_time_percentiles(self, client, mock_current_user, mock_analytics_service, monkeypatch):
+        """Test project analytics fill the mean and percentiles from the merged sketches"""
+        app.dependency_overrides[get_current_user] = lambda: mock_current_user
+        monkeypatch.setattr("app.api.analytics.analytics_service", mock_analytics_service)
+
+        data = client.get("/api/v1/analytics/projects/1").json()
+        assert data["avg_completion_time_hours"] == 5.0
+        assert data["completion_time"]["p90_hours"] == 6.0
+        assert mock_analytics_service.get_completion_times.call_args.kwargs["window"] is None
+
+        client.get("/api/v1/analytics/projects/1?granularity=week")
+        assert mock_analytics_service.get_completion_times.call_args.kwargs["window"]["granularity"] == "week"
+
+        app.dependency_overrides.clear()
+
+    def test_active_users_requires_admin(self, client):
+        """Test active user counts are only available to platform admins"""
+        response = client.get(
+            "/api/v1/analytics/admin/active-users",
+            headers={"X-User-Id": "1", "X-Username": "testuser", "X-User-Role": "User"}
+        )
+        assert response.status_code == 403
+
+    def test_active_user_series_windows(self, client, monkeypatch):
+        """Test active user series default to 30 days and reject hourly buckets"""
+        service = Mock()
+        service.get_active_user_series = AsyncMock(return_value={
+            "project_id": None, "from": "2024-01-01T00:00:00+00:00", "to": "2024-01-31T00:00:00+00:00",
+            "granularity": "day", "active_users": 42, "series": []
+        })
+        monkeypatch.setattr("app.api.analytics.analytics_service", service)
+        headers = {"X-User-Id": "1", "X-Username": "admin", "X-User-Role": "Admin"}
+
+        response = client.get("/api/v1/analytics/admin/active-users/series", headers=headers)
+        assert response.status_code == 200
+        window = service.get_active_user_series.call_args.args[0]
+        assert window["granularity"] == "day"
+        assert (window["end"] - window["start"]).days == 31
+
+        response = client.get("/api/v1/analytics/admin/active-users/series?granularity=hour", headers=headers)
+        assert response.status_code == 400
+
+        response = client.get(
+            "/api/v1/analytics/admin/active-users/series?from=2020-01-01T00:00:00&to=2024-01-01T00:00:00",
+            headers=headers
+        )
+        assert response.status_code == 400
+
+    def test_export_stream(self, client, monkeypatch):
+        """Test a day's export streams as zstd NDJSON and resume positions are validated"""
+        import zstandard
+        from bson import ObjectId
+
+        async def batches(*args):
+            yield [{"_id": ObjectId(), "event": "task_created", "timestamp": datetime(2024, 1, 5, 9, 0)}]
+            yield [{"_id": ObjectId(), "event": "task_updated", "timestamp": datetime(2024, 1, 5, 10, 0)}]
+
+        service = Mock()
+        service.export_batches = Mock(side_effect=batches)
+        monkeypatch.setattr("app.api.analytics.analytics_service", service)
+        headers = {"X-User-Id": "1", "X-Username": "admin", "X-User-Role": "Admin"}
+
+        response = client.get("/api/v1/analytics/admin/export/task_events?day=2024-01-05", headers=headers)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/zstd"
+        assert "task_events-2024-01-05.ndjson.zst" in response.headers["content-disposition"]
+        lines = zstandard.ZstdDecompressor().decompressobj().decompress(response.content).splitlines()
+        assert [json.loads(line)["event"] for line in lines] == ["task_created", "task_updated"]
+        collection, after, start, end = service.export_batches.call_args.args
+        assert (collection, after) == ("task_events", None)
+        assert (start, end) == (datetime(2024, 1, 5, tzinfo=timezone.utc), datetime(2024, 1, 6, tzinfo=timezone.utc))
+
+        response = client.get(
+            "/api/v1/analytics/admin/export/task_events?after_timestamp=2024-01-05T09:00:00", headers=headers
+        )
+        assert response.status_code == 400
+        response = client.get("/api/v1/analytics/admin/export/users", headers=headers)
+        assert response.status_code == 422
@@ -0,0 +1,55 @@
+from argparse import Namespace
+import pytest
+from benchmarks.dataset import generate_dataset
+from benchmarks.fake_mongo import FakeDatabase
+from benchmarks.run import SCENARIOS, run
+
+
+def benchmark_args(**overrides):
+    args = dict(
+        users=20, days=10, mean_events=20, seed=7, concurrency=4, requests=8, warmup=2,
+        only=None, mongodb_url=None, database="analytics_benchmark", keep_data=False
+    )
+    args.update(overrides)
+    return Namespace(**args)
+
+
+class TestDataset:
+    def test_generation_is_deterministic(self):
+        """The same seed always produces the same events"""
+        first = generate_dataset(users=10, mean_events=10, seed=3)
+        second = generate_dataset(users=10, mean_events=10, seed=3)
+        assert [e["task_id"] for e in first.task_events] == [e["task_id"] for e in second.task_events]
+        assert len(first.user_metrics) == 10
+
+
+class TestFakeMongo:
+    @pytest.mark.asyncio
+    async def test_find_sort_limit_and_group(self):
+        """The stand-in supports the query shapes the service issues"""
+        database = FakeDatabase()
+        await database.task_events.insert_many([
+            {"user_id": "1", "project_id": p, "timestamp": t} for p, t in [(1, 3), (1, 1), (2, 2)]
+        ])
+
+        latest = await database.task_events.find({"user_id": "1", "project_id": {"$in": [1]}}).sort(
+            "timestamp", -1).limit(1).to_list(1)
+        groups = await database.task_events.aggregate([
+            {"$match": {"user_id": "1"}},
+            {"$group": {"_id": "$project_id", "count": {"$sum": 1}, "last": {"$max": "$timestamp"}}}
+        ]).to_list(None)
+
+        assert latest[0]["timestamp"] == 3
+        assert sorted((g["_id"], g["count"], g["last"]) for g in groups) == [(1, 2, 3), (2, 1, 2)]
+
+
+class TestBenchmarkRun:
+    @pytest.mark.asyncio
+    async def test_every_endpoint_succeeds(self):
+        """A short run exercises every scenario without errors"""
+        report = await run(benchmark_args())
+
+        assert set(report["results"]) == {scenario.name for scenario in SCENARIOS}
+        for name, stats in report["results"].items():
+            assert stats["errors"] == 0, name
+            assert stats["requests"] == 8
@@ -0,0 +1,91 @@
+import zlib
+import brotli
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.testclient import TestClient
+from app.compression import CompressionMiddleware, negotiate_encoding
+
+
+@pytest.fixture
+def client():
+    app = FastAPI(default_response_class=ORJSONResponse)
+    app.add_middleware(CompressionMiddleware, minimum_size=100)
+
+    @app.get("/small")
+    async def small():
+        return {"ok": True}
+
+    @app.get("/large")
+    async def large():
+        return {"timeline": [{"event_type": "task_created", "task_id": i} for i in range(200)]}
+
+    @app.get("/stream")
+    async def stream():
+        async def lines():
+            for i in range(3):
+                yield f'{{"task_id": {i}}}\n'.encode()
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.get("/events")
+    async def events():
+        async def lines():
+            yield b"data: " + b"x" * 500 + b"\n\n"
+        return StreamingResponse(lines(), media_type="text/event-stream")
+
+    return TestClient(app)
+
+
+class TestNegotiation:
+    @pytest.mark.parametrize("header,expected", [
+        ("gzip, deflate, br", "br"),
+        ("gzip", "gzip"),
+        ("br;q=0, gzip;q=0.5", "gzip"),
+        ("identity", None),
+        ("", None),
+    ])
+    def test_negotiate_encoding(self, header, expected):
+        """Brotli is preferred when acceptable, gzip otherwise"""
+        assert negotiate_encoding(header) == expected
+
+
+class TestCompressionMiddleware:
+    def test_small_responses_are_not_compressed(self, client):
+        """Bodies below the threshold are sent as-is"""
+        response = client.get("/small", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+        assert response.json() == {"ok": True}
+
+    def test_large_responses_are_gzipped(self, client):
+        """Bodies above the threshold are gzip-compressed with a matching Content-Length"""
+        response = client.get("/large", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert int(response.headers["content-length"]) < len(response.content)
+        assert len(response.json()["timeline"]) == 200
+
+    def test_large_responses_prefer_brotli(self, client):
+        """Brotli is used when the client accepts it"""
+        response = client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+        assert response.headers["content-encoding"] == "br"
+        assert len(response.json()["timeline"]) == 200
+
+    def test_streams_are_flushed_per_chunk(self, client):
+        """Each streamed chunk can be decoded as soon as it arrives"""
+        with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as response:
+            assert response.headers["content-encoding"] == "gzip"
+            assert "content-length" not in response.headers
+            decoder = zlib.decompressobj(31)
+            decoded = b"".join(decoder.decompress(chunk) for chunk in response.iter_raw())
+        assert decoded.splitlines() == [b'{"task_id": 0}', b'{"task_id": 1}', b'{"task_id": 2}']
+
+    def test_event_streams_are_not_compressed(self, client):
+        """Server-Sent Events pass through uncompressed"""
+        response = client.get("/events", headers={"Accept-Encoding": "gzip, br"})
+        assert "content-encoding" not in response.headers
+
+    def test_brotli_round_trip(self, client):
+        """Raw brotli bodies decode to the original JSON"""
+        with client.stream("GET", "/large", headers={"Accept-Encoding": "br"}) as response:
+            raw = b"".join(response.iter_raw())
+        assert brotli.decompress(raw).startswith(b'{"timeline":')
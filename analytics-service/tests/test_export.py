@@ -0,0 +1,102 @@
+import json
+import os
+import pytest
+import zstandard
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from benchmarks.fake_mongo import FakeDatabase
+from app import export
+from app.export import export_collection, load_watermark
+
+START = datetime(2024, 3, 1, 22, tzinfo=timezone.utc)
+
+
+def task_events(count, start=START):
+    return [
+        {"_id": ObjectId(), "event": "task_created", "task_id": i, "project_id": 1, "user_id": "1",
+         "username": "testuser", "title": f"Task {i}", "status": "pending",
+         "timestamp": start + timedelta(minutes=30 * i)}
+        for i in range(count)
+    ]
+
+
+def read_ndjson(path):
+    with open(path, "rb") as f:
+        data = zstandard.ZstdDecompressor().stream_reader(f).read()
+    return [json.loads(line) for line in data.splitlines()]
+
+
+def exported(output, suffix=".ndjson.zst"):
+    files = []
+    for directory, _, names in os.walk(os.path.join(output, "task_events")):
+        files += [os.path.join(directory, name) for name in names if name.endswith(suffix)]
+    return sorted(files)
+
+
+class TestExport:
+    @pytest.mark.asyncio
+    async def test_partitions_by_day(self, tmp_path):
+        database = FakeDatabase()
+        await database.task_events.insert_many(task_events(10))  # 22:00 on March 1st to 02:30 on March 2nd
+
+        stats = await export_collection(database, "task_events", str(tmp_path), batch_size=3)
+
+        files = exported(str(tmp_path))
+        assert stats == {"rows": 10, "parts": 2}
+        assert [os.path.basename(os.path.dirname(path)) for path in files] == ["date=2024-03-01", "date=2024-03-02"]
+        assert [event["task_id"] for path in files for event in read_ndjson(path)] == list(range(10))
+        assert load_watermark(str(tmp_path), "task_events")[0] == START + timedelta(minutes=270)
+
+    @pytest.mark.asyncio
+    async def test_resumes_after_watermark(self, tmp_path):
+        """A second run exports only documents added since the first"""
+        database = FakeDatabase()
+        await database.task_events.insert_many(task_events(4))
+        await export_collection(database, "task_events", str(tmp_path))
+
+        await database.task_events.insert_many(task_events(2, start=START + timedelta(days=1)))
+        stats = await export_collection(database, "task_events", str(tmp_path))
+
+        assert stats == {"rows": 2, "parts": 1}
+        rows = [event for path in exported(str(tmp_path)) for event in read_ndjson(path)]
+        assert len(rows) == 6
+        assert len({event["_id"] for event in rows}) == 6
+
+    @pytest.mark.asyncio
+    async def test_interrupted_export_keeps_complete_parts(self, tmp_path, monkeypatch):
+        """A failure drops the open part; the watermark still points at the last complete one"""
+        database = FakeDatabase()
+        await database.task_events.insert_many(task_events(10))
+        original = export.NdjsonPart.write
+        calls = []
+
+        def failing_write(self, documents):
+            calls.append(len(documents))
+            if len(calls) == 3:
+                raise IOError("disk full")
+            original(self, documents)
+
+        monkeypatch.setattr(export.NdjsonPart, "write", failing_write)
+        with pytest.raises(IOError):
+            await export_collection(database, "task_events", str(tmp_path), batch_size=2)
+
+        assert len(exported(str(tmp_path))) == 1
+        assert exported(str(tmp_path), suffix=".tmp") == []
+        monkeypatch.setattr(export.NdjsonPart, "write", original)
+
+        stats = await export_collection(database, "task_events", str(tmp_path), batch_size=2)
+        rows = [event for path in exported(str(tmp_path)) for event in read_ndjson(path)]
+        assert stats["rows"] == 6
+        assert sorted(event["task_id"] for event in rows) == list(range(10))
+
+    @pytest.mark.asyncio
+    async def test_parquet(self, tmp_path):
+        parquet = pytest.importorskip("pyarrow.parquet")
+        database = FakeDatabase()
+        await database.task_events.insert_many(task_events(3))
+
+        await export_collection(database, "task_events", str(tmp_path), fmt="parquet")
+
+        table = parquet.read_table(exported(str(tmp_path), suffix=".parquet")[0])
+        assert table.column("task_id").to_pylist() == [0, 1, 2]
+        assert table.schema.field("timestamp").type.tz == "UTC"
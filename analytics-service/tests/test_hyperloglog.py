@@ -0,0 +1,123 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from benchmarks.fake_mongo import FakeDatabase
+from unittest.mock import AsyncMock
+from app.hyperloglog import ACTIVE_USERS_COLLECTION, ActiveUserBuffer, HyperLogLog, record_active_user, union
+from app.services.analytics_service import AnalyticsService
+
+
+def sketch_of(values):
+    sketch = HyperLogLog()
+    for value in values:
+        sketch.add(str(value))
+    return sketch
+
+
+class TestHyperLogLog:
+    @pytest.mark.parametrize("count", [0, 1, 100, 5000, 200000])
+    def test_estimate_is_close(self, count):
+        estimate = sketch_of(range(count)).estimate()
+        assert abs(estimate - count) <= max(1, 0.03 * count)
+
+    def test_duplicates_are_not_counted(self):
+        assert sketch_of(list(range(1000)) * 5).estimate() == sketch_of(range(1000)).estimate()
+
+    def test_union_counts_overlap_once(self):
+        merged = union([sketch_of(range(0, 20000)), sketch_of(range(10000, 30000))])
+        assert abs(merged.estimate() - 30000) <= 0.03 * 30000
+
+
+class TestActiveUsers:
+    @pytest.fixture
+    def database(self):
+        return FakeDatabase()
+
+    async def seed(self, database, today):
+        # Users 0-99 active today, 100-199 three days ago, 200-299 twenty days ago, in project 7
+        for offset, users in ((0, range(0, 100)), (3, range(100, 200)), (20, range(200, 300))):
+            for user_id in users:
+                await record_active_user(database, str(user_id), 7, today - timedelta(days=offset))
+
+    @pytest.mark.asyncio
+    async def test_recording_is_idempotent(self, database):
+        timestamp = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+        await record_active_user(database, "1", 7, timestamp)
+        await record_active_user(database, "1", 7, timestamp)
+
+        documents = database[ACTIVE_USERS_COLLECTION].documents
+        assert len(documents) == 4  # {platform, project} x {day, month}
+        assert all(len(document["registers"]) == 1 for document in documents)
+
+    @pytest.mark.asyncio
+    async def test_buffer_writes_each_register_set_once(self, database):
+        timestamp = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+        buffer = ActiveUserBuffer()
+        for user_id in range(1000):
+            buffer.add(str(user_id), 7, timestamp)
+        database[ACTIVE_USERS_COLLECTION].bulk_write = AsyncMock(wraps=database[ACTIVE_USERS_COLLECTION].bulk_write)
+
+        assert await buffer.flush(database) == 4
+        assert await buffer.flush(database) == 0
+
+        database[ACTIVE_USERS_COLLECTION].bulk_write.assert_awaited_once()
+        assert len(database[ACTIVE_USERS_COLLECTION].bulk_write.await_args.args[0]) == 4
+        direct = FakeDatabase()
+        for user_id in range(1000):
+            await record_active_user(direct, str(user_id), 7, timestamp)
+        # Same registers as recording each user on its own
+        registers = lambda db: sorted(
+            (str(document["project_id"]), document["granularity"], document["registers"])
+            for document in db[ACTIVE_USERS_COLLECTION].documents
+        )
+        assert registers(database) == registers(direct)
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_registers(self, database):
+        timestamp = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+        buffer = ActiveUserBuffer()
+        buffer.add("1", None, timestamp)
+        database[ACTIVE_USERS_COLLECTION].bulk_write = AsyncMock(side_effect=ConnectionError("down"))
+
+        with pytest.raises(ConnectionError):
+            await buffer.flush(database)
+        buffer.add("2", None, timestamp)
+        del database[ACTIVE_USERS_COLLECTION].bulk_write
+
+        assert await buffer.flush(database) == 2
+        registers = [HyperLogLog.from_document(document) for document in database[ACTIVE_USERS_COLLECTION].documents]
+        assert [sketch.estimate() for sketch in registers] == [2, 2]
+
+    @pytest.mark.asyncio
+    async def test_dau_wau_mau(self, database, monkeypatch):
+        service = AnalyticsService()
+        monkeypatch.setattr(service, "_get_db", lambda *args: database)
+        today = datetime.now(timezone.utc)
+        await self.seed(database, today)
+
+        platform = await service.get_active_users()
+        project = await service.get_active_users(project_id=7)
+        other_project = await service.get_active_users(project_id=8)
+
+        # Estimates, within 2% at these sizes
+        assert platform["dau"] == pytest.approx(100, rel=0.02)
+        assert platform["wau"] == pytest.approx(200, rel=0.02)
+        assert platform["mau"] == pytest.approx(300, rel=0.02)
+        assert project["mau"] == platform["mau"]
+        assert other_project["mau"] == 0
+
+    @pytest.mark.asyncio
+    async def test_series_unions_days_per_bucket(self, database, monkeypatch):
+        service = AnalyticsService()
+        monkeypatch.setattr(service, "_get_db", lambda *args: database)
+        monday = datetime(2024, 3, 4, tzinfo=timezone.utc)
+        for day in range(14):
+            # The same 50 users every day of the first week, new users in the second
+            users = range(50) if day < 7 else range(50 + day * 10, 60 + day * 10)
+            for user_id in users:
+                await record_active_user(database, str(user_id), None, monday + timedelta(days=day, hours=9))
+
+        window = {"start": monday, "end": monday + timedelta(days=14), "granularity": "week"}
+        result = await service.get_active_user_series(window)
+
+        assert [bucket["active_users"] for bucket in result["series"]] == pytest.approx([50, 70], rel=0.02)
+        assert result["active_users"] == pytest.approx(120, rel=0.02)
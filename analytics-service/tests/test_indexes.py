@@ -0,0 +1,168 @@
+import pytest
+from unittest.mock import Mock, AsyncMock
+from app.indexes import INDEX_MANIFEST, reconcile_indexes
+from app.query_plans import ANALYTICS_QUERIES, explain_query, manifest_index_for, plan_stages
+
+
+def make_collection(index_information):
+    collection = Mock()
+    collection.index_information = AsyncMock(return_value=index_information)
+    collection.create_index = AsyncMock()
+    collection.drop_index = AsyncMock()
+    return collection
+
+
+def manifest_index_information(collection_name):
+    info = {"_id_": {"key": [("_id", 1)]}}
+    for i, spec in enumerate(INDEX_MANIFEST[collection_name]):
+        info[f"idx_{i}"] = {"key": spec["keys"], "unique": spec.get("unique", False)}
+    return info
+
+
+@pytest.fixture
+def reconciled_database():
+    return {name: make_collection(manifest_index_information(name)) for name in INDEX_MANIFEST}
+
+
+class TestIndexReconciliation:
+    @pytest.mark.asyncio
+    async def test_creates_missing_indexes(self, reconciled_database):
+        """Indexes from the manifest that do not exist are created"""
+        reconciled_database["task_events"] = make_collection({"_id_": {"key": [("_id", 1)]}})
+
+        report = await reconcile_indexes(reconciled_database)
+
+        created = reconciled_database["task_events"].create_index
+        assert created.await_count == len(INDEX_MANIFEST["task_events"])
+        assert len(report["created"]) == len(INDEX_MANIFEST["task_events"])
+        assert report["unused"] == []
+
+    @pytest.mark.asyncio
+    async def test_reports_unused_indexes_without_dropping(self, reconciled_database):
+        """Indexes outside the manifest are reported but kept by default"""
+        info = manifest_index_information("task_events")
+        info["event_type_1"] = {"key": [("event_type", 1.0)]}
+        reconciled_database["task_events"] = make_collection(info)
+
+        report = await reconcile_indexes(reconciled_database)
+
+        assert report["unused"] == ["task_events {event_type: 1}"]
+        assert report["dropped"] == []
+        reconciled_database["task_events"].drop_index.assert_not_awaited()
+        reconciled_database["task_events"].create_index.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_drops_unused_indexes_when_enabled(self, reconciled_database):
+        """Indexes outside the manifest are dropped when requested"""
+        info = manifest_index_information("project_events")
+        info["created_at_-1"] = {"key": [("created_at", -1)]}
+        reconciled_database["project_events"] = make_collection(info)
+
+        report = await reconcile_indexes(reconciled_database, drop_unused=True)
+
+        reconciled_database["project_events"].drop_index.assert_awaited_once_with("created_at_-1")
+        assert report["dropped"] == ["project_events {created_at: -1}"]
+
+    @pytest.mark.asyncio
+    async def test_keeps_shard_key_index(self, reconciled_database):
+        """The hashed shard key index is never reported or dropped as unused"""
+        info = manifest_index_information("task_events")
+        info["user_id_hashed"] = {"key": [("user_id", "hashed")]}
+        reconciled_database["task_events"] = make_collection(info)
+
+        report = await reconcile_indexes(reconciled_database, drop_unused=True)
+
+        assert report["unused"] == []
+        reconciled_database["task_events"].drop_index.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_reports_unique_mismatch(self, reconciled_database):
+        """An index with the right keys but wrong uniqueness is flagged"""
+        info = manifest_index_information("user_metrics")
+        info["idx_0"]["unique"] = False
+        reconciled_database["user_metrics"] = make_collection(info)
+
+        report = await reconcile_indexes(reconciled_database)
+
+        assert report["mismatched"] == ["user_metrics {user_id: 1}"]
+
+
+class TestQueryPlans:
+    @pytest.mark.parametrize("query", ANALYTICS_QUERIES, ids=lambda query: query["name"])
+    def test_every_analytics_query_has_manifest_index(self, query):
+        """Each AnalyticsService query shape is served by an index in the manifest"""
+        assert manifest_index_for(query) is not None
+
+    def test_plan_stages_detects_collscan(self):
+        """Stages are collected through nested and sharded plan layouts"""
+        plan = {
+            "stage": "SHARD_MERGE",
+            "shards": [
+                {"winningPlan": {"stage": "LIMIT", "inputStage": {"stage": "COLLSCAN"}}},
+                {"winningPlan": {"queryPlan": {"stage": "FETCH", "inputStage": {"stage": "IXSCAN"}}}},
+            ],
+        }
+
+        stages = list(plan_stages(plan))
+
+        assert stages == ["SHARD_MERGE", "LIMIT", "COLLSCAN", "FETCH", "IXSCAN"]
+
+    def test_keyset_cursor_needs_the_timeline_index(self):
+        """The $or cursor fields have to follow the equality prefix in sort order"""
+        page = next(query for query in ANALYTICS_QUERIES if query["name"] == "project.timeline_page")
+
+        assert [field for field, _ in manifest_index_for(page)] == ["user_id", "project_id", "timestamp", "_id"]
+        assert manifest_index_for({**page, "sort": [("_id", 1)]}) is None
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("explanation,targeted", [
+        # Pipeline pushed down into the query layer
+        ({"queryPlanner": {"winningPlan": {"stage": "GROUP", "inputStage": {"stage": "IXSCAN"}}}}, True),
+        # Classic layout with a $cursor stage
+        ({"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {
+            "stage": "IXSCAN"}}}}}, {"$group": {}}]}, True),
+        # Through mongos, sent to both shards
+        ({"shards": {name: {"queryPlanner": {"winningPlan": {"stage": "IXSCAN"}}} for name in ("s1", "s2")}}, False),
+    ])
+    async def test_aggregates_are_explained_through_the_pipeline(self, explanation, targeted):
+        """The batch activity $group/$topN is explained as an aggregate whatever the explain layout"""
+        query = next(query for query in ANALYTICS_QUERIES if query["name"] == "projects.batch_activity")
+        database = Mock()
+        database.command = AsyncMock(return_value=explanation)
+
+        result = await explain_query(database, query)
+
+        command = database.command.await_args.args[1]
+        assert command["aggregate"] == "task_events"
+        assert command["pipeline"][0] == {"$match": query["filter"]}
+        assert "$topN" in str(command["pipeline"][1])
+        assert result["uses_index"] and "IXSCAN" in result["stages"]
+        assert result["targeted"] is targeted
+
+
+class TestBackgroundIndexManagement:
+    @pytest.mark.asyncio
+    async def test_create_indexes_tracks_progress(self, reconciled_database, monkeypatch):
+        """Index builds report progress and finish in the ready state"""
+        from app.database import mongodb, create_indexes
+
+        monkeypatch.setattr(mongodb, "database", reconciled_database)
+        monkeypatch.setattr(mongodb, "index_status", {})
+        await create_indexes()
+
+        total = sum(len(specs) for specs in INDEX_MANIFEST.values())
+        assert mongodb.index_status == {"status": "ready", "completed": total, "total": total, "error": None}
+
+    @pytest.mark.asyncio
+    async def test_create_indexes_failure_is_reported(self, reconciled_database, monkeypatch):
+        """A failed index build leaves the service degraded instead of crashing"""
+        from app.database import mongodb, create_indexes, get_readiness
+
+        reconciled_database["user_metrics"].index_information = AsyncMock(side_effect=RuntimeError("boom"))
+        monkeypatch.setattr(mongodb, "client", Mock())
+        monkeypatch.setattr(mongodb, "database", reconciled_database)
+        monkeypatch.setattr(mongodb, "index_status", {})
+        await create_indexes()
+
+        assert mongodb.index_status["status"] == "failed"
+        assert get_readiness()["status"] == "degraded"
@@ -0,0 +1,147 @@
+import asyncio
+import orjson
+import pytest
+from unittest.mock import Mock
+from pymongo.errors import OperationFailure
+from app.services.live_updates import LiveUpdateHub, Subscription
+
+
+class FakeChangeStream:
+    """In-process stand-in for a Motor change stream"""
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.resume_token = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.changes:
+            # Idle like a real change stream until cancelled
+            await asyncio.sleep(3600)
+        change = self.changes.pop(0)
+        self.resume_token = {"_data": str(len(self.changes))}
+        return change
+
+
+def metrics_change(collection, **document):
+    return {"ns": {"db": "analytics", "coll": collection}, "operationType": "update", "fullDocument": document}
+
+
+class TestSubscription:
+    @pytest.mark.asyncio
+    async def test_rapid_updates_are_coalesced(self):
+        """Only the latest delta per metrics document is delivered"""
+        subscription = Subscription("1", max_pending=4)
+        subscription.offer(("dashboard",), {"type": "dashboard", "version": 1})
+        subscription.offer(("dashboard",), {"type": "dashboard", "version": 2})
+        subscription.offer(("project", 7), {"type": "project", "version": 1})
+
+        batch = await subscription.next_batch(timeout=1)
+
+        assert batch == [{"type": "dashboard", "version": 2}, {"type": "project", "version": 1}]
+        assert subscription.coalesced == 1
+
+    @pytest.mark.asyncio
+    async def test_overflow_becomes_single_resync(self):
+        """A full buffer is replaced by one resync instead of growing"""
+        subscription = Subscription("1", max_pending=2)
+        for project_id in range(5):
+            subscription.offer(("project", project_id), {"type": "project", "project_id": project_id})
+
+        assert await subscription.next_batch(timeout=1) == [{"type": "resync"}]
+        assert subscription.resyncs == 1
+
+        subscription.offer(("dashboard",), {"type": "dashboard"})
+        assert await subscription.next_batch(timeout=1) == [{"type": "dashboard"}]
+
+    @pytest.mark.asyncio
+    async def test_next_batch_times_out_empty(self):
+        """Idle subscriptions return an empty batch after the timeout"""
+        subscription = Subscription("1", max_pending=2)
+        assert await subscription.next_batch(timeout=0.01) == []
+
+
+class TestLiveUpdateHub:
+    @pytest.mark.asyncio
+    async def test_publish_fans_out_to_owner_only(self):
+        """Deltas reach every connection of the owning user and nobody else"""
+        hub = LiveUpdateHub(max_pending=8)
+        first, second, other = hub.subscribe(1), hub.subscribe("1"), hub.subscribe(2)
+
+        hub.publish("user_metrics", {"user_id": "1", "total_tasks": 3, "version": 5})
+
+        assert (await first.next_batch(timeout=1))[0]["total_tasks"] == 3
+        assert (await second.next_batch(timeout=1))[0]["version"] == 5
+        assert await other.next_batch(timeout=0.01) == []
+
+        hub.unsubscribe(first)
+        hub.unsubscribe(second)
+        hub.unsubscribe(other)
+        assert hub.connections == 0
+
+    @pytest.mark.asyncio
+    async def test_change_stream_feeds_subscribers(self):
+        """A single change stream subscription publishes metrics changes"""
+        database = Mock()
+        database.watch.return_value = FakeChangeStream([
+            metrics_change("project_metrics", user_id="1", project_id=4, total_tasks=2, version=1),
+            metrics_change("user_metrics", user_id="1", total_tasks=9, version=2),
+        ])
+        hub = LiveUpdateHub(max_pending=8)
+        subscription = hub.subscribe(1)
+
+        hub.start(database)
+        await asyncio.sleep(0.05)
+        batch = await subscription.next_batch(timeout=1)
+        await hub.stop()
+
+        assert [delta["type"] for delta in batch] == ["project", "dashboard"]
+        assert database.watch.call_count == 1
+        assert database.watch.call_args.kwargs["full_document"] == "updateLookup"
+
+    @pytest.mark.asyncio
+    async def test_standalone_server_disables_live_updates(self):
+        """Servers without change streams mark the hub unsupported"""
+        database = Mock()
+        database.watch.side_effect = OperationFailure("not a replica set", code=40573)
+        hub = LiveUpdateHub()
+
+        await hub.start(database)
+
+        assert hub.status == "unsupported"
+
+
+class TestLiveUpdateEndpoint:
+    @pytest.mark.asyncio
+    async def test_events_are_framed_as_sse(self, monkeypatch):
+        """Deltas are sent as named SSE events after a ready event"""
+        from app.api import analytics
+
+        hub = LiveUpdateHub(max_pending=8)
+        monkeypatch.setattr(analytics, "live_update_hub", hub)
+        monkeypatch.setattr(analytics.settings, "LIVE_UPDATES_COALESCE_SECONDS", 0)
+        request = Mock()
+
+        async def is_disconnected():
+            return False
+        request.is_disconnected = is_disconnected
+
+        subscription = hub.subscribe(1)
+        events = analytics._live_update_events(request, subscription)
+
+        assert await events.__anext__() == b'event: ready\ndata: {"status":"stopped"}\n\n'
+        hub.publish("user_metrics", {"user_id": "1", "total_tasks": 4})
+        frame = await events.__anext__()
+        await events.aclose()
+
+        assert frame.startswith(b"event: dashboard\ndata: ")
+        assert orjson.loads(frame.split(b"data: ")[1])["total_tasks"] == 4
+        assert hub.connections == 0
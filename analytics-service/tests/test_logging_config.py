@@ -0,0 +1,77 @@
+import io
+import json
+import logging
+import queue
+import sys
+import structlog
+from app.logging_config import DroppingQueueHandler, ReportingQueueListener, json_formatter
+
+
+def record(message):
+    return logging.makeLogRecord({"msg": message, "levelno": logging.INFO, "levelname": "INFO"})
+
+
+class TestLogQueue:
+    def test_full_queue_drops_newest_without_blocking(self):
+        log_queue = queue.Queue(maxsize=2)
+        handler = DroppingQueueHandler(log_queue)
+        for message in ["a", "b", "c", "d"]:
+            handler.handle(record(message))
+
+        assert [log_queue.get_nowait().msg for _ in range(2)] == ["a", "b"]
+        assert handler.take_dropped() == 2
+        assert handler.dropped == 0
+
+    def test_full_queue_drops_oldest(self):
+        log_queue = queue.Queue(maxsize=2)
+        handler = DroppingQueueHandler(log_queue, drop="oldest")
+        for message in ["a", "b", "c", "d"]:
+            handler.handle(record(message))
+
+        assert [log_queue.get_nowait().msg for _ in range(2)] == ["c", "d"]
+        assert handler.dropped == 2
+
+    def test_listener_writes_and_reports_drops(self):
+        log_queue = queue.Queue(maxsize=1)
+        handler = DroppingQueueHandler(log_queue)
+        output = io.StringIO()
+        writer = logging.StreamHandler(output)
+        writer.setFormatter(logging.Formatter("%(message)s"))
+        listener = ReportingQueueListener(log_queue, handler, writer)
+
+        handler.handle(record('{"event": "first"}'))
+        handler.handle(record('{"event": "second"}'))  # dropped before the writer starts
+        listener.start()
+        listener.stop()
+
+        lines = output.getvalue().splitlines()
+        assert lines[0] == '{"event": "Log queue full, records dropped", "dropped": 1, "level": "warning"}'
+        assert lines[1] == '{"event": "first"}'
+
+
+class TestJsonFormatter:
+    def test_uvicorn_records_are_rendered_as_json(self):
+        """Access and error log records from plain logging loggers come out as the same JSON as structlog events"""
+        log_queue = queue.Queue()
+        handler = DroppingQueueHandler(log_queue)
+        handler.setFormatter(json_formatter([structlog.stdlib.add_logger_name, structlog.stdlib.add_log_level]))
+
+        access = logging.getLogger("uvicorn.access").makeRecord(
+            "uvicorn.access", logging.INFO, __file__, 1, '%s - "%s %s HTTP/%s" %d',
+            ("127.0.0.1:5000", "GET", "/health", "1.1", 200), None
+        )
+        try:
+            raise RuntimeError("boom")
+        except RuntimeError:
+            error = logging.getLogger("uvicorn.error").makeRecord(
+                "uvicorn.error", logging.ERROR, __file__, 1, "Exception in ASGI application", (), sys.exc_info()
+            )
+        handler.handle(access)
+        handler.handle(error)
+
+        first, second = (json.loads(log_queue.get_nowait().msg) for _ in range(2))
+        assert first == {"event": '127.0.0.1:5000 - "GET /health HTTP/1.1" 200',
+                         "logger": "uvicorn.access", "level": "info"}
+        assert second["logger"] == "uvicorn.error"
+        assert second["level"] == "error"
+        assert "RuntimeError: boom" in second["exception"]
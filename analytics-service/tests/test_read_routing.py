@@ -0,0 +1,87 @@
+import os
+import pytest
+from unittest.mock import AsyncMock, Mock
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from app import database
+from app.database import ANALYTICS, PRIMARY, get_database, read_preference_for
+from app.services.analytics_service import AnalyticsService
+
+
+@pytest.fixture
+def routed_database(monkeypatch):
+    primary = Mock()
+    primary.with_options.side_effect = lambda read_preference: Mock(read_preference=read_preference)
+    monkeypatch.setattr(database.mongodb, "database", primary)
+    monkeypatch.setattr(database.mongodb, "read_profiles", {})
+    return primary
+
+
+class TestReadPreferences:
+    def test_analytics_profile_bounds_staleness(self, monkeypatch):
+        """Analytics reads prefer secondaries no more than MONGODB_MAX_STALENESS_SECONDS behind"""
+        monkeypatch.setattr(database.settings, "MONGODB_ANALYTICS_READ_PREFERENCE", "secondaryPreferred")
+        monkeypatch.setattr(database.settings, "MONGODB_MAX_STALENESS_SECONDS", 120)
+
+        preference = read_preference_for(ANALYTICS)
+
+        assert preference == SecondaryPreferred(max_staleness=120)
+        assert read_preference_for(PRIMARY) == Primary()
+
+    def test_primary_mode_disables_routing(self, monkeypatch):
+        """MONGODB_ANALYTICS_READ_PREFERENCE=primary keeps every read on the primary"""
+        monkeypatch.setattr(database.settings, "MONGODB_ANALYTICS_READ_PREFERENCE", "primary")
+        assert read_preference_for(ANALYTICS) == Primary()
+
+    def test_unknown_profile_is_rejected(self):
+        with pytest.raises(ValueError):
+            read_preference_for("reporting")
+
+    def test_routed_databases_are_cached(self, routed_database):
+        """Each profile is derived from the primary database once"""
+        assert get_database() is routed_database
+        analytics = get_database(ANALYTICS)
+
+        assert get_database(ANALYTICS) is analytics
+        assert routed_database.with_options.call_count == 1
+
+
+class TestServiceRouting:
+    @pytest.mark.asyncio
+    async def test_dashboard_reads_use_profile(self, routed_database):
+        """Dashboard reads go to the analytics profile unless read-your-writes is requested"""
+        service = AnalyticsService()
+        analytics = get_database(ANALYTICS)
+        for db in (routed_database, analytics):
+            db.user_dashboard.find_one = AsyncMock(return_value=None)
+            db.user_metrics.find_one = AsyncMock(return_value=None)
+
+        await service.get_user_dashboard(1)
+        analytics.user_dashboard.find_one.assert_awaited()
+        analytics.user_metrics.find_one.assert_awaited()
+        routed_database.user_dashboard.find_one.assert_not_awaited()
+        routed_database.user_metrics.find_one.assert_not_awaited()
+
+        await service.get_user_dashboard(1, consistent=True)
+        routed_database.user_dashboard.find_one.assert_awaited()
+        routed_database.user_metrics.find_one.assert_awaited()
+
+
+@pytest.mark.skipif(not os.getenv("MONGODB_REPLICA_SET_URL"), reason="needs a replica set (MONGODB_REPLICA_SET_URL)")
+class TestReplicaSet:
+    @pytest.mark.asyncio
+    async def test_analytics_reads_are_served_by_a_secondary(self, monkeypatch):
+        """Against docker-compose.replica.yml the analytics profile lands on a secondary"""
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        client = AsyncIOMotorClient(os.environ["MONGODB_REPLICA_SET_URL"])
+        monkeypatch.setattr(database.mongodb, "database", client["analytics"])
+        monkeypatch.setattr(database.mongodb, "read_profiles", {})
+        try:
+            primary_hello = await get_database().command("hello")
+            analytics = get_database(ANALYTICS)
+            # Database.command does not inherit the database's read preference
+            secondary_hello = await analytics.command("hello", read_preference=analytics.read_preference)
+            assert primary_hello["isWritablePrimary"] is True
+            assert secondary_hello["secondary"] is True
+        finally:
+            client.close()
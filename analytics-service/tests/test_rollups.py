@@ -0,0 +1,163 @@
+import pytest
+from datetime import datetime, timezone
+from benchmarks.fake_mongo import FakeDatabase
+from app import rollups
+from app.rollups import (
+    ROLLUPS_COLLECTION, align_window, bucket_start, compact_rollups, load_watermarks,
+    next_bucket, read_series, record_task_event, summarize_window
+)
+
+UTC = timezone.utc
+GRACE = 3600
+
+
+def at(*args):
+    return datetime(*args, tzinfo=UTC)
+
+
+async def record(database, timestamp, now, event="task_updated", status="completed", project_id=7):
+    await record_task_event(database, "1", project_id, event, status, timestamp, now=now)
+
+
+class TestBuckets:
+    @pytest.mark.parametrize("granularity,expected", [
+        ("hour", at(2024, 3, 14, 15)),
+        ("day", at(2024, 3, 14)),
+        ("week", at(2024, 3, 11)),
+        ("month", at(2024, 3, 1)),
+    ])
+    def test_bucket_start(self, granularity, expected):
+        """Buckets are UTC, weeks start on Monday"""
+        assert bucket_start(at(2024, 3, 14, 15, 42), granularity) == expected
+
+    def test_next_month_rolls_over_year(self):
+        assert next_bucket(at(2024, 12, 1), "month") == at(2025, 1, 1)
+
+    def test_align_window_widens_to_whole_buckets(self):
+        window = align_window(at(2024, 3, 14, 15, 42), at(2024, 3, 20, 0, 1), "day")
+        assert window == {"start": at(2024, 3, 14), "end": at(2024, 3, 21)}
+
+
+class TestCompaction:
+    @pytest.mark.asyncio
+    async def test_hours_fold_into_days_weeks_and_months(self):
+        """Compaction folds closed hours and records watermarks per level"""
+        database = FakeDatabase()
+        now = at(2024, 3, 20, 12)
+        await record(database, at(2024, 3, 11, 9), now=at(2024, 3, 11, 9), event="task_created", status="pending")
+        await record(database, at(2024, 3, 11, 10), now=at(2024, 3, 11, 10))
+        await record(database, at(2024, 3, 19, 8), now=at(2024, 3, 19, 8))
+
+        written = await compact_rollups(database, GRACE, now=now)
+        watermarks = await load_watermarks(database)
+
+        assert watermarks["day"] == at(2024, 3, 20)
+        assert watermarks["week"] == at(2024, 3, 18)
+        assert "month" not in watermarks  # March has not closed yet
+        assert written["month"] == 0
+        assert written["day"] == 4  # two days, user and project scope
+        day = await database[ROLLUPS_COLLECTION].find_one(
+            {"user_id": "1", "project_id": None, "granularity": "day", "bucket": at(2024, 3, 11)}
+        )
+        assert day["counters"]["events"] == 2
+        assert day["counters"]["created"] == 1
+        assert day["counters"]["completed"] == 1
+
+    @pytest.mark.asyncio
+    async def test_compaction_is_incremental(self):
+        """A second run only folds buckets closed since the watermark"""
+        database = FakeDatabase()
+        await record(database, at(2024, 3, 11, 9), now=at(2024, 3, 11, 9))
+        await compact_rollups(database, GRACE, now=at(2024, 3, 12, 12))
+
+        written = await compact_rollups(database, GRACE, now=at(2024, 3, 12, 13))
+
+        assert written["day"] == 0
+
+    @pytest.mark.asyncio
+    async def test_late_events_are_folded_on_the_next_run(self):
+        """A late event only touches its hour; the next run folds the compacted day and week again"""
+        database = FakeDatabase()
+        await record(database, at(2024, 3, 11, 9), now=at(2024, 3, 11, 9))
+        await compact_rollups(database, GRACE, now=at(2024, 3, 20, 12))
+
+        await record(database, at(2024, 3, 11, 22), now=at(2024, 3, 20, 12))
+        daily = await read_series(database, "1", None, "day", at(2024, 3, 11), at(2024, 3, 12))
+        assert daily[at(2024, 3, 11)]["completed"] == 1
+
+        written = await compact_rollups(database, GRACE, now=at(2024, 3, 20, 13))
+        daily = await read_series(database, "1", None, "day", at(2024, 3, 11), at(2024, 3, 12))
+        weekly = await read_series(database, "1", 7, "week", at(2024, 3, 11), at(2024, 3, 18))
+
+        assert written["refolded"] == 4  # day and week, user and project scope
+        assert daily[at(2024, 3, 11)]["completed"] == 2
+        assert weekly[at(2024, 3, 11)]["completed"] == 2
+        assert await database[ROLLUPS_COLLECTION].count_documents({"refold": True}) == 0
+
+    @pytest.mark.asyncio
+    async def test_refold_moves_metrics_versions(self):
+        """Refolded windows change the validators of the user and project they belong to"""
+        database = FakeDatabase()
+        database.user_metrics.insert_many_sync([{"user_id": "1", "version": 5}])
+        database.user_dashboard.insert_many_sync([{"_id": "1", "version": 5}])
+        database.project_metrics.insert_many_sync([{"user_id": "1", "project_id": 7, "version": 2}])
+        await record(database, at(2024, 3, 11, 9), now=at(2024, 3, 11, 9))
+        await compact_rollups(database, GRACE, now=at(2024, 3, 20, 12))
+        await record(database, at(2024, 3, 11, 22), now=at(2024, 3, 20, 12))
+
+        await compact_rollups(database, GRACE, now=at(2024, 3, 20, 13))
+
+        assert (await database.user_metrics.find_one({"user_id": "1"}))["version"] == 6
+        assert (await database.user_dashboard.find_one({"_id": "1"}))["version"] == 6
+        assert (await database.project_metrics.find_one({"user_id": "1", "project_id": 7}))["version"] == 3
+
+    @pytest.mark.asyncio
+    async def test_event_landing_during_a_fold_is_not_lost(self, monkeypatch):
+        """An hour incremented after the fold read it stays flagged for the next run"""
+        database = FakeDatabase()
+        await record(database, at(2024, 3, 11, 9), now=at(2024, 3, 11, 9))
+        await compact_rollups(database, GRACE, now=at(2024, 3, 20, 12))
+        await record(database, at(2024, 3, 11, 22), now=at(2024, 3, 20, 12))
+
+        fold_level = rollups._fold_level
+
+        async def fold_then_record(*args, **kwargs):
+            written = await fold_level(*args, **kwargs)
+            if args[1] == "day":
+                await record(database, at(2024, 3, 11, 23), now=at(2024, 3, 20, 12), project_id=None)
+            return written
+
+        monkeypatch.setattr(rollups, "_fold_level", fold_then_record)
+        await compact_rollups(database, GRACE, now=at(2024, 3, 20, 13))
+        monkeypatch.setattr(rollups, "_fold_level", fold_level)
+        await compact_rollups(database, GRACE, now=at(2024, 3, 20, 14))
+
+        daily = await read_series(database, "1", None, "day", at(2024, 3, 11), at(2024, 3, 12))
+        assert daily[at(2024, 3, 11)]["completed"] == 4  # on time, late, and one after each of the first run's two day folds
+
+
+class TestReadSeries:
+    @pytest.mark.asyncio
+    async def test_compacted_and_recent_buckets_are_combined(self):
+        """Days before the watermark come from day documents, the tail from hours"""
+        database = FakeDatabase()
+        for day in (11, 12, 13):
+            await record(database, at(2024, 3, day, 9), now=at(2024, 3, day, 9))
+        await compact_rollups(database, GRACE, now=at(2024, 3, 13, 0, 30))
+        await record(database, at(2024, 3, 13, 10), now=at(2024, 3, 13, 10))
+
+        series = await read_series(database, "1", 7, "day", at(2024, 3, 11), at(2024, 3, 14))
+        weekly = await read_series(database, "1", 7, "week", at(2024, 3, 11), at(2024, 3, 18))
+
+        assert (await load_watermarks(database))["day"] == at(2024, 3, 12)
+        assert [series[at(2024, 3, day)]["completed"] for day in (11, 12, 13)] == [1, 1, 2]
+        assert weekly[at(2024, 3, 11)]["completed"] == 4
+
+    def test_summary_includes_empty_buckets(self):
+        """Windows list every bucket with totals"""
+        series = {at(2024, 3, 12): {"events": 3, "created": 1, "completed": 2, "deleted": 0}}
+        window = summarize_window(series, "day", at(2024, 3, 11), at(2024, 3, 14))
+
+        assert [bucket["completed"] for bucket in window["series"]] == [0, 2, 0]
+        assert window["totals"]["events"] == 3
+        assert window["from"] == "2024-03-11T00:00:00+00:00"
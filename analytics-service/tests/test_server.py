@@ -0,0 +1,52 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app import database, server
+
+
+class TestServer:
+    def test_worker_count_defaults_to_available_cpus(self, monkeypatch):
+        """WEB_CONCURRENCY=0 runs one worker per CPU"""
+        monkeypatch.setattr(server.settings, "WEB_CONCURRENCY", 0)
+        monkeypatch.setattr(server, "available_cpus", lambda: 6)
+        assert server.worker_count() == 6
+
+    def test_worker_count_override(self, monkeypatch):
+        """An explicit WEB_CONCURRENCY wins over CPU detection"""
+        monkeypatch.setattr(server.settings, "WEB_CONCURRENCY", 3)
+        assert server.worker_count() == 3
+
+    def test_runs_uvicorn_with_production_options(self, monkeypatch):
+        """Workers use uvloop and httptools without reload"""
+        run = MagicMock()
+        monkeypatch.setattr(server.uvicorn, "run", run)
+        monkeypatch.setattr(server.settings, "WEB_CONCURRENCY", 4)
+
+        server.main()
+
+        options = run.call_args.kwargs
+        assert run.call_args.args == ("app.main:app",)
+        assert (options["workers"], options["loop"], options["http"], options["reload"]) == (4, "uvloop", "httptools", False)
+
+
+class TestConnectionPool:
+    @pytest.mark.asyncio
+    async def test_pool_settings_and_prewarm(self, monkeypatch):
+        """The Motor client is sized from settings and opens minPoolSize connections"""
+        client = MagicMock()
+        client.admin.command = AsyncMock(return_value={"ok": 1})
+        client_factory = MagicMock(return_value=client)
+        monkeypatch.setattr(database, "AsyncIOMotorClient", client_factory)
+        monkeypatch.setattr(database.settings, "MONGODB_MAX_POOL_SIZE", 40)
+        monkeypatch.setattr(database.settings, "MONGODB_MIN_POOL_SIZE", 8)
+        monkeypatch.setattr(database.mongodb, "client", None)
+        monkeypatch.setattr(database.mongodb, "database", None)
+
+        await database.connect_to_mongo()
+
+        options = client_factory.call_args.kwargs
+        assert options["maxPoolSize"] == 40
+        assert options["minPoolSize"] == 8
+        assert options["waitQueueTimeoutMS"] == database.settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS
+        assert options["maxIdleTimeMS"] == database.settings.MONGODB_MAX_IDLE_TIME_MS
+        # One connectivity check plus eight concurrent warm-up pings
+        assert client.admin.command.await_count == 9
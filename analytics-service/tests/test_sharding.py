@@ -0,0 +1,110 @@
+import os
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+from app.indexes import INDEX_MANIFEST, SHARD_KEYS
+from app.query_plans import ANALYTICS_QUERIES, explain_query, shard_key_targeted
+from app.sharding import shard_collections
+
+
+def make_cluster(sharded=None, router=True):
+    """Database on a mocked mongos; ``sharded`` maps collection names to their current shard key"""
+    sharded = sharded or {}
+    database = MagicMock()
+    database.name = "analytics"
+    collections = {}
+    database.__getitem__.side_effect = lambda name: collections.setdefault(name, MagicMock(create_index=AsyncMock()))
+
+    async def command(name, *args, **kwargs):
+        return {"msg": "isdbgrid"} if name == "hello" and router else {"ok": 1}
+
+    async def find_one(query):
+        key = sharded.get(query["_id"].split(".", 1)[1])
+        return {"_id": query["_id"], "key": key} if key else None
+
+    database.client.admin.command = AsyncMock(side_effect=command)
+    database.client.config.collections.find_one = AsyncMock(side_effect=find_one)
+    return database, collections
+
+
+class TestShardKeys:
+    @pytest.mark.parametrize("query", ANALYTICS_QUERIES, ids=lambda query: query["name"])
+    def test_hot_queries_include_the_shard_key(self, query):
+        """Every AnalyticsService query is routed to one shard unless it is a platform-wide scatter"""
+        assert query.get("scatter") or shard_key_targeted(query)
+
+    @pytest.mark.parametrize("collection", sorted(SHARD_KEYS))
+    def test_unique_indexes_start_with_the_shard_key(self, collection):
+        """Sharded collections can only enforce unique indexes prefixed by the shard key"""
+        field = SHARD_KEYS[collection][0][0]
+        for spec in INDEX_MANIFEST.get(collection, []):
+            if spec.get("unique"):
+                assert spec["keys"][0][0] == field
+
+    def test_range_on_shard_key_is_not_targeted(self):
+        """A hashed shard key only routes equality, not ranges"""
+        query = {"collection": "task_rollups", "filter": {"user_id": {"$gte": "1", "$lte": "9"}}}
+
+        assert not shard_key_targeted(query)
+
+
+class TestShardCollections:
+    @pytest.mark.asyncio
+    async def test_shards_every_declared_collection(self):
+        """Sharding is enabled and each collection gets its hashed index and shard key"""
+        database, collections = make_cluster()
+
+        report = await shard_collections(database)
+
+        commands = [call.args for call in database.client.admin.command.await_args_list]
+        assert ("enableSharding", "analytics") in commands
+        assert ("shardCollection", "analytics.task_events") in commands
+        database.client.admin.command.assert_any_await(
+            "shardCollection", "analytics.user_dashboard", key={"_id": "hashed"}
+        )
+        collections["task_events"].create_index.assert_awaited_once_with([("user_id", "hashed")])
+        assert len(report["sharded"]) == len(SHARD_KEYS)
+
+    @pytest.mark.asyncio
+    async def test_already_sharded_collections_are_left_alone(self):
+        """Rerunning is a no-op; a collection sharded on another key is reported"""
+        database, collections = make_cluster(sharded={
+            "task_events": {"user_id": "hashed"},
+            "user_metrics": {"username": 1},
+        })
+
+        report = await shard_collections(database)
+
+        assert "task_events {user_id: hashed}" in report["unchanged"]
+        assert report["mismatched"] == ["user_metrics {user_id: hashed}"]
+        assert "task_events" not in collections
+        assert len(report["sharded"]) == len(SHARD_KEYS) - 2
+
+    @pytest.mark.asyncio
+    async def test_requires_mongos(self):
+        """Running against a plain replica set fails before changing anything"""
+        database, _ = make_cluster(router=False)
+
+        with pytest.raises(RuntimeError):
+            await shard_collections(database)
+        assert database.client.admin.command.await_count == 1
+
+
+@pytest.mark.skipif(not os.getenv("MONGODB_SHARDED_URL"), reason="needs a sharded cluster (MONGODB_SHARDED_URL)")
+class TestShardedCluster:
+    @pytest.mark.asyncio
+    async def test_hot_queries_are_single_shard(self):
+        """Against docker-compose.sharded.yml every non-scatter query is routed to one shard"""
+        from motor.motor_asyncio import AsyncIOMotorClient
+        from app.indexes import reconcile_indexes
+
+        client = AsyncIOMotorClient(os.environ["MONGODB_SHARDED_URL"])
+        database = client["analytics_sharding_test"]
+        try:
+            await shard_collections(database)
+            await reconcile_indexes(database)
+            for query in ANALYTICS_QUERIES:
+                result = await explain_query(database, query)
+                assert result["targeted"] or query.get("scatter"), result
+        finally:
+            await client.drop_database("analytics_sharding_test")
+            client.close()
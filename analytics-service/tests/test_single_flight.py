@@ -0,0 +1,121 @@
+import asyncio
+import pytest
+from app.config import settings
+from app.services.analytics_service import AnalyticsService
+from app.services.single_flight import SingleFlight
+from app.telemetry import metrics_registry
+from benchmarks.fake_mongo import FakeDatabase
+
+
+class CountingDatabase(FakeDatabase):
+    """FakeDatabase that counts user_metrics lookups"""
+
+    def __init__(self):
+        super().__init__()
+        self.lookups = 0
+        lookup = self.user_metrics.find_one
+
+        async def counted(*args, **kwargs):
+            self.lookups += 1
+            return await lookup(*args, **kwargs)
+
+        self.user_metrics.find_one = counted
+
+
+@pytest.fixture
+def service(monkeypatch):
+    db = CountingDatabase()
+    db.user_metrics.insert_many_sync([{
+        "user_id": "1", "username": "testuser", "total_tasks": 4, "completed_tasks": 2,
+        "active_projects": 1, "completion_rate": 50.0
+    }])
+    service = AnalyticsService()
+    monkeypatch.setattr(service, "_get_db", lambda *args: db)
+    return service, db
+
+
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_identical_calls_share_one_computation(self, service):
+        service, db = service
+        before = metrics_registry.coalesced_calls.get(("get_user_dashboard",), 0)
+
+        results = await asyncio.gather(*[service.get_user_dashboard(1) for _ in range(5)])
+
+        assert db.lookups == 1
+        assert all(result["completed_tasks"] == 2 for result in results)
+        # Every caller gets its own copy to add fields to
+        results[0]["window"] = {}
+        assert "window" not in results[1]
+        assert metrics_registry.coalesced_calls[("get_user_dashboard",)] == before + 4
+        assert service.flights.in_flight() == 0
+
+    @pytest.mark.asyncio
+    async def test_different_arguments_are_not_coalesced(self, service):
+        service, db = service
+
+        await asyncio.gather(service.get_user_dashboard(1), service.get_user_dashboard(2))
+
+        assert db.lookups == 3  # user 2 has no metrics under either user_id format
+
+    @pytest.mark.asyncio
+    async def test_consistent_reads_run_on_their_own(self, service):
+        service, db = service
+
+        await asyncio.gather(*[service.get_user_dashboard(1, consistent=True) for _ in range(3)])
+
+        assert db.lookups == 3
+
+    @pytest.mark.asyncio
+    async def test_sequential_calls_are_not_cached(self, service):
+        service, db = service
+
+        await service.get_user_dashboard(1)
+        await service.get_user_dashboard(1)
+
+        assert db.lookups == 2
+
+    @pytest.mark.asyncio
+    async def test_disabled(self, service, monkeypatch):
+        service, db = service
+        monkeypatch.setattr(settings, "SINGLE_FLIGHT_ENABLED", False)
+
+        await asyncio.gather(*[service.get_user_dashboard(1) for _ in range(3)])
+
+        assert db.lookups == 3
+
+    @pytest.mark.asyncio
+    async def test_errors_reach_every_caller_and_are_not_kept(self):
+        flights = SingleFlight()
+        calls = []
+
+        async def failing():
+            calls.append(1)
+            await asyncio.sleep(0)
+            raise RuntimeError("primary stepped down")
+
+        results = await asyncio.gather(*[flights.do("key", failing) for _ in range(3)], return_exceptions=True)
+        assert len(calls) == 1
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        with pytest.raises(RuntimeError):
+            await flights.do("key", failing)
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_caller_does_not_cancel_the_shared_call(self):
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return {"total_tasks": 4}
+
+        first = asyncio.create_task(flights.do("key", slow))
+        second = asyncio.create_task(flights.do("key", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+
+        assert await second == {"total_tasks": 4}
+        assert first.cancelled()
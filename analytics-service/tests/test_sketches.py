@@ -0,0 +1,155 @@
+import random
+import pytest
+from datetime import datetime, timezone
+from bson import Binary
+from benchmarks.fake_mongo import FakeDatabase
+from app.sketches import (
+    RELATIVE_ACCURACY, SKETCHES_COLLECTION, DDSketch, read_completion_times, record_completion_time,
+    summarize_sketch
+)
+
+
+def exact_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+@pytest.fixture
+def completion_times():
+    rng = random.Random(7)
+    return [rng.lognormvariate(2, 1.5) for _ in range(20000)]
+
+
+class TestDDSketch:
+    def test_quantiles_within_relative_accuracy(self, completion_times):
+        sketch = DDSketch()
+        for value in completion_times:
+            sketch.add(value)
+
+        for q in (0.5, 0.9, 0.99):
+            exact = exact_quantile(completion_times, q)
+            assert abs(sketch.quantile(q) - exact) <= RELATIVE_ACCURACY * exact
+
+    def test_merge_matches_single_sketch(self, completion_times):
+        """Merging per-bucket sketches gives the same answer as one sketch over all values"""
+        whole, halves = DDSketch(), [DDSketch(), DDSketch()]
+        for i, value in enumerate(completion_times):
+            whole.add(value)
+            halves[i % 2].add(value)
+        halves[0].merge(halves[1])
+
+        assert halves[0].bins == whole.bins
+        assert halves[0].quantile(0.99) == whole.quantile(0.99)
+        assert halves[0].count == whole.count
+
+    def test_binary_round_trip_is_compact(self, completion_times):
+        sketch = DDSketch()
+        for value in completion_times:
+            sketch.add(value)
+        sketch.add(0)
+
+        data = sketch.to_bytes()
+        restored = DDSketch.from_bytes(data)
+
+        assert len(data) < 4096
+        assert restored.bins == sketch.bins
+        assert restored.zero_count == 1
+        assert (restored.count, restored.min, restored.max) == (sketch.count, sketch.min, sketch.max)
+
+    def test_bins_are_bounded(self):
+        """Low bins are collapsed, high quantiles stay accurate"""
+        sketch = DDSketch(max_bins=64)
+        values = [1.1 ** i for i in range(500)]
+        for value in values:
+            sketch.add(value)
+
+        assert len(sketch.bins) == 64
+        exact = exact_quantile(values, 0.99)
+        assert abs(sketch.quantile(0.99) - exact) <= RELATIVE_ACCURACY * exact
+
+    def test_empty_summary(self):
+        assert summarize_sketch(DDSketch()) == {
+            "count": 0, "mean_hours": None, "p50_hours": None, "p90_hours": None, "p99_hours": None
+        }
+
+
+class TestCompletionSketches:
+    @pytest.mark.asyncio
+    async def test_recorded_per_day_and_all_time(self):
+        database = FakeDatabase()
+        for day, hours in ((1, 2.0), (1, 4.0), (2, 10.0)):
+            await record_completion_time(database, "1", 7, hours, datetime(2024, 3, day, 12, tzinfo=timezone.utc))
+
+        all_time = await read_completion_times(database, "1")
+        project = await read_completion_times(database, "1", 7)
+        first_day = await read_completion_times(
+            database, "1", 7, datetime(2024, 3, 1, 8, tzinfo=timezone.utc), datetime(2024, 3, 2, tzinfo=timezone.utc)
+        )
+
+        assert all_time.count == project.count == 3
+        assert summarize_sketch(all_time)["mean_hours"] == pytest.approx(16 / 3)
+        assert first_day.count == 2
+        assert first_day.max == 4.0
+        assert len(database[SKETCHES_COLLECTION].documents) == 6  # {user, project} x {2 days + all time}
+
+    @pytest.mark.asyncio
+    async def test_concurrent_update_is_retried(self, monkeypatch):
+        """A sketch replaced between read and write is re-read and merged again, the others are written once"""
+        database = FakeDatabase()
+        completed_at = datetime(2024, 3, 1, tzinfo=timezone.utc)
+        await record_completion_time(database, "1", 7, 1.0, completed_at)
+
+        collection = database[SKETCHES_COLLECTION]
+        find = collection.find
+        queries = []
+
+        def racing_find(query, projection=None, **kwargs):
+            cursor = find(query, projection, **kwargs)
+            queries.append(query)
+            if len(queries) == 1:
+                cursor._evaluate()  # this worker's read
+                # Another worker adds 2.0 to the user's day sketch before this one writes
+                day = next(document for document in collection.documents
+                           if document["granularity"] == "day" and document["project_id"] is None)
+                concurrent = DDSketch.from_bytes(day["sketch"])
+                concurrent.add(2.0)
+                day.update(sketch=Binary(concurrent.to_bytes()), count=concurrent.count)
+            return cursor
+
+        monkeypatch.setattr(collection, "find", racing_find)
+        await record_completion_time(database, "1", 7, 3.0, completed_at)
+
+        counts = {(document["project_id"], document["granularity"]): document["count"]
+                  for document in collection.documents}
+        assert counts == {(None, "day"): 3, (None, "all"): 2, (7, "day"): 2, (7, "all"): 2}
+        assert len(collection.documents) == 4
+        # The retry only reads the sketch that conflicted
+        assert len(queries) == 2
+        assert queries[1]["$or"] == [{"project_id": None, "granularity": "day", "bucket": completed_at}]
+
+    @pytest.mark.asyncio
+    async def test_concurrent_first_insert_is_retried(self, monkeypatch):
+        """Two workers creating the same sketch: the loser's insert fails on the unique key and it merges instead"""
+        database = FakeDatabase()
+        completed_at = datetime(2024, 3, 1, tzinfo=timezone.utc)
+        collection = database[SKETCHES_COLLECTION]
+        find = collection.find
+        raced = []
+
+        def racing_find(query, projection=None, **kwargs):
+            cursor = find(query, projection, **kwargs)
+            if not raced:
+                raced.append(True)
+                cursor._evaluate()
+                sketch = DDSketch()
+                sketch.add(5.0)
+                collection.insert_many_sync([{"user_id": "1", "project_id": None, "granularity": "all",
+                                              "bucket": None, "sketch": Binary(sketch.to_bytes()), "count": 1}])
+            return cursor
+
+        monkeypatch.setattr(collection, "find", racing_find)
+        await record_completion_time(database, "1", None, 1.0, completed_at)
+
+        all_time = await read_completion_times(database, "1")
+        assert all_time.count == 2
+        assert len(collection.documents) == 2
@@ -0,0 +1,138 @@
+from types import SimpleNamespace
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.testclient import TestClient
+from app.telemetry import (
+    Histogram, MetricsRegistry, MongoCommandListener, TimingMiddleware, current_request_timing
+)
+
+
+def command_started(command_name, command, request_id=1, connection_id=("mongo", 27017)):
+    return SimpleNamespace(
+        command_name=command_name, command=command, request_id=request_id, connection_id=connection_id
+    )
+
+
+def command_succeeded(command_name, reply, duration_micros=1500, request_id=1, connection_id=("mongo", 27017)):
+    return SimpleNamespace(
+        command_name=command_name, reply=reply, duration_micros=duration_micros,
+        request_id=request_id, connection_id=connection_id
+    )
+
+
+class TestHistogram:
+    def test_observations_land_in_cumulative_buckets(self):
+        """Rendered buckets are cumulative and end with +Inf"""
+        registry = MetricsRegistry()
+        registry.observe_request("GET", "/api/v1/analytics/dashboard", 200, 0.003)
+        registry.observe_request("GET", "/api/v1/analytics/dashboard", 200, 0.2)
+        registry.observe_request("GET", "/api/v1/analytics/dashboard", 200, 30)
+
+        text = registry.render()
+        labels = 'method="GET",route="/api/v1/analytics/dashboard",status="200"'
+
+        assert f'analytics_http_request_duration_seconds_bucket{{{labels},le="0.005"}} 1' in text
+        assert f'analytics_http_request_duration_seconds_bucket{{{labels},le="0.25"}} 2' in text
+        assert f'analytics_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} 3' in text
+        assert f"analytics_http_request_duration_seconds_count{{{labels}}} 3" in text
+
+    def test_boundary_values_are_inclusive(self):
+        """A value equal to a bucket bound counts towards that bucket"""
+        histogram = Histogram([0.1, 1.0])
+        histogram.observe(0.1)
+        counts, total, count = histogram.snapshot()
+        assert counts == [1, 0, 0]
+        assert (total, count) == (0.1, 1)
+
+    def test_label_values_are_escaped(self):
+        """Backslashes, double quotes and line feeds in label values are escaped"""
+        registry = MetricsRegistry()
+        registry.observe_request("GET", 'C:\\temp\n"x"', 200, 0.003)
+
+        text = registry.render()
+
+        assert 'route="C:\\\\temp\\n\\"x\\""' in text
+        assert all(line.count("{") <= 1 for line in text.splitlines())
+
+
+class TestMongoCommandListener:
+    def test_records_latency_and_documents_per_collection(self):
+        """find and getMore are attributed to their collection with documents returned"""
+        registry = MetricsRegistry()
+        listener = MongoCommandListener(registry)
+
+        listener.started(command_started("find", {"find": "task_events", "filter": {}}, request_id=1))
+        listener.succeeded(command_succeeded("find", {"cursor": {"firstBatch": [{}, {}, {}]}}, request_id=1))
+        listener.started(command_started("getMore", {"getMore": 42, "collection": "task_events"}, request_id=2))
+        listener.succeeded(command_succeeded("getMore", {"cursor": {"nextBatch": [{}]}}, request_id=2))
+
+        assert registry.command_latency[("task_events", "find")].count == 1
+        assert registry.command_latency[("task_events", "getMore")].count == 1
+        assert registry.documents_returned == {("task_events", "find"): 3, ("task_events", "getMore"): 1}
+
+    def test_failures_and_housekeeping(self):
+        """Failed commands are counted and driver handshakes are ignored"""
+        registry = MetricsRegistry()
+        listener = MongoCommandListener(registry)
+
+        listener.started(command_started("hello", {"hello": 1}, request_id=1))
+        listener.succeeded(command_succeeded("hello", {"ok": 1}, request_id=1))
+        listener.started(command_started("aggregate", {"aggregate": "project_events"}, request_id=2))
+        listener.failed(command_succeeded("aggregate", {}, request_id=2))
+
+        assert registry.command_latency == {}
+        assert registry.command_failures == {("project_events", "aggregate"): 1}
+
+    def test_database_time_is_added_to_current_request(self):
+        """Command time accumulates on the request's timing context"""
+        from app.telemetry import RequestTiming
+
+        listener = MongoCommandListener(MetricsRegistry())
+        timing = RequestTiming()
+        token = current_request_timing.set(timing)
+        try:
+            listener.started(command_started("find", {"find": "user_metrics"}))
+            listener.succeeded(command_succeeded("find", {"cursor": {"firstBatch": []}}, duration_micros=2500))
+        finally:
+            current_request_timing.reset(token)
+
+        assert timing.db_commands == 1
+        assert timing.db_seconds == pytest.approx(0.0025)
+
+
+class TestTimingMiddleware:
+    @pytest.fixture
+    def registry(self):
+        return MetricsRegistry()
+
+    @pytest.fixture
+    def client(self, registry):
+        app = FastAPI(default_response_class=ORJSONResponse)
+        app.add_middleware(TimingMiddleware, registry=registry)
+        listener = MongoCommandListener(registry)
+
+        @app.get("/projects/{project_id}")
+        async def project(project_id: int):
+            listener.started(command_started("find", {"find": "project_metrics"}))
+            listener.succeeded(command_succeeded("find", {"cursor": {"firstBatch": [{}]}}, duration_micros=4000))
+            return {"project_id": project_id}
+
+        return TestClient(app)
+
+    def test_server_timing_header(self, client):
+        """Responses split total time from MongoDB time"""
+        response = client.get("/projects/7")
+        server_timing = response.headers["server-timing"]
+
+        assert server_timing.startswith("app;dur=")
+        assert 'db;dur=4.0;desc="1 commands"' in server_timing
+
+    def test_routes_are_labelled_by_template(self, client, registry):
+        """Path parameters do not explode the label set; unknown paths share one label"""
+        client.get("/projects/7")
+        client.get("/projects/8")
+        client.get("/missing")
+
+        assert registry.request_latency[("GET", "/projects/{project_id}", "200")].count == 2
+        assert registry.request_latency[("GET", "unmatched", "404")].count == 1
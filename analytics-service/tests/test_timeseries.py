@@ -0,0 +1,143 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+from bson import ObjectId
+from benchmarks.fake_mongo import FakeDatabase
+from app.config import RAW_EVENTS_WINDOW_DAYS, Settings, settings
+from app.timeseries import copy_events, ensure_event_collection, ensure_event_collections, migrate_event_collection
+
+
+def make_database(collections=None):
+    """Mock database keeping the ``options()`` of each collection through creates and renames"""
+    collections = dict(collections or {})
+    database = MagicMock()
+    database.list_collection_names = AsyncMock(
+        side_effect=lambda filter=None: [name for name in collections if not filter or name == filter["name"]]
+    )
+    database.command = AsyncMock()
+    handles = {}
+
+    async def create_collection(name, **options):
+        collections[name] = options
+
+    def collection(name):
+        if name not in handles:
+            async def rename(new_name):
+                collections[new_name] = collections.pop(name)
+
+            handles[name] = MagicMock(options=AsyncMock(side_effect=lambda: collections.get(name, {})),
+                                      rename=AsyncMock(side_effect=rename), drop=AsyncMock(),
+                                      delete_one=AsyncMock())
+        return handles[name]
+
+    database.create_collection = AsyncMock(side_effect=create_collection)
+    database.__getitem__.side_effect = collection
+    return database
+
+
+@pytest.fixture
+def retention(monkeypatch):
+    monkeypatch.setattr(settings, "EVENTS_TIMESERIES", True)
+    monkeypatch.setattr(settings, "EVENTS_RETENTION_DAYS", 30)
+
+
+class TestEventCollections:
+    @pytest.mark.asyncio
+    async def test_creates_timeseries_collections_with_retention(self, retention):
+        """Missing event collections are created as time series bucketed by user with a TTL"""
+        database = make_database()
+
+        report = await ensure_event_collections(database)
+
+        assert report == {"task_events": "created", "project_events": "created"}
+        database.create_collection.assert_any_await(
+            "task_events",
+            timeseries={"timeField": "timestamp", "metaField": "user_id", "granularity": "hours"},
+            expireAfterSeconds=30 * 86400,
+        )
+
+    @pytest.mark.asyncio
+    async def test_updates_retention_of_existing_collections(self, retention, monkeypatch):
+        """A changed retention is applied with collMod; turning it off disables expiry"""
+        database = make_database({"task_events": {"timeseries": {}, "expireAfterSeconds": 7 * 86400}})
+
+        assert await ensure_event_collection(database, "task_events") == "retention updated"
+        database.command.assert_awaited_once_with("collMod", "task_events", expireAfterSeconds=30 * 86400)
+
+        monkeypatch.setattr(settings, "EVENTS_RETENTION_DAYS", 0)
+        database.command.reset_mock()
+        await ensure_event_collection(database, "task_events")
+        database.command.assert_awaited_once_with("collMod", "task_events", expireAfterSeconds="off")
+
+    @pytest.mark.asyncio
+    async def test_regular_collections_are_left_alone(self, retention):
+        """An existing regular collection is reported for migration, never converted at startup"""
+        database = make_database({"task_events": {}, "project_events": {}})
+
+        report = await ensure_event_collections(database)
+
+        assert report == {"task_events": "regular", "project_events": "regular"}
+        database.create_collection.assert_not_awaited()
+        database.command.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_disabled_by_default(self):
+        """Nothing is created unless EVENTS_TIMESERIES is on"""
+        database = make_database()
+
+        assert await ensure_event_collections(database) == {}
+        database.list_collection_names.assert_not_awaited()
+
+
+class TestRetentionSettings:
+    def test_retention_inside_the_raw_event_window_is_rejected(self):
+        """A TTL shorter than the window the API reads from raw events is refused; 0 keeps events forever"""
+        config = Settings()
+        config.EVENTS_RETENTION_DAYS = RAW_EVENTS_WINDOW_DAYS - 1
+        with pytest.raises(ValueError, match="EVENTS_RETENTION_DAYS"):
+            config.check_event_storage()
+
+        for days in (0, RAW_EVENTS_WINDOW_DAYS):
+            config.EVENTS_RETENTION_DAYS = days
+            config.check_event_storage()
+
+
+class TestMigration:
+    @pytest.mark.asyncio
+    async def test_migrate_renames_and_copies(self, retention, monkeypatch):
+        """The regular collection moves aside, the time series takes its name, events are copied"""
+        database = make_database({"task_events": {}})
+        copy = AsyncMock(return_value={"copied": 3, "skipped": 0})
+        monkeypatch.setattr("app.timeseries.copy_events", copy)
+
+        result = await migrate_event_collection(database, "task_events", drop_legacy=True)
+
+        database["task_events"].rename.assert_awaited_once_with("task_events_legacy")
+        database.create_collection.assert_awaited_once()
+        copy.assert_awaited_once()
+        assert copy.await_args.args[:2] == (database["task_events_legacy"], database["task_events"])
+        database["task_events_legacy"].drop.assert_awaited_once()
+        assert result == {"collection": "task_events", "status": "migrated", "copied": 3, "skipped": 0}
+
+    @pytest.mark.asyncio
+    async def test_copy_converts_timestamps_and_resumes(self):
+        """String timestamps are parsed, undated events skipped, and a rerun continues after the last batch"""
+        database = FakeDatabase()
+        ids = [ObjectId() for _ in range(5)]
+        database.legacy.insert_many_sync([
+            {"_id": ids[0], "user_id": "1", "timestamp": datetime(2024, 1, 1, tzinfo=timezone.utc)},
+            {"_id": ids[1], "user_id": "1", "timestamp": "2024-01-02T00:00:00Z"},
+            {"_id": ids[2], "user_id": "2"},
+            {"_id": ids[3], "user_id": "2", "timestamp": datetime(2024, 1, 3, tzinfo=timezone.utc)},
+        ])
+
+        first = await copy_events(database.legacy, database.events, database.progress, "task_events", batch_size=2)
+        # New legacy rows after an interrupted run, one of them already copied
+        database.legacy.insert_many_sync([{"_id": ids[4], "user_id": "3", "timestamp": datetime(2024, 1, 4)}])
+        database.events.insert_many_sync([{"_id": ids[4], "user_id": "3", "timestamp": datetime(2024, 1, 4)}])
+        second = await copy_events(database.legacy, database.events, database.progress, "task_events", batch_size=2)
+
+        assert first == {"copied": 3, "skipped": 1}
+        assert second == {"copied": 1, "skipped": 0}
+        assert sorted(event["_id"] for event in database.events.documents) == [ids[0], ids[1], ids[3], ids[4]]
+        assert all(isinstance(event["timestamp"], datetime) for event in database.events.documents)
@@ -1,15 +1,29 @@
+import asyncio
 from datetime import datetime, timezone
 from typing import Dict, Any
 import structlog
 from app.database import get_database
+from app.hyperloglog import ActiveUserBuffer
+from app.rollups import as_utc, record_task_event
+from app.sketches import record_completion_time
 from app.models import TaskEvent, ProjectEvent, UserMetrics, ProjectMetrics
 
 logger = structlog.get_logger()
 
+# Materialized dashboard per user, read by the API by _id (the user_id)
+DASHBOARD_COLLECTION = "user_dashboard"
+RECENT_ACTIVITY_LIMIT = 10
+
+# Creation time per (user_id, task_id) for completion sketches; unlike the
+# task_created event it is neither archived nor expired with raw events
+TASK_CREATED_COLLECTION = "task_created_at"
+
 
 class AnalyticsService:
     def __init__(self):
         self.db = None
+        # HyperLogLog registers raised since the last flush (flushed by the worker)
+        self.active_users = ActiveUserBuffer()
 
     def _get_db(self):
         """Get database instance"""
@@ -20,12 +34,25 @@ class AnalyticsService:
     async def update_task_metrics(self, task_event: TaskEvent):
         """Update user and project metrics based on task event"""
         try:
-            # Update user metrics
-            await self._update_user_metrics(task_event)
+            # Count the user as active; the registers are written in bulk by the periodic flush
+            self.active_users.add(task_event.user_id, task_event.project_id, task_event.timestamp)
+            
+            # Rollups and completion sketches are independent documents:
+            # write them concurrently, one round trip each
+            writes = [self._update_rollups(task_event)]
+            if task_event.event in ("task_created", "task_deleted"):
+                writes.append(self._update_task_created_at(task_event))
+            elif task_event.event == "task_updated" and task_event.status == "completed":
+                writes.append(self._update_completion_sketches(task_event))
+            await asyncio.gather(*writes)
             
-            # Update project metrics
+            # Metrics last: their version bump moves the API ETags, so everything
+            # the new ETag covers has to be written by then
             await self._update_project_metrics_from_task(task_event)
             
+            # Update user metrics and the dashboard document
+            await self._update_user_metrics(task_event)
+            
             logger.debug("Task metrics updated", 
                         task_id=task_event.task_id,
                         user_id=task_event.user_id,
@@ -48,6 +75,9 @@ class AnalyticsService:
             # Update project metrics document
             await self._update_project_metrics_from_project(project_event)
             
+            # Count the user as active; the registers are written in bulk by the periodic flush
+            self.active_users.add(project_event.user_id, project_event.project_id, project_event.timestamp)
+            
             logger.debug("Project metrics updated",
                         project_id=project_event.project_id,
                         user_id=project_event.user_id,
@@ -102,9 +132,10 @@ class AnalyticsService:
         else:
             user_metrics["completion_rate"] = 0.0
 
-        # Update last activity
+        # Update last activity and bump the version used for API ETags
         user_metrics["last_activity"] = task_event.timestamp
         user_metrics["updated_at"] = datetime.now(timezone.utc)
+        user_metrics["version"] = user_metrics.get("version", 0) + 1
 
         # Upsert user metrics
         await db.user_metrics.replace_one(
@@ -113,6 +144,99 @@ class AnalyticsService:
             upsert=True
         )
 
+        await self._update_dashboard(task_event, user_metrics)
+
+    async def _update_dashboard(self, task_event: TaskEvent, user_metrics: Dict[str, Any]):
+        """Copy the new counters into the user's dashboard document and add the event to its recent activity"""
+        activity = {
+            "type": "task",
+            "event": task_event.event,
+            "task_id": task_event.task_id,
+            "project_id": task_event.project_id,
+            "timestamp": task_event.timestamp
+        }
+        db = self._get_db()
+        result = await db[DASHBOARD_COLLECTION].update_one(
+            {"_id": task_event.user_id},
+            {
+                "$set": {
+                    "total_tasks": user_metrics["total_tasks"],
+                    "completed_tasks": user_metrics["completed_tasks"],
+                    "active_projects": user_metrics.get("active_projects", 0),
+                    "completion_rate": user_metrics["completion_rate"],
+                    # The API builds the dashboard ETag from the document it serves
+                    "version": user_metrics["version"],
+                    "updated_at": user_metrics["updated_at"]
+                },
+                # Newest first, keeping the last RECENT_ACTIVITY_LIMIT even when events arrive out of order
+                "$push": {
+                    "recent_activity": {
+                        "$each": [activity],
+                        "$sort": {"timestamp": -1},
+                        "$slice": RECENT_ACTIVITY_LIMIT
+                    }
+                }
+            },
+            upsert=True
+        )
+
+        if result.upserted_id is not None:
+            # First dashboard write for a user with earlier history: seed the recent activity once
+            recent_events = await db.task_events.find(
+                {"user_id": task_event.user_id},
+                {"_id": 0, "event": 1, "task_id": 1, "project_id": 1, "timestamp": 1}
+            ).sort("timestamp", -1).limit(RECENT_ACTIVITY_LIMIT).to_list(RECENT_ACTIVITY_LIMIT)
+            if len(recent_events) > 1:
+                await db[DASHBOARD_COLLECTION].update_one(
+                    {"_id": task_event.user_id},
+                    {"$set": {"recent_activity": [{"type": "task", **event} for event in recent_events]}}
+                )
+
+    async def _update_rollups(self, task_event: TaskEvent):
+        """Increment the hourly user and project rollups for a task event"""
+        await record_task_event(
+            self._get_db(),
+            task_event.user_id,
+            task_event.project_id,
+            task_event.event,
+            task_event.status,
+            task_event.timestamp
+        )
+
+    async def _update_task_created_at(self, task_event: TaskEvent):
+        """Keep a task's creation time until it is deleted"""
+        collection = self._get_db()[TASK_CREATED_COLLECTION]
+        key = {"user_id": task_event.user_id, "task_id": task_event.task_id}
+        if task_event.event == "task_deleted":
+            await collection.delete_one(key)
+            return
+        # $min keeps the first creation when an event is replayed
+        await collection.update_one(key, {"$min": {"created_at": task_event.timestamp}}, upsert=True)
+
+    async def _task_created_at(self, task_event: TaskEvent):
+        db = self._get_db()
+        # Tasks belong to one user, so both lookups carry the shard key
+        key = {"user_id": task_event.user_id, "task_id": task_event.task_id}
+        created = await db[TASK_CREATED_COLLECTION].find_one(key, {"_id": 0, "created_at": 1})
+        if created is not None:
+            return created["created_at"]
+        # Tasks created before creation times were kept, while their event is still in MongoDB
+        created = await db.task_events.find_one({**key, "event": "task_created"}, {"_id": 0, "timestamp": 1})
+        return created["timestamp"] if created is not None else None
+
+    async def _update_completion_sketches(self, task_event: TaskEvent):
+        """Record hours from the task's creation to this completion"""
+        created_at = await self._task_created_at(task_event)
+        if created_at is None:
+            logger.warning("No creation time for completed task", task_id=task_event.task_id,
+                           user_id=task_event.user_id)
+            return
+
+        hours = (as_utc(task_event.timestamp) - as_utc(created_at)).total_seconds() / 3600
+        await record_completion_time(
+            self._get_db(), task_event.user_id, task_event.project_id, hours, task_event.timestamp
+        )
+
     async def _update_project_metrics_from_task(self, task_event: TaskEvent):
         """Update project-level metrics from task event"""
         if not task_event.project_id:
@@ -165,9 +289,10 @@ class AnalyticsService:
         else:
             project_metrics["completion_rate"] = 0.0
 
-        # Update last activity
+        # Update last activity and bump the version used for API ETags
         project_metrics["last_activity"] = task_event.timestamp
         project_metrics["updated_at"] = datetime.now(timezone.utc)
+        project_metrics["version"] = project_metrics.get("version", 0) + 1
 
         # Upsert project metrics
         await db.project_metrics.replace_one(
@@ -184,17 +309,24 @@ class AnalyticsService:
         active_projects = await db.project_metrics.count_documents({"user_id": project_event.user_id})
         
         # Update user metrics
+        updated_at = datetime.now(timezone.utc)
         await db.user_metrics.update_one(
             {"user_id": project_event.user_id},
             {
                 "$set": {
                     "active_projects": active_projects,
                     "last_activity": project_event.timestamp,
-                    "updated_at": datetime.now(timezone.utc)
-                }
+                    "updated_at": updated_at
+                },
+                "$inc": {"version": 1}
             },
             upsert=True
         )
+        # Only existing dashboards; the first task event creates one with every counter
+        await db[DASHBOARD_COLLECTION].update_one(
+            {"_id": project_event.user_id},
+            {"$set": {"active_projects": active_projects, "updated_at": updated_at}, "$inc": {"version": 1}}
+        )
 
     async def _update_project_metrics_from_project(self, project_event: ProjectEvent):
         """Update project metrics from project event"""
@@ -207,7 +339,8 @@ class AnalyticsService:
                 user_id=project_event.user_id,
                 username=project_event.username,
                 project_name=project_event.name or f"Project {project_event.project_id}",
-                created_at_project=project_event.timestamp
+                created_at_project=project_event.timestamp,
+                version=1
             )
             
             await db.project_metrics.insert_one(project_metrics.model_dump())
@@ -221,7 +354,8 @@ class AnalyticsService:
                         "project_name": project_event.name or f"Project {project_event.project_id}",
                         "last_activity": project_event.timestamp,
                         "updated_at": datetime.now(timezone.utc)
-                    }
+                    },
+                    "$inc": {"version": 1}
                 }
             )
             
@@ -0,0 +1,257 @@
+"""Tiered archival of cold raw events to local compressed segment files.
+
+Events older than ``ARCHIVE_AFTER_DAYS`` are moved out of ``task_events`` and
+``project_events`` into append-only, day-partitioned segments::
+
+    <ARCHIVE_DIR>/<collection>/date=YYYY-MM-DD/events.ndjson.zst
+    <ARCHIVE_DIR>/<collection>/date=YYYY-MM-DD/index.ndjson
+
+Each archiver batch appends one independent zstd frame of NDJSON per user and
+day to the segment, then one index line per frame: ``user_id``, byte
+``offset`` and ``length``, event ``count`` and the ``first``/``last``
+timestamps. Reading a user's day is a seek and one small decompression. The
+segment is also a valid zstd stream as a whole (``zstdcat`` prints the day).
+
+Frames are flushed to disk before their index lines, and index lines before
+the events are deleted from MongoDB (in per-user batches, so every delete is
+routed to one shard). A crash can therefore leave unreferenced bytes or, at
+worst, archive a batch twice. ``read_archived`` drops the duplicates by
+``_id``. Archiving keeps the hot working set small; with time-series storage,
+``EVENTS_RETENTION_DAYS`` must be at least ``ARCHIVE_AFTER_DAYS`` (checked when
+settings load) so events are archived before MongoDB expires them.
+
+Usage:
+    python -m app.archive                                   # archive once
+    python -m app.archive --read task_events --user 42 --from 2024-01-01 --to 2024-02-01
+"""
+import argparse
+import asyncio
+import fcntl
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+import orjson
+import structlog
+import zstandard
+from bson import ObjectId
+from pymongo import DeleteMany
+from app.config import settings
+from app.rollups import as_utc
+
+logger = structlog.get_logger()
+
+ARCHIVED_COLLECTIONS = ["task_events", "project_events"]
+SEGMENT_FILE = "events.ndjson.zst"
+INDEX_FILE = "index.ndjson"
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def _day_directory(archive_dir: str, collection: str, day: str) -> str:
+    return os.path.join(archive_dir, collection, f"date={day}")
+
+
+def append_frames(
+    archive_dir: str, collection: str, day: str, frames: Dict[str, List[Dict[str, Any]]], level: int = 3
+) -> int:
+    """Append one zstd frame per user to the day's segment, then their index lines; returns the segment size"""
+    directory = _day_directory(archive_dir, collection, day)
+    os.makedirs(directory, exist_ok=True)
+    compressor = zstandard.ZstdCompressor(level=level)
+    entries = []
+
+    with open(os.path.join(directory, SEGMENT_FILE), "ab") as segment:
+        offset = segment.seek(0, os.SEEK_END)
+        for user_id, events in frames.items():
+            lines = b"".join(
+                orjson.dumps(event, default=_default, option=orjson.OPT_NAIVE_UTC | orjson.OPT_APPEND_NEWLINE)
+                for event in events
+            )
+            frame = compressor.compress(lines)
+            segment.write(frame)
+            entries.append({
+                "user_id": user_id, "offset": offset, "length": len(frame), "count": len(events),
+                "first": as_utc(events[0]["timestamp"]).isoformat(),
+                "last": as_utc(events[-1]["timestamp"]).isoformat(),
+            })
+            offset += len(frame)
+        segment.flush()
+        os.fsync(segment.fileno())
+
+    # The index only ever points at bytes that are already on disk
+    with open(os.path.join(directory, INDEX_FILE), "ab") as index:
+        index.write(b"".join(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in entries))
+        index.flush()
+        os.fsync(index.fileno())
+    return offset
+
+
+async def archive_collection(
+    database,
+    collection: str,
+    cutoff: datetime,
+    archive_dir: Optional[str] = None,
+    batch_size: Optional[int] = None
+) -> Dict[str, int]:
+    """Move events older than ``cutoff`` from ``collection`` to the archive; returns events and batches"""
+    archive_dir = archive_dir or settings.ARCHIVE_DIR
+    batch_size = batch_size or settings.ARCHIVE_BATCH_SIZE
+    stats = {"events": 0, "batches": 0}
+
+    while True:
+        # Archived events are deleted, so every batch starts again from the oldest remaining one
+        batch = await database[collection].find(
+            {"timestamp": {"$lt": cutoff}}
+        ).sort([("timestamp", 1), ("_id", 1)]).limit(batch_size).to_list(None)
+        if not batch:
+            break
+
+        days: Dict[str, Dict[str, List[Dict[str, Any]]]] = defaultdict(lambda: defaultdict(list))
+        for event in batch:
+            days[as_utc(event["timestamp"]).date().isoformat()][str(event.get("user_id"))].append(event)
+        for day, frames in days.items():
+            # Compression and fsyncs stay off the event loop the consumer shares
+            await asyncio.to_thread(append_frames, archive_dir, collection, day, frames, settings.ARCHIVE_ZSTD_LEVEL)
+
+        by_user: Dict[Any, List[ObjectId]] = defaultdict(list)
+        for event in batch:
+            by_user[event.get("user_id")].append(event["_id"])
+        await database[collection].bulk_write(
+            [DeleteMany({"user_id": user_id, "_id": {"$in": ids}}) for user_id, ids in by_user.items()],
+            ordered=False
+        )
+
+        stats["events"] += len(batch)
+        stats["batches"] += 1
+        logger.info("Events archived", collection=collection, events=len(batch), days=sorted(days))
+    return stats
+
+
+async def archive_events(
+    database, now: Optional[datetime] = None, archive_dir: Optional[str] = None
+) -> Dict[str, Dict[str, int]]:
+    """Archive every raw event collection up to the start of the day ``ARCHIVE_AFTER_DAYS`` ago"""
+    if settings.ARCHIVE_AFTER_DAYS <= 0:
+        logger.info("Archiving disabled (ARCHIVE_AFTER_DAYS=0)")
+        return {}
+    archive_dir = archive_dir or settings.ARCHIVE_DIR
+    now = as_utc(now or datetime.now(timezone.utc))
+    # Whole days only, so a day's segment is not appended to by every run
+    cutoff = (now - timedelta(days=settings.ARCHIVE_AFTER_DAYS)).replace(hour=0, minute=0, second=0, microsecond=0)
+    os.makedirs(archive_dir, exist_ok=True)
+
+    with open(os.path.join(archive_dir, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logger.warning("Another archiver is running on this archive, skipping", archive_dir=archive_dir)
+            return {}
+        return {
+            collection: await archive_collection(database, collection, cutoff, archive_dir)
+            for collection in ARCHIVED_COLLECTIONS
+        }
+
+
+def read_archived(
+    collection: str,
+    user_id: str,
+    start: datetime,
+    end: datetime,
+    archive_dir: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """A user's archived events in [start, end), oldest first, with ``timestamp`` as a datetime"""
+    archive_dir = archive_dir or settings.ARCHIVE_DIR
+    start, end = as_utc(start), as_utc(end)
+    decompressor = zstandard.ZstdDecompressor()
+    events: Dict[str, Dict[str, Any]] = {}
+
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end:
+        directory = _day_directory(archive_dir, collection, day.date().isoformat())
+        day += timedelta(days=1)
+        try:
+            with open(os.path.join(directory, INDEX_FILE), "rb") as index:
+                lines = index.read().splitlines()
+        except FileNotFoundError:
+            continue
+
+        entries = []
+        for line in lines:
+            try:
+                entries.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                pass  # a line cut short by a crash; its events are still in MongoDB
+
+        entries = [entry for entry in entries if entry["user_id"] == str(user_id)]
+        if not entries:
+            continue
+        with open(os.path.join(directory, SEGMENT_FILE), "rb") as segment:
+            for entry in entries:
+                segment.seek(entry["offset"])
+                frame = decompressor.decompress(segment.read(entry["length"]))
+                for line in frame.splitlines():
+                    event = orjson.loads(line)
+                    event["timestamp"] = as_utc(datetime.fromisoformat(event["timestamp"]))
+                    if start <= event["timestamp"] < end:
+                        events[event["_id"]] = event  # a batch archived twice keeps one copy
+
+    return sorted(events.values(), key=lambda event: (event["timestamp"], event["_id"]))
+
+
+async def read_events(
+    database,
+    collection: str,
+    user_id: str,
+    start: datetime,
+    end: datetime,
+    archive_dir: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """A user's events in [start, end) read through to the archive for the part MongoDB no longer has"""
+    archived = await asyncio.to_thread(read_archived, collection, user_id, start, end, archive_dir)
+    recent = await database[collection].find(
+        {"user_id": user_id, "timestamp": {"$gte": start, "$lt": end}}
+    ).sort([("timestamp", 1), ("_id", 1)]).to_list(None)
+
+    # An event still in MongoDB wins over its archived copy (archived, not yet deleted)
+    seen = {str(event["_id"]) for event in recent}
+    merged = [event for event in archived if event["_id"] not in seen]
+    merged += [{**event, "_id": str(event["_id"]), "timestamp": as_utc(event["timestamp"])} for event in recent]
+    return sorted(merged, key=lambda event: (event["timestamp"], event["_id"]))
+
+
+def _parse_day(value: str) -> datetime:
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+async def _main(args) -> Any:
+    from app.database import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        if args.read:
+            return await read_events(get_database(), args.read, args.user, _parse_day(args.start), _parse_day(args.end))
+        return await archive_events(get_database())
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive cold raw events to compressed day segments, or read them back")
+    parser.add_argument("--read", choices=ARCHIVED_COLLECTIONS, help="read a user's events instead of archiving")
+    parser.add_argument("--user", help="user_id to read")
+    parser.add_argument("--from", dest="start", help="first day to read (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", help="day after the last one to read (YYYY-MM-DD)")
+    args = parser.parse_args()
+    if args.read and not (args.user and args.start and args.end):
+        parser.error("--read needs --user, --from and --to")
+    result = asyncio.run(_main(args))
+    if args.read:
+        for event in result:
+            print(orjson.dumps(event, default=_default, option=orjson.OPT_NAIVE_UTC).decode())
+    else:
+        print(result)
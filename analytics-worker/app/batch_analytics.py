@@ -0,0 +1,246 @@
+"""Vectorized platform-wide batch analytics over the daily rollups.
+
+Reads the window's compacted daily user rollups (``task_rollups``) in one
+scan into compact NumPy arrays, turns them into matrices of users x days, one
+chunk of users at a time, and computes per user:
+
+- ``productivity_score``: ``min(100, 20 * completions per day)`` over the last
+  30 days, the formula the API applies per request
+- the current and longest streak of consecutive days with a completion
+- completions this week and the week before, and the week-over-week change
+
+and platform-wide weekly signup-cohort retention: for each cohort (users whose
+metrics were first created in the same week), the share with any activity in
+each following week. Per-user results are bulk-upserted into
+``user_productivity`` and cohorts into ``cohort_retention``. The only Python
+loops are over cursor documents (to fill columns) and over the results (to
+build the bulk writes); all statistics are array operations.
+
+The job covers whole compacted days, so it ends at the ``day`` rollup
+watermark. Run it after compaction, e.g. nightly:
+
+    python -m app.batch_analytics
+    python -m app.batch_analytics --days 180 --chunk-size 100000
+"""
+import argparse
+import asyncio
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from pymongo import UpdateOne
+import structlog
+from app.rollups import ROLLUPS_COLLECTION, as_utc, bucket_start, load_watermarks
+
+logger = structlog.get_logger()
+
+PRODUCTIVITY_COLLECTION = "user_productivity"
+COHORTS_COLLECTION = "cohort_retention"
+
+SCORE_WINDOW_DAYS = 30
+WRITE_BATCH_SIZE = 1000
+READ_BATCH_SIZE = 10000
+
+
+async def load_users(database, start: datetime) -> Tuple[List[str], np.ndarray]:
+    """Every user_id, in ``_id`` order, and their signup day offsets from ``start`` (-1 if unknown)"""
+    user_ids: List[str] = []
+    signup_days = array("i")
+    cursor = database.user_metrics.find(
+        {}, {"_id": 0, "user_id": 1, "created_at": 1}, batch_size=READ_BATCH_SIZE
+    ).sort("_id", 1)
+    async for document in cursor:
+        signup = document.get("created_at")
+        user_ids.append(str(document["user_id"]))
+        signup_days.append((as_utc(signup) - start).days if signup else -1)
+    return user_ids, np.frombuffer(signup_days, dtype=np.int32).astype(np.int64)
+
+
+async def load_activity(database, user_ids: List[str], start: datetime, days: int) -> Tuple[np.ndarray, ...]:
+    """Row (position in ``user_ids``), day, completions and events of each daily user rollup, sorted by row.
+
+    One scan of the window's daily rollups on the ``(granularity, bucket)``
+    index, across all users and shards, instead of a query per user.
+    """
+    rows_by_user = {user_id: row for row, user_id in enumerate(user_ids)}
+    rows, columns, completed, events = array("i"), array("i"), array("i"), array("i")
+    cursor = database[ROLLUPS_COLLECTION].find(
+        {"granularity": "day", "bucket": {"$gte": start, "$lt": start + timedelta(days=days)}, "project_id": None},
+        {"_id": 0, "user_id": 1, "bucket": 1, "counters.completed": 1, "counters.events": 1},
+        batch_size=READ_BATCH_SIZE
+    )
+    async for document in cursor:
+        row = rows_by_user.get(str(document["user_id"]))
+        if row is None:
+            continue  # rollups of users without metrics
+        counters = document.get("counters", {})
+        rows.append(row)
+        columns.append((as_utc(document["bucket"]) - start).days)
+        completed.append(counters.get("completed", 0))
+        events.append(counters.get("events", 0))
+
+    row_array = np.frombuffer(rows, dtype=np.int32)
+    order = np.argsort(row_array, kind="stable")
+    return tuple(np.frombuffer(values, dtype=np.int32)[order] for values in (rows, columns, completed, events))
+
+
+def activity_matrices(activity: Tuple[np.ndarray, ...], first: int, last: int, days: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Completions and events per user (rows ``first`` to ``last``) and day (columns)"""
+    rows, columns, completed, events = activity
+    low, high = np.searchsorted(rows, [first, last])
+    cells = (rows[low:high] - first, columns[low:high])
+    completed_matrix = np.zeros((last - first, days), dtype=np.int32)
+    events_matrix = np.zeros((last - first, days), dtype=np.int32)
+    completed_matrix[cells] = completed[low:high]
+    events_matrix[cells] = events[low:high]
+    return completed_matrix, events_matrix
+
+
+def productivity_scores(completed: np.ndarray) -> np.ndarray:
+    """The API's ``min(100, avg_daily * 20)`` over the last SCORE_WINDOW_DAYS days, for every user"""
+    avg_daily = completed[:, -SCORE_WINDOW_DAYS:].sum(axis=1) / SCORE_WINDOW_DAYS
+    return np.minimum(100.0, avg_daily * 20).round(1)
+
+
+def streaks(active: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Current (ending on the last day) and longest runs of active days per row"""
+    days = active.shape[1]
+    backwards = active[:, ::-1]
+    current = np.where(backwards.all(axis=1), days, backwards.argmin(axis=1))
+    # Running count of active days, minus its value at the latest inactive day
+    running = np.cumsum(active, axis=1, dtype=np.int32)
+    last_reset = np.maximum.accumulate(np.where(active, 0, running), axis=1)
+    longest = (running - last_reset).max(axis=1, initial=0)
+    return current, longest
+
+
+def week_over_week(completed: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Completions in the last 7 days, the 7 before, and the relative change (NaN without a previous week)"""
+    this_week = completed[:, -7:].sum(axis=1)
+    last_week = completed[:, -14:-7].sum(axis=1)
+    change = np.divide(
+        this_week - last_week, last_week,
+        out=np.full(len(completed), np.nan), where=last_week > 0
+    )
+    return this_week, last_week, change
+
+
+def cohort_counts(active: np.ndarray, signup_days: np.ndarray, weeks: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Cohort sizes and active users per (signup week, weeks since signup).
+
+    ``active`` is padded to whole weeks; ``signup_days`` are day offsets from
+    the window start, negative for users who signed up before it.
+    """
+    users = active.shape[0]
+    weekly = active.reshape(users, weeks, 7).any(axis=2)
+    cohort = np.floor_divide(signup_days, 7)
+    in_window = (signup_days >= 0) & (cohort < weeks)
+
+    sizes = np.bincount(cohort[in_window], minlength=weeks)[:weeks]
+    offsets = np.arange(weeks)[None, :] - cohort[:, None]
+    counted = weekly & (offsets >= 0) & in_window[:, None]
+    counts = np.zeros((weeks, weeks), dtype=np.int64)
+    np.add.at(counts, (np.broadcast_to(cohort[:, None], counted.shape)[counted], offsets[counted]), 1)
+    return sizes, counts
+
+
+async def _bulk_write(collection, operations: List[UpdateOne]):
+    for offset in range(0, len(operations), WRITE_BATCH_SIZE):
+        await collection.bulk_write(operations[offset:offset + WRITE_BATCH_SIZE], ordered=False)
+
+
+async def run_batch_analytics(database, days: int = 90, chunk_size: int = 50000) -> Dict[str, int]:
+    """Compute and store per-user productivity and cohort retention up to the day watermark"""
+    watermarks = await load_watermarks(database)
+    if "day" not in watermarks:
+        logger.warning("No compacted daily rollups yet, skipping batch analytics")
+        return {"users": 0, "cohorts": 0}
+
+    end = watermarks["day"]
+    # Start on a Monday so the columns reshape into whole weeks
+    start = bucket_start(end - timedelta(days=days), "week")
+    days = (end - start).days
+    weeks = -(-days // 7)
+    as_of = (end - timedelta(days=1)).date().isoformat()
+    computed_at = datetime.now(timezone.utc)
+
+    cohort_sizes = np.zeros(weeks, dtype=np.int64)
+    retained = np.zeros((weeks, weeks), dtype=np.int64)
+    all_user_ids, all_signup_days = await load_users(database, start)
+    activity = await load_activity(database, all_user_ids, start, days)
+
+    for first in range(0, len(all_user_ids), chunk_size):
+        last = min(first + chunk_size, len(all_user_ids))
+        user_ids, signup_days = all_user_ids[first:last], all_signup_days[first:last]
+        completed, events = activity_matrices(activity, first, last, days)
+
+        scores = productivity_scores(completed)
+        current_streak, longest_streak = streaks(completed > 0)
+        this_week, last_week, change = week_over_week(completed)
+
+        padded = np.pad(events > 0, ((0, 0), (0, weeks * 7 - days)))
+        sizes, counts = cohort_counts(padded, signup_days, weeks)
+        cohort_sizes += sizes
+        retained += counts
+
+        columns = zip(
+            user_ids, scores.tolist(), current_streak.tolist(), longest_streak.tolist(),
+            this_week.tolist(), last_week.tolist(), change.tolist()
+        )
+        await _bulk_write(database[PRODUCTIVITY_COLLECTION], [
+            UpdateOne({"user_id": user_id}, {"$set": {
+                "productivity_score": score,
+                "current_streak_days": current,
+                "longest_streak_days": longest,
+                "completions_this_week": this_count,
+                "completions_last_week": last_count,
+                "week_over_week_change": None if np.isnan(delta) else round(delta, 4),
+                "as_of": as_of,
+                "computed_at": computed_at,
+            }}, upsert=True)
+            for user_id, score, current, longest, this_count, last_count, delta in columns
+        ])
+        logger.info("Batch analytics chunk written", users=len(user_ids), first_user=user_ids[0])
+
+    # Only weeks observed since each cohort's signup week are reported
+    with np.errstate(divide="ignore", invalid="ignore"):
+        retention = np.where(cohort_sizes[:, None] > 0, retained / cohort_sizes[:, None], 0.0)
+    cohorts = [
+        UpdateOne({"_id": start + timedelta(weeks=week)}, {"$set": {
+            "cohort_week": (start + timedelta(weeks=week)).date().isoformat(),
+            "size": int(cohort_sizes[week]),
+            "retention": retention[week, :weeks - week].round(4).tolist(),
+            "as_of": as_of,
+            "computed_at": computed_at,
+        }}, upsert=True)
+        for week in np.flatnonzero(cohort_sizes).tolist()
+    ]
+    await _bulk_write(database[COHORTS_COLLECTION], cohorts)
+
+    users = len(all_user_ids)
+    logger.info("Batch analytics completed", users=users, cohorts=len(cohorts), days=days, as_of=as_of)
+    return {"users": users, "cohorts": len(cohorts)}
+
+
+async def _main(days: int, chunk_size: int) -> Dict[str, Any]:
+    from app.database import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        return await run_batch_analytics(get_database(), days, chunk_size)
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    from app.config import settings
+
+    parser = argparse.ArgumentParser(description="Compute productivity scores, streaks and cohort retention for all users")
+    parser.add_argument("--days", type=int, default=settings.BATCH_ANALYTICS_DAYS,
+                        help="days of daily rollups to load (at least 14)")
+    parser.add_argument("--chunk-size", type=int, default=settings.BATCH_ANALYTICS_CHUNK_SIZE,
+                        help="users turned into matrices and written at once")
+    args = parser.parse_args()
+    if args.days < 14:
+        parser.error("--days must be at least 14 for week-over-week changes")
+    print(asyncio.run(_main(args.days, args.chunk_size)))
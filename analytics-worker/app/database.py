@@ -1,5 +1,9 @@
+import asyncio
+from typing import Any, Dict, Optional
 from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
 from app.config import settings
+from app.indexes import INDEX_MANIFEST, reconcile_indexes
+from app.timeseries import ensure_event_collections
 import structlog
 
 logger = structlog.get_logger()
@@ -7,23 +11,26 @@ logger = structlog.get_logger()
 class MongoDB:
     client: AsyncIOMotorClient = None
     database: AsyncIOMotorDatabase = None
+    index_task: Optional[asyncio.Task] = None
+    index_status: Dict[str, Any] = {"status": "pending", "completed": 0, "total": 0, "error": None}
 
 mongodb = MongoDB()
 
 
 async def connect_to_mongo():
-    """Create database connection"""
+    """Create database connection.
+
+    Only verifies the connection; indexes are managed separately by
+    ``start_index_management`` so large index builds never delay readiness.
+    """
     try:
         mongodb.client = AsyncIOMotorClient(settings.MONGODB_URL)
         mongodb.database = mongodb.client[settings.DATABASE_NAME]
-        
+
         # Test the connection
         await mongodb.client.admin.command('ping')
         logger.info("Connected to MongoDB", database=settings.DATABASE_NAME)
-        
-        # Create indexes for better performance
-        await create_indexes()
-        
+
     except Exception as e:
         logger.error("Failed to connect to MongoDB", error=str(e))
         raise
@@ -31,39 +38,81 @@ async def connect_to_mongo():
 
 async def close_mongo_connection():
     """Close database connection"""
+    if mongodb.index_task and not mongodb.index_task.done():
+        mongodb.index_task.cancel()
     if mongodb.client:
         mongodb.client.close()
         logger.info("Disconnected from MongoDB")
 
 
+async def start_index_management():
+    """Manage indexes according to MONGODB_INDEX_MODE.
+
+    ``background`` reconciles indexes in a task so startup is not delayed,
+    ``blocking`` waits for them, and ``skip`` leaves them to the one-shot
+    migration (``python -m app.indexes``).
+    """
+    if settings.MONGODB_INDEX_MODE == "skip":
+        mongodb.index_status = {"status": "skipped", "completed": 0, "total": 0, "error": None}
+        logger.info("Index management skipped, expecting migration job to manage indexes")
+    elif settings.MONGODB_INDEX_MODE == "blocking":
+        await create_indexes()
+    else:
+        mongodb.index_task = asyncio.create_task(create_indexes())
+
+
 async def create_indexes():
-    """Create database indexes for better query performance"""
+    """Reconcile database indexes with the shared index manifest"""
+    total = sum(len(specs) for specs in INDEX_MANIFEST.values())
+    mongodb.index_status = {"status": "building", "completed": 0, "total": total, "error": None}
+
+    def report_progress(completed: int, total: int, index: str):
+        mongodb.index_status["completed"] = completed
+        logger.info("Index ready", index=index, completed=completed, total=total)
+
     try:
-        # Task events indexes
-        await mongodb.database.task_events.create_index([("user_id", 1), ("timestamp", -1)])
-        await mongodb.database.task_events.create_index([("project_id", 1), ("timestamp", -1)])
-        await mongodb.database.task_events.create_index([("task_id", 1)])
-        await mongodb.database.task_events.create_index([("event", 1)])
-        
-        # Project events indexes
-        await mongodb.database.project_events.create_index([("user_id", 1), ("timestamp", -1)])
-        await mongodb.database.project_events.create_index([("project_id", 1)])
-        await mongodb.database.project_events.create_index([("event", 1)])
-        
-        # User metrics indexes
-        await mongodb.database.user_metrics.create_index([("user_id", 1)], unique=True)
-        await mongodb.database.user_metrics.create_index([("last_activity", -1)])
-        
-        # Project metrics indexes
-        await mongodb.database.project_metrics.create_index([("project_id", 1), ("user_id", 1)], unique=True)
-        await mongodb.database.project_metrics.create_index([("user_id", 1), ("last_activity", -1)])
-        
+        # Time-series event collections must exist before an index build creates regular ones
+        await ensure_event_collections(mongodb.database)
+        await reconcile_indexes(
+            mongodb.database,
+            drop_unused=settings.MONGODB_DROP_UNUSED_INDEXES,
+            progress=report_progress
+        )
+        mongodb.index_status["status"] = "ready"
         logger.info("Database indexes created successfully")
-        
+
+    except asyncio.CancelledError:
+        mongodb.index_status["status"] = "cancelled"
+        raise
     except Exception as e:
+        mongodb.index_status.update(status="failed", error=str(e))
         logger.error("Failed to create database indexes", error=str(e))
 
 
+def get_readiness() -> Dict[str, Any]:
+    """Summarize database and index state for health checks.
+
+    ``ready`` means connected with all indexes in place (or managed externally),
+    ``degraded`` means serving while indexes are still building or failed, and
+    ``unavailable`` means there is no database connection.
+    """
+    index_status = dict(mongodb.index_status)
+    if mongodb.client is None or mongodb.database is None:
+        status = "unavailable"
+    elif index_status["status"] in ("ready", "skipped"):
+        status = "ready"
+    else:
+        status = "degraded"
+
+    return {
+        "status": status,
+        "checks": {
+            "database": "connected" if status != "unavailable" else "disconnected",
+            "indexes": index_status
+        }
+    }
+
+
 def get_database() -> AsyncIOMotorDatabase:
     """Get database instance"""
-    return mongodb.database
\ No newline at end of file
+    return mongodb.database
@@ -0,0 +1,161 @@
+"""HyperLogLog distinct active-user counters shared by the analytics API service and worker.
+
+Both services keep an identical copy of this module (like ``rollups.py``).
+The worker records every user with task or project activity in register sets
+per UTC day and per month, for the whole platform (``project_id: None``) and
+per project, in ``active_users``. Registers are a sparse ``{index: rank}``
+subdocument updated with ``$max``, so writes are idempotent and replayed
+events never change a count. The worker buffers raised registers in memory
+and flushes them periodically (``ActiveUserBuffer``). The API unions the days of
+any window by taking the register-wise maximum: memory and query cost depend
+on the number of days (or months), not on the number of users or events.
+Estimates have a standard error of about ``1.04 / sqrt(2 ** PRECISION)`` (0.8%).
+"""
+import hashlib
+import math
+from datetime import datetime
+from typing import Dict, Iterable, Optional, Tuple
+from pymongo import UpdateOne
+from app.rollups import as_utc, bucket_start
+
+ACTIVE_USERS_COLLECTION = "active_users"
+
+# Register sets are kept per day, and per month so long windows read few documents
+REGISTER_GRANULARITIES = ["day", "month"]
+
+PRECISION = 14
+REGISTERS = 1 << PRECISION
+_HASH_BITS = 64
+_RANK_BITS = _HASH_BITS - PRECISION
+_ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+_POWERS = [2.0 ** -rank for rank in range(_RANK_BITS + 2)]
+
+
+def register_for(value: str) -> Tuple[int, int]:
+    """Register index and rank (position of the first set bit) of a value's 64-bit hash"""
+    digest = int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+    index = digest >> _RANK_BITS
+    remainder = digest & ((1 << _RANK_BITS) - 1)
+    return index, _RANK_BITS - remainder.bit_length() + 1
+
+
+class HyperLogLog:
+    """Sparse register set; only registers that were ever raised are kept"""
+
+    def __init__(self, registers: Optional[Dict[int, int]] = None):
+        self.registers: Dict[int, int] = dict(registers or {})
+
+    @classmethod
+    def from_document(cls, document: Dict) -> "HyperLogLog":
+        """Registers as stored by ``record_active_user`` (BSON keys are strings)"""
+        return cls({int(index): rank for index, rank in document.get("registers", {}).items()})
+
+    def add(self, value: str):
+        index, rank = register_for(value)
+        if rank > self.registers.get(index, 0):
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog"):
+        registers = self.registers
+        for index, rank in other.registers.items():
+            if rank > registers.get(index, 0):
+                registers[index] = rank
+
+    def estimate(self) -> int:
+        if not self.registers:
+            return 0
+        zeros = REGISTERS - len(self.registers)
+        harmonic = zeros + sum(_POWERS[rank] for rank in self.registers.values())
+        estimate = _ALPHA * REGISTERS * REGISTERS / harmonic
+        # Linear counting is more accurate while many registers are still empty
+        if estimate <= 2.5 * REGISTERS and zeros:
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+
+def union(sketches: Iterable[HyperLogLog]) -> HyperLogLog:
+    merged = HyperLogLog()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
+
+
+# Worker side
+
+class ActiveUserBuffer:
+    """Registers raised since the last flush, per ``(project_id, granularity, bucket)`` register set.
+
+    Every event touches the platform-wide day and month documents, so
+    writing them per event would make all workers contend on two documents.
+    The worker merges users into this buffer instead and flushes it
+    periodically: one ``$max`` update per register set carrying every raised
+    register. Register maxima are idempotent, so a flush that is retried, or
+    events replayed after a restart, never change a count.
+    """
+
+    def __init__(self):
+        self.pending: Dict[Tuple[Optional[int], str, datetime], Dict[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def add(self, user_id: str, project_id: Optional[int], timestamp: datetime):
+        """Count a user as active on the event's day and month, platform-wide and in its project"""
+        index, rank = register_for(str(user_id))
+        timestamp = as_utc(timestamp)
+        for scope in [None] + ([project_id] if project_id is not None else []):
+            for granularity in REGISTER_GRANULARITIES:
+                registers = self.pending.setdefault((scope, granularity, bucket_start(timestamp, granularity)), {})
+                if rank > registers.get(index, 0):
+                    registers[index] = rank
+
+    def merge(self, pending: Dict[Tuple[Optional[int], str, datetime], Dict[int, int]]):
+        for key, raised in pending.items():
+            registers = self.pending.setdefault(key, {})
+            for index, rank in raised.items():
+                if rank > registers.get(index, 0):
+                    registers[index] = rank
+
+    async def flush(self, database) -> int:
+        """Write the buffered registers with one unordered bulk write; returns the register sets written"""
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return 0
+        try:
+            await database[ACTIVE_USERS_COLLECTION].bulk_write([
+                UpdateOne(
+                    {"project_id": scope, "granularity": granularity, "bucket": bucket},
+                    {"$max": {f"registers.{index}": rank for index, rank in registers.items()}},
+                    upsert=True
+                )
+                for (scope, granularity, bucket), registers in pending.items()
+            ], ordered=False)
+        except Exception:
+            # Kept for the next flush; updates that did apply are harmless to repeat
+            self.merge(pending)
+            raise
+        return len(pending)
+
+
+async def record_active_user(database, user_id: str, project_id: Optional[int], timestamp: datetime):
+    """Count one user right away (seeding, tests); the worker batches through ``ActiveUserBuffer``"""
+    buffer = ActiveUserBuffer()
+    buffer.add(user_id, project_id, timestamp)
+    await buffer.flush(database)
+
+
+# API side
+
+async def read_registers(
+    database, project_id: Optional[int], granularity: str, start: datetime, end: datetime
+) -> Dict[datetime, HyperLogLog]:
+    """Register sets per day or month in [start, end), platform-wide or for one project"""
+    documents = await database[ACTIVE_USERS_COLLECTION].find(
+        {
+            "project_id": project_id,
+            "granularity": granularity,
+            "bucket": {"$gte": bucket_start(start, granularity), "$lt": end},
+        },
+        {"_id": 0, "bucket": 1, "registers": 1}
+    ).to_list(None)
+    return {as_utc(document["bucket"]): HyperLogLog.from_document(document) for document in documents}
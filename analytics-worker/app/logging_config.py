@@ -0,0 +1,142 @@
+"""Structured logging with a non-blocking, queue-based sink.
+
+Both services keep an identical copy of this module. Each record is rendered
+to a JSON line in the calling thread by the ``QueueHandler`` on the root
+logger and a ``QueueListener`` thread writes the lines to stdout. The handler's
+``ProcessorFormatter`` renders structlog events and plain ``logging`` records
+(uvicorn's access and error logs) alike, so every line is the same JSON. The
+event loop never waits on the log collector: the queue holds at most
+``LOG_QUEUE_SIZE`` records and, when it is full, a record is dropped
+(``LOG_QUEUE_DROP=newest``, the incoming one, or ``oldest``, the one at the
+head of the queue). Dropped records are counted and reported by the writer
+thread once it catches up.
+"""
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+import structlog
+from app.config import settings
+
+# Loggers that come with their own handlers (uvicorn's) are routed through the queue too
+CAPTURED_LOGGERS = ["uvicorn", "uvicorn.error", "uvicorn.access"]
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue: queue.Queue, drop: str = "newest"):
+        super().__init__(log_queue)
+        self.drop = drop
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        if self.drop == "oldest":
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(record)
+            except (queue.Empty, queue.Full):
+                pass  # the writer or another thread got there first; drop this one
+        self.dropped += 1
+
+    def take_dropped(self) -> int:
+        dropped, self.dropped = self.dropped, 0
+        return dropped
+
+
+class ReportingQueueListener(QueueListener):
+    """QueueListener that reports records dropped since the last one it wrote"""
+
+    def __init__(self, log_queue: queue.Queue, producer: DroppingQueueHandler, *handlers: logging.Handler):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.producer = producer
+
+    def handle(self, record: logging.LogRecord):
+        dropped = self.producer.take_dropped()
+        if dropped:
+            super().handle(logging.makeLogRecord({
+                "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f'{{"event": "Log queue full, records dropped", "dropped": {dropped}, "level": "warning"}}',
+            }))
+        super().handle(record)
+
+    def enqueue_sentinel(self):
+        # Unlike put_nowait, waits for room so shutdown does not fail on a full queue
+        self.queue.put(self._sentinel, timeout=5)
+
+
+_listener: Optional[ReportingQueueListener] = None
+
+
+def json_formatter(foreign_pre_chain) -> structlog.stdlib.ProcessorFormatter:
+    """Formatter rendering structlog events and records from plain ``logging`` loggers as JSON lines"""
+    return structlog.stdlib.ProcessorFormatter(
+        foreign_pre_chain=foreign_pre_chain,
+        processors=[
+            structlog.stdlib.ProcessorFormatter.remove_processors_meta,
+            structlog.processors.format_exc_info,
+            structlog.processors.JSONRenderer(),
+        ],
+    )
+
+
+def configure_logging(stream=None) -> ReportingQueueListener:
+    """Configure structlog and the root logger to write through the queue (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    shared_processors = [
+        structlog.stdlib.add_logger_name,
+        structlog.stdlib.add_log_level,
+        structlog.processors.TimeStamper(fmt="iso"),
+    ]
+    structlog.configure(
+        processors=[
+            structlog.stdlib.filter_by_level,
+            *shared_processors,
+            structlog.stdlib.PositionalArgumentsFormatter(),
+            structlog.processors.StackInfoRenderer(),
+            structlog.processors.format_exc_info,
+            structlog.processors.UnicodeDecoder(),
+            structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
+        ],
+        context_class=dict,
+        logger_factory=structlog.stdlib.LoggerFactory(),
+        wrapper_class=structlog.stdlib.BoundLogger,
+        cache_logger_on_first_use=True,
+    )
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+    handler = DroppingQueueHandler(log_queue, settings.LOG_QUEUE_DROP)
+    handler.setFormatter(json_formatter(shared_processors))
+    writer = logging.StreamHandler(stream or sys.stdout)
+    writer.setFormatter(logging.Formatter("%(message)s"))
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(settings.LOG_LEVEL.upper())
+    for name in CAPTURED_LOGGERS:
+        captured = logging.getLogger(name)
+        captured.handlers = []
+        captured.propagate = True
+
+    _listener = ReportingQueueListener(log_queue, handler, writer)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
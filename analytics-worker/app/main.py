@@ -3,27 +3,14 @@ import signal
 import sys
 import structlog
 from app.config import settings
-from app.database import connect_to_mongo, close_mongo_connection
+from app.logging_config import configure_logging
+from app.database import connect_to_mongo, close_mongo_connection, start_index_management, get_database
 from app.kafka_consumer import KafkaEventConsumer
+from app.rollups import compact_rollups
+from app.archive import archive_events
 
-# Configure structured logging
-structlog.configure(
-    processors=[
-        structlog.stdlib.filter_by_level,
-        structlog.stdlib.add_logger_name,
-        structlog.stdlib.add_log_level,
-        structlog.stdlib.PositionalArgumentsFormatter(),
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.StackInfoRenderer(),
-        structlog.processors.format_exc_info,
-        structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer()
-    ],
-    context_class=dict,
-    logger_factory=structlog.stdlib.LoggerFactory(),
-    wrapper_class=structlog.stdlib.BoundLogger,
-    cache_logger_on_first_use=True,
-)
+# Configure structured logging, written to stdout by a background thread
+configure_logging()
 
 logger = structlog.get_logger()
 
@@ -32,6 +19,9 @@ class AnalyticsWorker:
     def __init__(self):
         self.kafka_consumer = KafkaEventConsumer()
         self.running = False
+        self.compaction_task = None
+        self.active_users_task = None
+        self.archive_task = None
 
     async def start(self):
         """Start the analytics worker"""
@@ -44,6 +34,9 @@ class AnalyticsWorker:
             print("Connecting to MongoDB...")
             await connect_to_mongo()
             
+            # Reconcile indexes in the background so consumption starts immediately
+            await start_index_management()
+            
             # Start Kafka consumer
             logger.info("Starting Kafka consumer")
             print("Starting Kafka consumer...")
@@ -52,6 +45,16 @@ class AnalyticsWorker:
             # Start consumer in background task
             consumer_task = asyncio.create_task(self.kafka_consumer.start_consumer())
             
+            # Write buffered HyperLogLog registers in bulk
+            self.active_users_task = asyncio.create_task(self._flush_active_users_periodically())
+            
+            # Fold closed hourly rollups into days, weeks and months periodically
+            self.compaction_task = asyncio.create_task(self._compact_rollups_periodically())
+            
+            # Move cold raw events to compressed segment files
+            if settings.ARCHIVE_AFTER_DAYS > 0:
+                self.archive_task = asyncio.create_task(self._archive_events_periodically())
+            
             # Wait for shutdown signal
             logger.info("Analytics worker started successfully")
             print("Analytics worker is running. Press Ctrl+C to stop.")
@@ -70,12 +73,56 @@ class AnalyticsWorker:
         print("Stopping analytics worker...")
         
         self.running = False
+        if self.active_users_task and not self.active_users_task.done():
+            self.active_users_task.cancel()
+        if self.compaction_task and not self.compaction_task.done():
+            self.compaction_task.cancel()
+        if self.archive_task and not self.archive_task.done():
+            self.archive_task.cancel()
         await self.kafka_consumer.stop_consumer()
+        await self._flush_active_users()
         await close_mongo_connection()
         
         logger.info("Analytics worker stopped")
         print("Analytics worker stopped")
 
+    async def _flush_active_users(self):
+        """Write the HyperLogLog registers buffered since the last flush"""
+        try:
+            await self.kafka_consumer.analytics_service.active_users.flush(get_database())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("Active user flush failed", error=str(e))
+
+    async def _flush_active_users_periodically(self):
+        """Flush buffered active-user registers every ACTIVE_USERS_FLUSH_SECONDS"""
+        while self.running:
+            await self._flush_active_users()
+            await asyncio.sleep(settings.ACTIVE_USERS_FLUSH_SECONDS)
+
+    async def _compact_rollups_periodically(self):
+        """Run rollup compaction every ROLLUP_COMPACTION_INTERVAL_SECONDS"""
+        while self.running:
+            try:
+                await compact_rollups(get_database(), settings.ROLLUP_COMPACTION_GRACE_SECONDS)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Rollup compaction failed", error=str(e))
+            await asyncio.sleep(settings.ROLLUP_COMPACTION_INTERVAL_SECONDS)
+
+    async def _archive_events_periodically(self):
+        """Archive events older than ARCHIVE_AFTER_DAYS every ARCHIVE_INTERVAL_SECONDS"""
+        while self.running:
+            try:
+                await archive_events(get_database())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Event archiving failed", error=str(e))
+            await asyncio.sleep(settings.ARCHIVE_INTERVAL_SECONDS)
+
     def handle_shutdown(self, signum, frame):
         """Handle shutdown signals"""
         logger.info("Received shutdown signal", signal=signum)
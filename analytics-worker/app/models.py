@@ -41,6 +41,7 @@ class UserMetrics(BaseModel):
     completion_rate: float = 0.0
     avg_completion_time_hours: Optional[float] = None
     last_activity: Optional[datetime] = None
+    version: int = 0  # Incremented by the worker on every change, used for ETags
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -56,5 +57,6 @@ class ProjectMetrics(BaseModel):
     avg_completion_time_hours: Optional[float] = None
     created_at_project: datetime
     last_activity: Optional[datetime] = None
+    version: int = 0  # Incremented by the worker on every change, used for ETags
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
\ No newline at end of file
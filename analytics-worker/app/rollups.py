@@ -0,0 +1,380 @@
+"""Hierarchical task activity rollups shared by the analytics API service and worker.
+
+Both services keep an identical copy of this module (like ``indexes.py``).
+The worker ``$inc``s hourly counters in ``task_rollups`` for every task event,
+once for the user (``project_id: None``) and once for the project. A compaction
+job folds closed hours into days, and closed days into ISO weeks and months,
+recording how far each level is complete in ``rollup_watermarks``. The API then
+answers any window with a handful of range reads: compacted buckets from the
+coarse level, the tail after its watermark from the next finer level.
+
+Only compaction writes the coarse levels. An event arriving after its day
+has ended still only increments its hour, and flags it with ``refold``; the
+next compaction run folds that user's (or project's) already compacted day,
+week and month again from their children, so compacted levels stay exact,
+and bumps the matching metrics ``version`` so API validators change with them.
+Folding replaces bucket values, and a concurrent ``$inc`` into a coarse
+bucket could land between the read of its children and the write, so the
+worker never writes there.
+
+Usage (worker):
+    python -m app.rollups            # compact closed buckets once
+    python -m app.rollups --rebuild  # reset watermarks and recompact from the hourly data
+"""
+import argparse
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne
+import structlog
+
+logger = structlog.get_logger()
+
+ROLLUPS_COLLECTION = "task_rollups"
+WATERMARKS_COLLECTION = "rollup_watermarks"
+
+GRANULARITIES = ["hour", "day", "week", "month"]
+COUNTERS = ["events", "created", "completed", "deleted"]
+
+# Each compacted level is folded from (and falls back to) the next finer one
+CHILD_GRANULARITY = {"day": "hour", "week": "day", "month": "day"}
+
+COMPACTION_BATCH_SIZE = 1000
+
+
+def as_utc(value: datetime) -> datetime:
+    """MongoDB returns naive datetimes in UTC"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    """Start of the UTC bucket containing ``timestamp`` (weeks start on Monday)"""
+    timestamp = as_utc(timestamp)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def next_bucket(start: datetime, granularity: str) -> datetime:
+    """Start of the bucket following the one starting at ``start``"""
+    if granularity == "hour":
+        return start + timedelta(hours=1)
+    if granularity == "day":
+        return start + timedelta(days=1)
+    if granularity == "week":
+        return start + timedelta(weeks=1)
+    if granularity == "month":
+        return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+    raise ValueError(f"Unknown granularity: {granularity}")
+
+
+def align_window(start: datetime, end: datetime, granularity: str) -> Dict[str, datetime]:
+    """Widen [start, end) to whole buckets"""
+    aligned_end = bucket_start(end, granularity)
+    if aligned_end < as_utc(end):
+        aligned_end = next_bucket(aligned_end, granularity)
+    return {"start": bucket_start(start, granularity), "end": aligned_end}
+
+
+def count_buckets(start: datetime, end: datetime, granularity: str) -> int:
+    count, bucket = 0, bucket_start(start, granularity)
+    while bucket < end:
+        count += 1
+        bucket = next_bucket(bucket, granularity)
+    return count
+
+
+def event_counters(event: str, status: Optional[str]) -> Dict[str, int]:
+    """Counter increments for one task event"""
+    counters = {"events": 1}
+    if event == "task_created":
+        counters["created"] = 1
+    elif event == "task_updated" and status == "completed":
+        counters["completed"] = 1
+    elif event == "task_deleted":
+        counters["deleted"] = 1
+    return counters
+
+
+def empty_counters() -> Dict[str, int]:
+    return {counter: 0 for counter in COUNTERS}
+
+
+# Worker side
+
+async def record_task_event(
+    database,
+    user_id: str,
+    project_id: Optional[int],
+    event: str,
+    status: Optional[str],
+    timestamp: datetime,
+    now: Optional[datetime] = None
+):
+    """Add one task event to the hourly rollups of its user and project.
+
+    An event for a day that has already ended may belong to compacted
+    buckets, so its hour is flagged for ``compact_rollups`` to fold them again.
+    """
+    now = as_utc(now or datetime.now(timezone.utc))
+    increments = event_counters(event, status)
+    day = bucket_start(timestamp, "day")
+    fields: Dict[str, Any] = {"updated_at": now}
+    if next_bucket(day, "day") <= now:
+        fields["refold"] = True
+
+    operations = [
+        UpdateOne(
+            {
+                "user_id": user_id,
+                "project_id": scope,
+                "granularity": "hour",
+                "bucket": bucket_start(timestamp, "hour"),
+            },
+            {"$inc": {f"counters.{name}": value for name, value in increments.items()}, "$set": fields},
+            upsert=True
+        )
+        for scope in [None] + ([project_id] if project_id is not None else [])
+    ]
+    await database[ROLLUPS_COLLECTION].bulk_write(operations, ordered=False)
+
+
+async def load_watermarks(database, session=None) -> Dict[str, datetime]:
+    """How far each compacted level is complete: {granularity: first uncompacted bucket}"""
+    watermarks = {}
+    async for document in database[WATERMARKS_COLLECTION].find({}, session=session):
+        watermarks[document["_id"]] = as_utc(document["compacted_until"])
+    return watermarks
+
+
+async def _fold_level(
+    database, granularity: str, start: datetime, end: datetime, scope: Optional[Dict[str, Any]] = None
+) -> int:
+    """Recompute every ``granularity`` bucket in [start, end) from its child buckets, optionally for one scope"""
+    child = CHILD_GRANULARITY[granularity]
+    folded: Dict[tuple, Dict[str, int]] = {}
+    cursor = database[ROLLUPS_COLLECTION].find(
+        {**(scope or {}), "granularity": child, "bucket": {"$gte": start, "$lt": end}},
+        {"_id": 0, "user_id": 1, "project_id": 1, "bucket": 1, "counters": 1}
+    )
+    async for document in cursor:
+        key = (document["user_id"], document.get("project_id"), bucket_start(document["bucket"], granularity))
+        totals = folded.setdefault(key, empty_counters())
+        for name, value in document.get("counters", {}).items():
+            totals[name] = totals.get(name, 0) + value
+
+    now = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne(
+            {"user_id": user_id, "project_id": project_id, "granularity": granularity, "bucket": bucket},
+            {"$set": {"counters": totals, "updated_at": now}},
+            upsert=True
+        )
+        for (user_id, project_id, bucket), totals in folded.items()
+    ]
+    for offset in range(0, len(operations), COMPACTION_BATCH_SIZE):
+        await database[ROLLUPS_COLLECTION].bulk_write(operations[offset:offset + COMPACTION_BATCH_SIZE], ordered=False)
+    return len(operations)
+
+
+async def _refold_late_events(database, watermarks: Dict[str, datetime]) -> int:
+    """Fold the compacted buckets above hours flagged by late events again; returns the buckets written"""
+    hours = await database[ROLLUPS_COLLECTION].find(
+        {"granularity": "hour", "refold": True}, {"_id": 1, "user_id": 1, "project_id": 1, "bucket": 1}
+    ).to_list(None)
+    if not hours:
+        return 0
+
+    # Flags are cleared before the hours are read, so an event landing during
+    # the fold flags its hour again for the next run instead of being lost
+    await database[ROLLUPS_COLLECTION].bulk_write([
+        UpdateOne({"user_id": hour["user_id"], "_id": hour["_id"], "refold": True}, {"$unset": {"refold": ""}})
+        for hour in hours
+    ], ordered=False)
+
+    written = 0
+    changed = set()
+    days = {(hour["user_id"], hour.get("project_id"), bucket_start(hour["bucket"], "day")) for hour in hours}
+    # Days first, since weeks and months are folded from them
+    for granularity in ("day", "week", "month"):
+        watermark = watermarks.get(granularity)
+        buckets = {(user_id, project_id, bucket_start(day, granularity)) for user_id, project_id, day in days}
+        for user_id, project_id, bucket in buckets:
+            if watermark is None or bucket >= watermark:
+                continue  # not compacted yet, the regular fold will include the hour
+            written += await _fold_level(
+                database, granularity, bucket, next_bucket(bucket, granularity),
+                {"user_id": user_id, "project_id": project_id}
+            )
+            changed.add((user_id, project_id))
+
+    # Windows over these buckets change now rather than when the events were
+    # counted, so move the versions the API builds its validators from
+    if changed:
+        bump = {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}}
+        users = sorted({user_id for user_id, project_id in changed if project_id is None})
+        projects = sorted((user_id, project_id) for user_id, project_id in changed if project_id is not None)
+        if users:
+            await database["user_metrics"].bulk_write(
+                [UpdateOne({"user_id": user_id}, bump) for user_id in users], ordered=False
+            )
+            await database["user_dashboard"].bulk_write(
+                [UpdateOne({"_id": user_id}, bump) for user_id in users], ordered=False
+            )
+        if projects:
+            await database["project_metrics"].bulk_write([
+                UpdateOne({"user_id": user_id, "project_id": project_id}, bump) for user_id, project_id in projects
+            ], ordered=False)
+    return written
+
+
+async def compact_rollups(database, grace_seconds: int, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Fold closed buckets into the next level, resuming from the stored watermarks.
+
+    Days are compacted first because weeks and months are folded from days.
+    Then buckets that received late events are folded again. Returns the
+    number of buckets written per level, and ``refolded``.
+    """
+    now = as_utc(now or datetime.now(timezone.utc))
+    closed_before = now - timedelta(seconds=grace_seconds)
+    watermarks = await load_watermarks(database)
+    written = {}
+
+    for granularity in ("day", "week", "month"):
+        child = CHILD_GRANULARITY[granularity]
+        # Only whole buckets that closed before the grace period, and whose children are complete
+        limit = bucket_start(closed_before, granularity)
+        if child != "hour":
+            if child not in watermarks:
+                written[granularity] = 0
+                continue
+            limit = min(limit, bucket_start(watermarks[child], granularity))
+
+        start = watermarks.get(granularity)
+        if start is None:
+            oldest = await database[ROLLUPS_COLLECTION].find_one(
+                {"granularity": "hour"}, {"bucket": 1}, sort=[("granularity", 1), ("bucket", 1)]
+            )
+            if oldest is None:
+                break
+            start = bucket_start(oldest["bucket"], granularity)
+
+        written[granularity] = 0
+        if start >= limit:
+            continue
+
+        written[granularity] = await _fold_level(database, granularity, start, limit)
+        await database[WATERMARKS_COLLECTION].update_one(
+            {"_id": granularity}, {"$set": {"compacted_until": limit, "updated_at": now}}, upsert=True
+        )
+        watermarks[granularity] = limit
+        logger.info("Rollups compacted", granularity=granularity, start=start.isoformat(),
+                    until=limit.isoformat(), buckets=written[granularity])
+
+    written["refolded"] = await _refold_late_events(database, watermarks)
+    if written["refolded"]:
+        logger.info("Rollups refolded after late events", buckets=written["refolded"])
+    return written
+
+
+# API side
+
+async def read_series(
+    database,
+    user_id: str,
+    project_id: Optional[int],
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    watermarks: Optional[Dict[str, datetime]] = None,
+    session=None
+) -> Dict[datetime, Dict[str, int]]:
+    """Counters per ``granularity`` bucket in [start, end) for a user or one of their projects.
+
+    ``start`` and ``end`` must be aligned to ``granularity`` (see ``align_window``).
+    Reads run in ``session`` when given.
+    """
+    if watermarks is None:
+        watermarks = await load_watermarks(database, session)
+
+    series: Dict[datetime, Dict[str, int]] = {}
+    if start >= end:
+        return series
+
+    # Compacted buckets come from this level, the rest is folded from the finer one
+    split = end if granularity == "hour" else min(end, max(start, watermarks.get(granularity, start)))
+    if split > start:
+        documents = await database[ROLLUPS_COLLECTION].find(
+            {
+                "user_id": user_id,
+                "project_id": project_id,
+                "granularity": granularity,
+                "bucket": {"$gte": start, "$lt": split},
+            },
+            {"_id": 0, "bucket": 1, "counters": 1},
+            session=session
+        ).to_list(None)
+        for document in documents:
+            series[as_utc(document["bucket"])] = {**empty_counters(), **document.get("counters", {})}
+
+    if split < end:
+        finer = await read_series(
+            database, user_id, project_id, CHILD_GRANULARITY[granularity], split, end, watermarks, session
+        )
+        for bucket, counters in finer.items():
+            totals = series.setdefault(bucket_start(bucket, granularity), empty_counters())
+            for name, value in counters.items():
+                totals[name] = totals.get(name, 0) + value
+
+    return series
+
+
+def summarize_window(
+    series: Dict[datetime, Dict[str, int]], granularity: str, start: datetime, end: datetime
+) -> Dict[str, Any]:
+    """Shape a series as the ``window`` block of API responses, including empty buckets"""
+    buckets: List[Dict[str, Any]] = []
+    totals = empty_counters()
+    bucket = start
+    while bucket < end:
+        counters = series.get(bucket, empty_counters())
+        buckets.append({"bucket": bucket.isoformat(), **{name: counters.get(name, 0) for name in COUNTERS}})
+        for name in COUNTERS:
+            totals[name] += counters.get(name, 0)
+        bucket = next_bucket(bucket, granularity)
+
+    return {
+        "from": start.isoformat(),
+        "to": end.isoformat(),
+        "granularity": granularity,
+        "totals": totals,
+        "series": buckets,
+    }
+
+
+async def _main(rebuild: bool) -> Dict[str, int]:
+    from app.config import settings
+    from app.database import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        database = get_database()
+        if rebuild:
+            await database[WATERMARKS_COLLECTION].delete_many({})
+        return await compact_rollups(database, settings.ROLLUP_COMPACTION_GRACE_SECONDS)
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact hourly task rollups into days, weeks and months")
+    parser.add_argument("--rebuild", action="store_true", help="reset watermarks and recompact everything")
+    args = parser.parse_args()
+    print(asyncio.run(_main(args.rebuild)))
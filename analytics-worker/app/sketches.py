@@ -0,0 +1,274 @@
+"""Mergeable task completion-time sketches shared by the analytics API service and worker.
+
+Both services keep an identical copy of this module (like ``rollups.py``).
+Completion times (hours from ``task_created`` to the completing
+``task_updated``) are summarised in DDSketches: values fall into logarithmic
+bins whose width guarantees every quantile estimate is within
+``RELATIVE_ACCURACY`` of the true value, and two sketches merge by adding bin
+counts. The worker keeps one sketch per user and per project for every day,
+plus an all-time one, in ``completion_sketches`` as a small binary field. The
+API merges the day sketches covering a window at query time.
+"""
+import math
+import struct
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from bson import Binary
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import structlog
+from app.rollups import as_utc, bucket_start
+
+logger = structlog.get_logger()
+
+SKETCHES_COLLECTION = "completion_sketches"
+
+RELATIVE_ACCURACY = 0.01
+MAX_BINS = 2048
+# Completion times below this (in hours) are counted as zero
+MIN_INDEXABLE_VALUE = 1e-6
+
+PERCENTILES = {"p50_hours": 0.5, "p90_hours": 0.9, "p99_hours": 0.99}
+
+DUPLICATE_KEY = 11000
+
+_FORMAT_VERSION = 1
+_HEADER = struct.Struct("<BdQdddQI")  # version, accuracy, count, sum, min, max, zero count, bins
+
+
+def _write_varint(buffer: bytearray, value: int):
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data: bytes, offset: int) -> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class DDSketch:
+    """Quantile sketch with relative-error guarantees (Masson et al., VLDB 2019).
+
+    A positive value ``x`` is counted in bin ``ceil(log_gamma(x))`` with
+    ``gamma = (1 + a) / (1 - a)``. When there are more than ``max_bins`` bins
+    the lowest ones are collapsed, so only low quantiles lose accuracy.
+    """
+
+    def __init__(self, relative_accuracy: float = RELATIVE_ACCURACY, max_bins: int = MAX_BINS):
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index: int) -> float:
+        # Midpoint of the bin (gamma^(i-1), gamma^i] with the smallest relative error
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def add(self, value: float, weight: int = 1):
+        value = max(value, 0.0)  # clock skew between services can produce small negatives
+        if value < MIN_INDEXABLE_VALUE:
+            self.zero_count += weight
+        else:
+            index = self._index(value)
+            self.bins[index] = self.bins.get(index, 0) + weight
+            self._collapse()
+        self.count += weight
+        self.sum += value * weight
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "DDSketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Sketches with different relative accuracy cannot be merged")
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        self._collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def _collapse(self):
+        if len(self.bins) <= self.max_bins:
+            return
+        indexes = sorted(self.bins)
+        overflow = len(indexes) - self.max_bins
+        target = indexes[overflow]
+        for index in indexes[:overflow]:
+            self.bins[target] += self.bins.pop(index)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.bins):
+            seen += self.bins[index]
+            if seen > rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def to_bytes(self) -> bytes:
+        """Compact encoding: fixed header, then delta/zigzag varint bin indexes and varint counts"""
+        buffer = bytearray(_HEADER.pack(
+            _FORMAT_VERSION, self.relative_accuracy, self.count, self.sum,
+            self.min if self.count else 0.0, self.max if self.count else 0.0,
+            self.zero_count, len(self.bins)
+        ))
+        previous = 0
+        for index in sorted(self.bins):
+            delta = index - previous
+            _write_varint(buffer, (delta << 1) ^ (delta >> 63))
+            _write_varint(buffer, self.bins[index])
+            previous = index
+        return bytes(buffer)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, max_bins: int = MAX_BINS) -> "DDSketch":
+        version, accuracy, count, total, minimum, maximum, zero_count, bins = _HEADER.unpack_from(data)
+        if version != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported sketch format version {version}")
+        sketch = cls(accuracy, max_bins)
+        sketch.count, sketch.sum, sketch.zero_count = count, total, zero_count
+        if count:
+            sketch.min, sketch.max = minimum, maximum
+        offset, index = _HEADER.size, 0
+        for _ in range(bins):
+            encoded, offset = _read_varint(data, offset)
+            index += (encoded >> 1) ^ -(encoded & 1)
+            sketch.bins[index], offset = _read_varint(data, offset)
+        return sketch
+
+
+def summarize_sketch(sketch: DDSketch) -> Dict[str, Any]:
+    """Shape a sketch as the ``completion_time`` block of API responses"""
+    summary: Dict[str, Any] = {
+        "count": sketch.count,
+        "mean_hours": sketch.sum / sketch.count if sketch.count else None,
+    }
+    for name, q in PERCENTILES.items():
+        summary[name] = sketch.quantile(q)
+    return summary
+
+
+# Worker side
+
+def _sketch_key(document: Dict[str, Any]) -> Tuple:
+    bucket = document.get("bucket")
+    return document.get("project_id"), document["granularity"], as_utc(bucket) if bucket else None
+
+
+async def _add_to_sketches(
+    collection, user_id: str, keys: List[Dict[str, Any]], hours: float, attempts: int = 5
+) -> List[Dict[str, Any]]:
+    """Add ``hours`` to several of a user's sketches; returns the keys that kept conflicting.
+
+    Each attempt is one read and one unordered bulk write, both routed to the
+    user's shard. Every write only replaces the sketch it was built from (the
+    ``count`` acts as a version) and otherwise turns into an insert that fails
+    on the unique sketch key, so only the sketches a concurrent writer changed
+    are read and merged again.
+    """
+    pending = keys
+    for _ in range(attempts):
+        documents = await collection.find(
+            {"user_id": user_id, "$or": pending},
+            {"project_id": 1, "granularity": 1, "bucket": 1, "sketch": 1, "count": 1}
+        ).to_list(None)
+        current = {_sketch_key(document): document for document in documents}
+
+        operations = []
+        now = datetime.now(timezone.utc)
+        for key in pending:
+            document = current.get(_sketch_key(key))
+            sketch = DDSketch.from_bytes(document["sketch"]) if document else DDSketch()
+            sketch.add(hours)
+            operations.append(UpdateOne(
+                {"user_id": user_id, **key, "count": document["count"] if document else {"$exists": False}},
+                {"$set": {"sketch": Binary(sketch.to_bytes()), "count": sketch.count, "sum_hours": sketch.sum,
+                          "updated_at": now}},
+                upsert=True
+            ))
+
+        try:
+            await collection.bulk_write(operations, ordered=False)
+            return []
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != DUPLICATE_KEY for error in errors):
+                raise
+            pending = [pending[error["index"]] for error in errors]
+    return pending
+
+
+async def record_completion_time(
+    database,
+    user_id: str,
+    project_id: Optional[int],
+    hours: float,
+    completed_at: datetime
+):
+    """Add one completion time to the day and all-time sketches of its user and project"""
+    day = bucket_start(as_utc(completed_at), "day")
+    keys = [
+        {"project_id": scope, "granularity": granularity, "bucket": bucket}
+        for scope in [None] + ([project_id] if project_id is not None else [])
+        for granularity, bucket in (("day", day), ("all", None))
+    ]
+    conflicting = await _add_to_sketches(database[SKETCHES_COLLECTION], user_id, keys, hours)
+    if conflicting:
+        logger.warning("Completion sketch update kept conflicting", user_id=user_id, sketches=conflicting)
+
+
+# API side
+
+def merge_sketches(documents: Iterable[Dict[str, Any]]) -> DDSketch:
+    merged = DDSketch()
+    for document in documents:
+        merged.merge(DDSketch.from_bytes(document["sketch"]))
+    return merged
+
+
+async def read_completion_times(
+    database,
+    user_id: str,
+    project_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> DDSketch:
+    """Merged completion-time sketch for a user or one of their projects.
+
+    Without a window this is the all-time sketch. A window is widened to whole
+    days, since the per-bucket sketches are kept per day.
+    """
+    collection = database[SKETCHES_COLLECTION]
+    query: Dict[str, Any] = {"user_id": user_id, "project_id": project_id}
+    if start is None or end is None:
+        document = await collection.find_one({**query, "granularity": "all", "bucket": None}, {"_id": 0, "sketch": 1})
+        return merge_sketches([document] if document else [])
+
+    documents: List[Dict[str, Any]] = await collection.find(
+        {**query, "granularity": "day", "bucket": {"$gte": bucket_start(start, "day"), "$lt": end}},
+        {"_id": 0, "sketch": 1}
+    ).to_list(None)
+    return merge_sketches(documents)
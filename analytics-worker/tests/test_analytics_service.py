@@ -0,0 +1,155 @@
+import pytest
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock, Mock
+from app.analytics_service import AnalyticsService, RECENT_ACTIVITY_LIMIT
+from app.models import TaskEvent
+
+
+@pytest.fixture
+def mock_db():
+    db = MagicMock()
+    dashboard = Mock()
+    dashboard.update_one = AsyncMock(return_value=Mock(upserted_id=None))
+    db.__getitem__.side_effect = lambda name: {"user_dashboard": dashboard}[name]
+    db.user_dashboard = dashboard
+    return db
+
+
+@pytest.fixture
+def analytics_service(mock_db):
+    service = AnalyticsService()
+    service.db = mock_db
+    return service
+
+
+def make_task_event(**fields):
+    return TaskEvent(**{
+        "event": "task_created", "task_id": 7, "project_id": 2, "user_id": "1", "username": "testuser",
+        "timestamp": datetime(2024, 1, 5, 9, 30, tzinfo=timezone.utc), **fields
+    })
+
+
+def make_user_metrics(**fields):
+    return {
+        "total_tasks": 4, "completed_tasks": 1, "active_projects": 2, "completion_rate": 0.25,
+        "version": 9, "updated_at": datetime(2024, 1, 5, 9, 31, tzinfo=timezone.utc), **fields
+    }
+
+
+class TestDashboard:
+    @pytest.mark.asyncio
+    async def test_update_dashboard_pushes_bounded_recent_activity(self, analytics_service, mock_db):
+        """Counters and version are copied over and the event is pushed newest first, capped at ten"""
+        event = make_task_event()
+
+        await analytics_service._update_dashboard(event, make_user_metrics())
+
+        mock_db.user_dashboard.update_one.assert_awaited_once()
+        query, update = mock_db.user_dashboard.update_one.await_args.args
+        assert query == {"_id": "1"}
+        assert mock_db.user_dashboard.update_one.await_args.kwargs == {"upsert": True}
+        assert update["$set"] == {
+            "total_tasks": 4, "completed_tasks": 1, "active_projects": 2, "completion_rate": 0.25,
+            "version": 9, "updated_at": datetime(2024, 1, 5, 9, 31, tzinfo=timezone.utc)
+        }
+        assert update["$push"]["recent_activity"] == {
+            "$each": [{"type": "task", "event": "task_created", "task_id": 7, "project_id": 2,
+                       "timestamp": event.timestamp}],
+            "$sort": {"timestamp": -1},
+            "$slice": 10
+        }
+        mock_db.task_events.find.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_first_dashboard_write_seeds_recent_activity(self, analytics_service, mock_db):
+        """A newly upserted dashboard is seeded once from the user's latest task events"""
+        mock_db.user_dashboard.update_one.return_value = Mock(upserted_id="1")
+        history = [
+            {"event": "task_created", "task_id": 7, "project_id": 2, "timestamp": datetime(2024, 1, 5, 9, 30)},
+            {"event": "task_created", "task_id": 6, "project_id": 2, "timestamp": datetime(2024, 1, 4, 8, 0)},
+        ]
+        find = mock_db.task_events.find
+        find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=history)
+
+        await analytics_service._update_dashboard(make_task_event(), make_user_metrics())
+
+        assert find.call_args.args[0] == {"user_id": "1"}
+        find.return_value.sort.assert_called_once_with("timestamp", -1)
+        find.return_value.sort.return_value.limit.assert_called_once_with(RECENT_ACTIVITY_LIMIT)
+        assert mock_db.user_dashboard.update_one.await_count == 2
+        assert mock_db.user_dashboard.update_one.await_args.args == (
+            {"_id": "1"}, {"$set": {"recent_activity": [{"type": "task", **event} for event in history]}}
+        )
+
+    @pytest.mark.asyncio
+    async def test_first_event_of_a_new_user_is_not_reseeded(self, analytics_service, mock_db):
+        """When the only event is the one just pushed the seed write is skipped"""
+        mock_db.user_dashboard.update_one.return_value = Mock(upserted_id="1")
+        find = mock_db.task_events.find
+        find.return_value.sort.return_value.limit.return_value.to_list = AsyncMock(return_value=[{"task_id": 7}])
+
+        await analytics_service._update_dashboard(make_task_event(), make_user_metrics())
+
+        mock_db.user_dashboard.update_one.assert_awaited_once()
+
+    @pytest.mark.asyncio
+    async def test_metrics_version_is_bumped_last(self, analytics_service, monkeypatch):
+        """Rollups, sketches and HyperLogLogs are written before the version the ETags come from"""
+        calls = []
+        for name in ("_update_rollups", "_update_completion_sketches",
+                     "_update_project_metrics_from_task", "_update_user_metrics"):
+            monkeypatch.setattr(analytics_service, name, AsyncMock(side_effect=lambda *args, name=name: calls.append(name)))
+        monkeypatch.setattr(analytics_service.active_users, "add",
+                            Mock(side_effect=lambda *args: calls.append("active_users.add")))
+
+        await analytics_service.update_task_metrics(make_task_event(event="task_updated", status="completed"))
+
+        assert calls[0] == "active_users.add"
+        assert sorted(calls[1:3]) == ["_update_completion_sketches", "_update_rollups"]
+        assert calls[3:] == ["_update_project_metrics_from_task", "_update_user_metrics"]
+
+
+class TestTaskCreatedAt:
+    @pytest.fixture
+    def created_at(self, mock_db):
+        collection = Mock(update_one=AsyncMock(), delete_one=AsyncMock(), find_one=AsyncMock(return_value=None))
+        mock_db.__getitem__.side_effect = lambda name: {"task_created_at": collection}[name]
+        mock_db.task_events.find_one = AsyncMock(return_value=None)
+        return collection
+
+    @pytest.mark.asyncio
+    async def test_creation_time_is_kept_until_the_task_is_deleted(self, analytics_service, created_at):
+        """Created tasks upsert the earliest creation time, deleted tasks drop it"""
+        event = make_task_event()
+
+        await analytics_service._update_task_created_at(event)
+        await analytics_service._update_task_created_at(make_task_event(event="task_deleted"))
+
+        created_at.update_one.assert_awaited_once_with(
+            {"user_id": "1", "task_id": 7}, {"$min": {"created_at": event.timestamp}}, upsert=True
+        )
+        created_at.delete_one.assert_awaited_once_with({"user_id": "1", "task_id": 7})
+
+    @pytest.mark.asyncio
+    async def test_completion_uses_kept_creation_time(self, analytics_service, mock_db, created_at, monkeypatch):
+        """Completions are timed from the kept creation time, even once the task_created event is archived"""
+        created_at.find_one.return_value = {"created_at": datetime(2024, 1, 5, 7, 30, tzinfo=timezone.utc)}
+        record = AsyncMock()
+        monkeypatch.setattr("app.analytics_service.record_completion_time", record)
+
+        await analytics_service._update_completion_sketches(make_task_event(event="task_updated", status="completed"))
+
+        assert record.await_args.args[1:4] == ("1", 2, 2.0)
+        mock_db.task_events.find_one.assert_not_awaited()
+
+    @pytest.mark.asyncio
+    async def test_completion_falls_back_to_the_creation_event(self, analytics_service, mock_db, created_at, monkeypatch):
+        """Tasks created before creation times were kept are timed from their task_created event"""
+        mock_db.task_events.find_one.return_value = {"timestamp": datetime(2024, 1, 5, 8, 30)}
+        record = AsyncMock()
+        monkeypatch.setattr("app.analytics_service.record_completion_time", record)
+
+        await analytics_service._update_completion_sketches(make_task_event(event="task_updated", status="completed"))
+
+        assert mock_db.task_events.find_one.await_args.args[0] == {"user_id": "1", "task_id": 7, "event": "task_created"}
+        assert record.await_args.args[3] == 1.0
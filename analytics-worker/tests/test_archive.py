@@ -0,0 +1,156 @@
+import os
+import pytest
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import DeleteMany
+from app.archive import INDEX_FILE, append_frames, archive_collection, read_archived, read_events
+from app.config import RAW_EVENTS_WINDOW_DAYS, Settings
+
+DAY = datetime(2024, 1, 10, tzinfo=timezone.utc)
+
+
+def make_event(user_id, hour, **fields):
+    return {"_id": ObjectId(), "user_id": user_id, "event": "task_created", "task_id": hour,
+            "timestamp": DAY + timedelta(hours=hour), **fields}
+
+
+class Cursor:
+    def __init__(self, documents):
+        self.documents = documents
+
+    def sort(self, *args):
+        return self
+
+    def limit(self, limit):
+        self.documents = self.documents[:limit]
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.documents)
+
+
+class EventCollection:
+    """Just enough of a Motor collection for archiving: timestamp and user filters, per-user deletes"""
+
+    def __init__(self, documents):
+        self.documents = sorted(documents, key=lambda event: (event["timestamp"], event["_id"]))
+        self.bulk_writes = []
+
+    def find(self, query):
+        documents = [event for event in self.documents if event["timestamp"] < query["timestamp"]["$lt"]]
+        if "user_id" in query:
+            documents = [event for event in documents
+                         if event["user_id"] == query["user_id"] and event["timestamp"] >= query["timestamp"]["$gte"]]
+        return Cursor(documents)
+
+    async def bulk_write(self, operations, ordered=True):
+        self.bulk_writes.append(operations)
+        for operation in operations:
+            query = operation._filter
+            self.documents = [event for event in self.documents
+                              if not (event["user_id"] == query["user_id"] and event["_id"] in query["_id"]["$in"])]
+
+
+def write_day(archive_dir, frames):
+    return append_frames(str(archive_dir), "task_events", DAY.date().isoformat(), frames)
+
+
+class TestSegments:
+    def test_round_trip(self, tmp_path):
+        """Each user's frame reads back alone, oldest first, within the requested range"""
+        first, second = make_event("1", 9), make_event("1", 11)
+        write_day(tmp_path, {"1": [first, second], "2": [make_event("2", 10)]})
+
+        events = read_archived("task_events", "1", DAY, DAY + timedelta(hours=10), archive_dir=str(tmp_path))
+
+        assert [event["_id"] for event in events] == [str(first["_id"])]
+        assert events[0]["timestamp"] == first["timestamp"]
+        assert len(read_archived("task_events", "1", DAY, DAY + timedelta(days=1), archive_dir=str(tmp_path))) == 2
+
+    def test_batch_archived_twice_keeps_one_copy(self, tmp_path):
+        """A frame appended again after a crash is dropped by _id"""
+        events = [make_event("1", 9), make_event("1", 10)]
+        write_day(tmp_path, {"1": events})
+        write_day(tmp_path, {"1": events[1:]})
+
+        read = read_archived("task_events", "1", DAY, DAY + timedelta(days=1), archive_dir=str(tmp_path))
+
+        assert [event["_id"] for event in read] == [str(event["_id"]) for event in events]
+
+    def test_truncated_index_line_is_skipped(self, tmp_path):
+        """An index line cut short by a crash is ignored and the lines before it still read"""
+        event = make_event("1", 9)
+        write_day(tmp_path, {"1": [event]})
+        index = os.path.join(tmp_path, "task_events", f"date={DAY.date().isoformat()}", INDEX_FILE)
+        with open(index, "ab") as file:
+            file.write(b'{"user_id": "1", "offs')
+
+        read = read_archived("task_events", "1", DAY, DAY + timedelta(days=1), archive_dir=str(tmp_path))
+
+        assert [event["_id"] for event in read] == [str(event["_id"])]
+
+    @pytest.mark.asyncio
+    async def test_read_events_prefers_the_mongodb_copy(self, tmp_path):
+        """An event both archived and still in MongoDB is returned once, as stored in MongoDB"""
+        archived, both = make_event("1", 8), make_event("1", 9, status="pending")
+        write_day(tmp_path, {"1": [archived, both]})
+        recent = make_event("1", 12)
+        database = {"task_events": EventCollection([{**both, "status": "completed"}, recent])}
+
+        events = await read_events(database, "task_events", "1", DAY, DAY + timedelta(days=1), archive_dir=str(tmp_path))
+
+        assert [event["_id"] for event in events] == [str(archived["_id"]), str(both["_id"]), str(recent["_id"])]
+        assert events[1]["status"] == "completed"
+
+
+class TestArchiveCollection:
+    @pytest.mark.asyncio
+    async def test_archives_old_events_and_deletes_them_per_user(self, tmp_path):
+        """Events before the cutoff are archived, then deleted with one shard-targeted DeleteMany per user"""
+        old = [make_event("1", 1), make_event("2", 2), make_event("1", 3)]
+        recent = make_event("1", 30)
+        collection = EventCollection(old + [recent])
+        database = {"task_events": collection}
+
+        stats = await archive_collection(database, "task_events", DAY + timedelta(days=1),
+                                         archive_dir=str(tmp_path), batch_size=10)
+
+        assert stats == {"events": 3, "batches": 1}
+        assert collection.documents == [recent]
+        operations, = collection.bulk_writes
+        assert all(isinstance(operation, DeleteMany) for operation in operations)
+        assert sorted((operation._filter["user_id"], operation._filter["_id"]["$in"]) for operation in operations) == [
+            ("1", [old[0]["_id"], old[2]["_id"]]), ("2", [old[1]["_id"]])
+        ]
+        read = read_archived("task_events", "1", DAY, DAY + timedelta(days=1), archive_dir=str(tmp_path))
+        assert [event["_id"] for event in read] == [str(old[0]["_id"]), str(old[2]["_id"])]
+
+
+class TestArchiveSettings:
+    def test_archiving_inside_the_raw_event_window_is_rejected(self):
+        """Events the API still reads from task_events may not be archived; 0 turns archiving off"""
+        settings = Settings()
+        settings.ARCHIVE_AFTER_DAYS = RAW_EVENTS_WINDOW_DAYS - 1
+        with pytest.raises(ValueError, match="ARCHIVE_AFTER_DAYS"):
+            settings.check_event_storage()
+
+        for days in (0, RAW_EVENTS_WINDOW_DAYS):
+            settings.ARCHIVE_AFTER_DAYS = days
+            settings.check_event_storage()
+
+    def test_retention_shorter_than_archival_is_rejected(self):
+        """Events may not expire before the API has read them or the archiver has moved them"""
+        settings = Settings()
+        settings.ARCHIVE_AFTER_DAYS = 60
+        settings.EVENTS_RETENTION_DAYS = 45
+        with pytest.raises(ValueError, match="EVENTS_RETENTION_DAYS"):
+            settings.check_event_storage()
+
+        settings.ARCHIVE_AFTER_DAYS = 0
+        settings.EVENTS_RETENTION_DAYS = RAW_EVENTS_WINDOW_DAYS - 1
+        with pytest.raises(ValueError, match="EVENTS_RETENTION_DAYS"):
+            settings.check_event_storage()
+
+        for archive_days, retention_days in ((60, 0), (60, 90), (0, RAW_EVENTS_WINDOW_DAYS)):
+            settings.ARCHIVE_AFTER_DAYS, settings.EVENTS_RETENTION_DAYS = archive_days, retention_days
+            settings.check_event_storage()
@@ -0,0 +1,219 @@
+import math
+import numpy as np
+import pytest
+from datetime import datetime, timedelta, timezone
+from app.batch_analytics import (
+    activity_matrices,
+    cohort_counts,
+    load_activity,
+    productivity_scores,
+    run_batch_analytics,
+    streaks,
+    week_over_week,
+)
+
+START = datetime(2024, 1, 15, tzinfo=timezone.utc)
+
+
+class AsyncCursor:
+    """Async-iterable stand-in for a Motor cursor"""
+
+    def __init__(self, documents):
+        self.documents = list(documents)
+
+    def sort(self, *args):
+        return self
+
+    async def to_list(self, length=None):
+        return list(self.documents)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.documents:
+            raise StopAsyncIteration
+        return self.documents.pop(0)
+
+
+def _matches(document, query):
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if "$gte" in condition and not value >= condition["$gte"]:
+                return False
+            if "$lt" in condition and not value < condition["$lt"]:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    def __init__(self, documents=()):
+        self.documents = list(documents)
+        self.queries = []
+        self.operations = []
+
+    def find(self, query=None, projection=None, **kwargs):
+        self.queries.append(query or {})
+        return AsyncCursor(document for document in self.documents if _matches(document, query or {}))
+
+    async def bulk_write(self, operations, **kwargs):
+        self.operations.extend(operations)
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+
+    def __getattr__(self, name):
+        return self[name]
+
+
+def rollup(user_id, day, completed, events=None):
+    return {
+        "user_id": user_id, "project_id": None, "granularity": "day", "bucket": START + timedelta(days=day),
+        "counters": {"completed": completed, "events": completed if events is None else events}
+    }
+
+
+class TestStatistics:
+    def test_productivity_scores(self):
+        """The last 30 days average, times 20, capped at 100 and rounded"""
+        completed = np.zeros((3, 40), dtype=np.int32)
+        completed[0, -30:] = 3
+        completed[1, -30:] = 10
+        completed[2, -1] = 1
+        completed[2, 0] = 50  # outside the window
+
+        assert productivity_scores(completed).tolist() == [60.0, 100.0, 0.7]
+
+    def test_streaks(self):
+        """Current runs end on the last day, longest runs anywhere"""
+        active = np.array([
+            [1, 1, 0, 1, 1, 1],
+            [0, 0, 0, 0, 0, 0],
+            [1, 1, 1, 1, 1, 1],
+            [1, 0, 1, 1, 0, 0],
+        ], dtype=bool)
+
+        current, longest = streaks(active)
+
+        assert current.tolist() == [3, 0, 6, 0]
+        assert longest.tolist() == [3, 0, 6, 2]
+
+    def test_week_over_week(self):
+        """Changes are relative to the previous week and NaN without one"""
+        completed = np.zeros((2, 14), dtype=np.int32)
+        completed[0, :7] = [1, 1, 0, 0, 0, 0, 0]
+        completed[0, 7:] = [0, 2, 0, 1, 0, 0, 1]
+        completed[1, 7:] = 1
+
+        this_week, last_week, change = week_over_week(completed)
+
+        assert this_week.tolist() == [4, 7]
+        assert last_week.tolist() == [2, 0]
+        assert change[0] == 1.0
+        assert math.isnan(change[1])
+
+    def test_cohort_counts(self):
+        """Users count from their signup week; earlier signups and later ones are left out"""
+        active = np.zeros((4, 14), dtype=bool)
+        active[0, [1, 9]] = True  # cohort 0, active both weeks
+        active[1, [2, 8]] = True  # cohort 1, week 0 precedes the signup
+        active[2, :] = True       # signed up before the window
+        active[3, :] = True       # unknown signup
+
+        sizes, counts = cohort_counts(active, np.array([0, 7, -3, -1]), 2)
+
+        assert sizes.tolist() == [1, 1]
+        assert counts.tolist() == [[1, 1], [1, 0]]
+
+
+class TestLoadActivity:
+    @pytest.mark.asyncio
+    async def test_one_scan_fills_rows_in_user_ids_order(self):
+        """Rows keep the given order, whatever the ids sort as, and the window is read with one query"""
+        database = FakeDatabase()
+        database["task_rollups"] = FakeCollection([
+            rollup("9", 0, 1), rollup("10", 2, 3, events=5), rollup("2", 6, 2),
+            rollup("10", 7, 4),  # past the window
+            rollup("7", 1, 9),   # a user without metrics
+            {**rollup("9", 1, 8), "project_id": 3},  # a project rollup
+        ])
+
+        activity = await load_activity(database, ["10", "9", "2"], START, 7)
+        completed, events = activity_matrices(activity, 0, 3, 7)
+
+        assert completed.tolist() == [[0, 0, 3, 0, 0, 0, 0], [1, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 2]]
+        assert events[0].tolist() == [0, 0, 5, 0, 0, 0, 0]
+        query, = database["task_rollups"].queries
+        assert "user_id" not in query
+        assert query["granularity"] == "day"
+
+    @pytest.mark.asyncio
+    async def test_chunks_slice_the_scanned_rows(self):
+        """A chunk's matrices hold only its own rows, renumbered from zero"""
+        database = FakeDatabase()
+        database["task_rollups"] = FakeCollection([rollup("3", 2, 4), rollup("1", 0, 1), rollup("2", 1, 2)])
+
+        activity = await load_activity(database, ["1", "2", "3"], START, 3)
+        completed, _ = activity_matrices(activity, 1, 3, 3)
+
+        assert completed.tolist() == [[0, 2, 0], [0, 0, 4]]
+
+    @pytest.mark.asyncio
+    async def test_users_without_rollups(self):
+        """Users with no activity get rows of zeros"""
+        activity = await load_activity(FakeDatabase(), ["1", "2"], START, 3)
+        completed, events = activity_matrices(activity, 0, 2, 3)
+
+        assert completed.shape == events.shape == (2, 3)
+        assert not completed.any()
+
+
+class TestRunBatchAnalytics:
+    @pytest.mark.asyncio
+    async def test_writes_user_productivity_and_cohorts(self):
+        """Two weeks up to the day watermark: per-user statistics and the signup cohort's retention"""
+        database = FakeDatabase()
+        database["rollup_watermarks"] = FakeCollection([{"_id": "day", "compacted_until": START + timedelta(days=14)}])
+        database["user_metrics"] = FakeCollection([
+            {"user_id": "1", "created_at": START},
+            {"user_id": "2", "created_at": START - timedelta(days=45)},
+        ])
+        database["task_rollups"] = FakeCollection(
+            [rollup("1", day, 1) for day in range(7, 14)] + [rollup("2", 1, 2)]
+        )
+
+        result = await run_batch_analytics(database, days=14, chunk_size=1)
+
+        assert result == {"users": 2, "cohorts": 1}
+        written = {operation._filter["user_id"]: operation._doc["$set"]
+                   for operation in database["user_productivity"].operations}
+        assert {field: written["1"][field] for field in (
+            "productivity_score", "current_streak_days", "longest_streak_days",
+            "completions_this_week", "completions_last_week", "week_over_week_change", "as_of"
+        )} == {
+            "productivity_score": 4.7, "current_streak_days": 7, "longest_streak_days": 7,
+            "completions_this_week": 7, "completions_last_week": 0, "week_over_week_change": None,
+            "as_of": "2024-01-28"
+        }
+        assert written["2"]["productivity_score"] == 1.3
+        assert (written["2"]["current_streak_days"], written["2"]["longest_streak_days"]) == (0, 1)
+        assert written["2"]["week_over_week_change"] == -1.0
+
+        cohort, = database["cohort_retention"].operations
+        assert cohort._filter == {"_id": START}
+        assert cohort._doc["$set"]["size"] == 1
+        assert cohort._doc["$set"]["retention"] == [0.0, 1.0]
+
+    @pytest.mark.asyncio
+    async def test_skips_without_day_watermark(self):
+        """Nothing runs before daily rollups have been compacted"""
+        database = FakeDatabase()
+
+        assert await run_batch_analytics(database) == {"users": 0, "cohorts": 0}
+        assert database["user_metrics"].queries == []
@@ -1,19 +1,33 @@
 package events
 
 import (
+	"crypto/rand"
 	"encoding/json"
 	"fmt"
 	"log/slog"
 	"os"
+	"strconv"
+	"strings"
 	"time"
 
 	"github.com/IBM/sarama"
 )
 
-// Producer handles Kafka event publishing
+// SchemaVersion is sent in the schema_version header of every event
+const SchemaVersion = "1"
+
+// Producer handles Kafka event publishing.
+//
+// Messages are keyed by user_id and partitioned by key hash, so all of a
+// user's events land on one partition in the order they were published.
+// With KAFKA_PRODUCER_MODE=async, publishing only queues the message and
+// batches are sent every KAFKA_LINGER_MS or once KAFKA_BATCH_SIZE messages
+// or KAFKA_BATCH_BYTES are buffered; delivery errors are logged.
 type Producer struct {
-	producer sarama.SyncProducer
-	topic    string
+	sync  sarama.SyncProducer
+	async sarama.AsyncProducer
+	done  chan struct{}
+	topic string
 }
 
 // TaskEvent represents a task-related event
@@ -40,35 +54,51 @@ type ProjectEvent struct {
 
 // NewProducer creates a new Kafka producer
 func NewProducer() (*Producer, error) {
-	brokerURL := os.Getenv("KAFKA_BROKER")
-	if brokerURL == "" {
-		brokerURL = "kafka:9092"
+	brokerURL := envOr("KAFKA_BROKER", "kafka:9092")
+	topic := envOr("KAFKA_TOPIC", "task-events")
+	mode := envOr("KAFKA_PRODUCER_MODE", "sync")
+	if mode != "sync" && mode != "async" {
+		return nil, fmt.Errorf("invalid KAFKA_PRODUCER_MODE %q (sync or async)", mode)
 	}
 
-	topic := os.Getenv("KAFKA_TOPIC")
-	if topic == "" {
-		topic = "task-events"
+	codec, err := compressionCodec(envOr("KAFKA_COMPRESSION", "none"))
+	if err != nil {
+		return nil, err
 	}
 
-	slog.Info("Creating Kafka producer", "broker", brokerURL, "topic", topic)
+	slog.Info("Creating Kafka producer", "broker", brokerURL, "topic", topic, "mode", mode, "compression", codec.String())
 
 	config := sarama.NewConfig()
 	config.Producer.RequiredAcks = sarama.WaitForAll
 	config.Producer.Retry.Max = 5
-	config.Producer.Return.Successes = true
-	config.Producer.Partitioner = sarama.NewRandomPartitioner
-
-	producer, err := sarama.NewSyncProducer([]string{brokerURL}, config)
+	config.Producer.Partitioner = sarama.NewHashPartitioner
+	config.Producer.Compression = codec
+	// Retries must not reorder a user's events within their partition
+	config.Producer.Idempotent = true
+	config.Net.MaxOpenRequests = 1
+
+	producer := &Producer{topic: topic}
+	if mode == "sync" {
+		config.Producer.Return.Successes = true
+		producer.sync, err = sarama.NewSyncProducer([]string{brokerURL}, config)
+	} else {
+		config.Producer.Flush.Frequency = time.Duration(envInt("KAFKA_LINGER_MS", 5)) * time.Millisecond
+		config.Producer.Flush.Messages = envInt("KAFKA_BATCH_SIZE", 500)
+		config.Producer.Flush.Bytes = envInt("KAFKA_BATCH_BYTES", 1<<20)
+		config.Producer.Return.Errors = true
+		producer.async, err = sarama.NewAsyncProducer([]string{brokerURL}, config)
+		if err == nil {
+			producer.done = make(chan struct{})
+			go producer.logErrors()
+		}
+	}
 	if err != nil {
 		return nil, fmt.Errorf("failed to create Kafka producer: %w", err)
 	}
 
 	slog.Info("Kafka producer created successfully")
 
-	return &Producer{
-		producer: producer,
-		topic:    topic,
-	}, nil
+	return producer, nil
 }
 
 // PublishTaskEvent publishes a task-related event
@@ -84,7 +114,7 @@ func (p *Producer) PublishTaskEvent(eventType string, taskID, projectID uint, ti
 		Timestamp: time.Now(),
 	}
 
-	return p.publishEvent(event)
+	return p.publishEvent(eventType, userID, event)
 }
 
 // PublishProjectEvent publishes a project-related event
@@ -98,11 +128,11 @@ func (p *Producer) PublishProjectEvent(eventType string, projectID uint, name, u
 		Timestamp: time.Now(),
 	}
 
-	return p.publishEvent(event)
+	return p.publishEvent(eventType, userID, event)
 }
 
-// publishEvent publishes an event to Kafka
-func (p *Producer) publishEvent(event interface{}) error {
+// publishEvent publishes an event to Kafka, keyed by the user it belongs to
+func (p *Producer) publishEvent(eventType, userID string, event interface{}) error {
 	eventBytes, err := json.Marshal(event)
 	if err != nil {
 		return fmt.Errorf("failed to marshal event: %w", err)
@@ -110,10 +140,21 @@ func (p *Producer) publishEvent(event interface{}) error {
 
 	message := &sarama.ProducerMessage{
 		Topic: p.topic,
+		Key:   sarama.StringEncoder(userID),
 		Value: sarama.StringEncoder(eventBytes),
+		Headers: []sarama.RecordHeader{
+			{Key: []byte("event_id"), Value: []byte(newEventID())},
+			{Key: []byte("event_type"), Value: []byte(eventType)},
+			{Key: []byte("schema_version"), Value: []byte(SchemaVersion)},
+		},
+	}
+
+	if p.async != nil {
+		p.async.Input() <- message
+		return nil
 	}
 
-	partition, offset, err := p.producer.SendMessage(message)
+	partition, offset, err := p.sync.SendMessage(message)
 	if err != nil {
 		slog.Error("Failed to publish event", "error", err, "event", string(eventBytes))
 		return fmt.Errorf("failed to publish event: %w", err)
@@ -123,14 +164,70 @@ func (p *Producer) publishEvent(event interface{}) error {
 	return nil
 }
 
-// Close closes the Kafka producer
+// logErrors logs messages the async producer failed to deliver, until it is closed
+func (p *Producer) logErrors() {
+	defer close(p.done)
+	for err := range p.async.Errors() {
+		value, _ := err.Msg.Value.Encode()
+		slog.Error("Failed to publish event", "error", err.Err, "event", string(value))
+	}
+}
+
+// Close closes the Kafka producer, flushing buffered messages first
 func (p *Producer) Close() error {
-	if p.producer != nil {
-		return p.producer.Close()
+	if p.async != nil {
+		p.async.AsyncClose()
+		<-p.done
+		return nil
+	}
+	if p.sync != nil {
+		return p.sync.Close()
 	}
 	return nil
 }
 
+// newEventID returns a random (version 4) UUID identifying one published event
+func newEventID() string {
+	var b [16]byte
+	if _, err := rand.Read(b[:]); err != nil {
+		return strconv.FormatInt(time.Now().UnixNano(), 16)
+	}
+	b[6] = (b[6] & 0x0f) | 0x40
+	b[8] = (b[8] & 0x3f) | 0x80
+	return fmt.Sprintf("%x-%x-%x-%x-%x", b[0:4], b[4:6], b[6:8], b[8:10], b[10:])
+}
+
+func compressionCodec(name string) (sarama.CompressionCodec, error) {
+	switch strings.ToLower(name) {
+	case "none", "":
+		return sarama.CompressionNone, nil
+	case "gzip":
+		return sarama.CompressionGZIP, nil
+	case "snappy":
+		return sarama.CompressionSnappy, nil
+	case "lz4":
+		return sarama.CompressionLZ4, nil
+	case "zstd":
+		return sarama.CompressionZSTD, nil
+	}
+	return sarama.CompressionNone, fmt.Errorf("invalid KAFKA_COMPRESSION %q (none, gzip, snappy, lz4 or zstd)", name)
+}
+
+func envOr(key, fallback string) string {
+	if value := os.Getenv(key); value != "" {
+		return value
+	}
+	return fallback
+}
+
+func envInt(key string, fallback int) int {
+	value, err := strconv.Atoi(os.Getenv(key))
+	if err != nil {
+		return fallback
+	}
+	return value
+}
+
 // Event type constants
 const (
 	EventTaskCreated   = "task_created"